@@ -1,4 +1,4 @@
 # Copyright 2014 Davide Corio <davide.corio@abstract.it>
 # Copyright 2015-2016 Lorenzo Battistini - Agile Business Group
 
-from . import bindings, controllers, models
+from . import bindings, controllers, models, wizard
@@ -37,6 +37,7 @@
         'views/partner_view.xml',
         'views/invoice_view.xml',
         'views/related_document_type_views.xml',
+        'wizard/wizard_validate_xml_view.xml',
         'security/ir.model.access.csv',
     ],
     "demo": ['demo/account_invoice_fatturapa.xml'],
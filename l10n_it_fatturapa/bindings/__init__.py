@@ -6,8 +6,16 @@ try:
     import pyxb
 except ImportError as e:
     _logger.warning(e)
-else:
+
+
+def get_binding_module():
+    """Import the FatturaPA binding module on first use.
+
+    It loads the whole pyxb binding, so it is not imported
+    at server start but only when an e-invoice is parsed or built."""
     try:
-        from . import fatturapa  # noqa: F401
+        from . import fatturapa
     except pyxb.PyXBVersionError as e:
         _logger.warning('{}: {}'.format(e.__class__.__name__, e))
+        raise
+    return fatturapa
@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict
+
+
+class ParsedXMLCache(object):
+    """Least recently used cache of the objects parsed from e-invoices.
+
+    Keys start with the checksum of the XML file. The size of each entry
+    is the estimated memory taken by its objects, given by the caller:
+    the cache is bounded by their total. Cached objects are shared, they
+    must not be changed."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size, max_size):
+        with self._lock:
+            self._pop(key)
+            if size > max_size:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > max_size:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def invalidate(self, checksum):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == checksum]:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+parsed_xml_cache = ParsedXMLCache()
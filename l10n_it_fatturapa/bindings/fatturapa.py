@@ -1,6 +1,12 @@
+import hashlib
+import json
 import logging
+import os
+import threading
+from datetime import date
 
 from lxml import etree
+from lxml import sax
 
 from odoo.modules.module import get_module_resource
 
@@ -11,21 +17,29 @@ _logger.setLevel(logging.DEBUG)
 
 try:
     import pyxb.binding
+    import pyxb.binding.saxer
     from pyxb import SimpleFacetValueError
+    from pyxb.binding.basis import complexTypeDefinition, simpleTypeDefinition
 except (ImportError) as err:
     _logger.debug(err)
 
 
 XSD_SCHEMA = 'Schema_del_file_xml_FatturaPA_versione_1.2.1.xsd'
-
-_xsd_schema = get_module_resource('l10n_it_fatturapa', 'bindings', 'xsd', XSD_SCHEMA)
-_root = etree.parse(_xsd_schema)
+# Local copy of the schema imported by XSD_SCHEMA from www.w3.org
+XMLDSIG_SCHEMA = 'xmldsig-core-schema.xsd'
+XS_NAMESPACE = 'http://www.w3.org/2001/XMLSchema'
+# date/datetime element map generated from XSD_SCHEMA by write_types_map()
+TYPES_MAP = 'fatturapa_types.json'
 
 _CreateFromDocument = CreateFromDocument  # noqa: F405
 
 date_types = {}
 datetime_types = {}
 
+_xml_schema = None
+# lxml keeps the errors of the last validation in the schema object
+_xml_schema_lock = threading.RLock()
+
 
 def get_parent_element(e):
     for ancestor in e.iterancestors():
@@ -51,114 +65,276 @@ def collect_element(target, element, parent=None):
         )
 
 
-def collect_elements_by_type_query(target, query):
-    for element in _root.xpath(query):
+def collect_elements_by_type_query(root, target, query):
+    for element in root.xpath(query):
         parent_type = get_parent_element(element)
-        for parent in _root.xpath(get_type_query(parent_type)):
+        for parent in root.xpath(get_type_query(parent_type)):
             collect_element(target, element, parent)
 
 
-def collect_elements_by_type(target, element_type):
-    collect_elements_by_type_query(target, get_type_query(element_type))
+def collect_elements_by_type(root, target, element_type):
+    collect_elements_by_type_query(root, target, get_type_query(element_type))
 
 
-def collect_types():
+def collect_types(root=None, date_target=None, datetime_target=None):
+    if root is None:
+        root = etree.parse(get_xsd_path())
+    if date_target is None:
+        date_target = date_types
+    if datetime_target is None:
+        datetime_target = datetime_types
     # simpleType, we look at the base of restriction
-    for element_type in _root.findall('//{*}simpleType'):
+    for element_type in root.findall('//{*}simpleType'):
         base = element_type.find('{*}restriction').attrib['base']
 
         if base == 'xs:date':
-            collect_elements_by_type(date_types, element_type)
+            collect_elements_by_type(root, date_target, element_type)
         elif base == 'xs:dateTime':
-            collect_elements_by_type(datetime_types, element_type)
+            collect_elements_by_type(root, datetime_target, element_type)
 
     # complexType containing xs:date children
-    collect_elements_by_type_query(date_types, "//*[@type='xs:date']")
+    collect_elements_by_type_query(
+        root, date_target, "//*[@type='xs:date']")
 
     # complexType containing xs:dateTime children
-    collect_elements_by_type_query(datetime_types, "//*[@type='xs:dateTime']")
+    collect_elements_by_type_query(
+        root, datetime_target, "//*[@type='xs:dateTime']")
+
+
+def get_xsd_path():
+    return get_module_resource(
+        'l10n_it_fatturapa', 'bindings', 'xsd', XSD_SCHEMA)
+
+
+def get_xsd_digest():
+    with open(get_xsd_path(), 'rb') as xsd_file:
+        return hashlib.sha1(xsd_file.read()).hexdigest()
+
+
+def get_xml_schema():
+    """Return XSD_SCHEMA compiled by lxml, compiling it the first time"""
+    global _xml_schema
+    with _xml_schema_lock:
+        if _xml_schema is None:
+            xsd = etree.parse(get_xsd_path())
+            xmldsig_path = get_module_resource(
+                'l10n_it_fatturapa', 'bindings', 'xsd', XMLDSIG_SCHEMA)
+            for xsd_import in xsd.getroot().iterfind(
+                    '{%s}import' % XS_NAMESPACE):
+                xsd_import.set('schemaLocation', xmldsig_path)
+            _xml_schema = etree.XMLSchema(xsd)
+    return _xml_schema
+
+
+def get_validation_errors(xml_root):
+    """Validate the document against XSD_SCHEMA,
+    return the list of lxml error log entries, empty if it is valid"""
+    schema = get_xml_schema()
+    with _xml_schema_lock:
+        if schema.validate(xml_root):
+            return []
+        return list(schema.error_log)
+
+
+def write_types_map(path=None):
+    """Generate TYPES_MAP from XSD_SCHEMA.
+
+    Run it again whenever the XSD is updated, see README.md."""
+    if path is None:
+        path = os.path.join(os.path.dirname(get_xsd_path()), TYPES_MAP)
+    new_date_types = {}
+    new_datetime_types = {}
+    collect_types(
+        date_target=new_date_types, datetime_target=new_datetime_types)
+    with open(path, 'w') as types_map:
+        json.dump({
+            'xsd_sha1': get_xsd_digest(),
+            'date_types': new_date_types,
+            'datetime_types': new_datetime_types,
+        }, types_map, indent=4, sort_keys=True)
+        types_map.write('\n')
+    return path
+
+
+def load_types():
+    """Fill date_types and datetime_types from TYPES_MAP.
+
+    The XSD is only parsed when the generated map is missing
+    or does not match the shipped XSD.
+    New dicts are built and then swapped in, so that a tree being
+    sanitized by another thread never sees them half filled."""
+    global date_types, datetime_types
+    types_map_path = get_module_resource(
+        'l10n_it_fatturapa', 'bindings', 'xsd', TYPES_MAP)
+    types_map = {}
+    if types_map_path:
+        with open(types_map_path) as types_map_file:
+            types_map = json.load(types_map_file)
+    new_date_types = {}
+    new_datetime_types = {}
+    if types_map.get('xsd_sha1') == get_xsd_digest():
+        new_date_types.update(types_map['date_types'])
+        new_datetime_types.update(types_map['datetime_types'])
+    else:
+        _logger.warning(
+            '%s is missing or outdated, collecting types from %s',
+            TYPES_MAP, XSD_SCHEMA)
+        collect_types(
+            date_target=new_date_types, datetime_target=new_datetime_types)
+    date_types, datetime_types = new_date_types, new_datetime_types
 
 
-def remove_invalid_date(xml_root, problems):
+def remove_invalid_date(element, mandatory, tree, problems):
     # remove bogus dates accepted by ADE but not by python
-    tree = etree.ElementTree(xml_root)
+    try:
+        pyxb.binding.datatypes.dateTime(element.text)
+    except OverflowError as e:
+        element_path = tree.getpath(element)
+        if mandatory:
+            _logger.error(
+                'element %s is invalid but is mandatory: '
+                '%s' % (element_path, element.text)
+            )
+        else:
+            msg = 'removed invalid dateTime element {}: {} ({})'.format(
+                element_path,
+                element.text,
+                e,
+            )
+            problems['invalid_date'].append(msg)
+            _logger.warn(msg)
+            return True
+    return False
+
 
-    for path, mandatory in datetime_types.items():
-        for element in xml_root.xpath(path):
-            try:
-                pyxb.binding.datatypes.dateTime(element.text)
-            except OverflowError as e:
-                element_path = tree.getpath(element)
-                if mandatory:
-                    _logger.error(
-                        'element %s is invalid but is mandatory: '
-                        '%s' % (element_path, element.text)
-                    )
-                else:
-                    element.getparent().remove(element)
-                    msg = 'removed invalid dateTime element {}: {} ({})'.format(
-                        element_path,
-                        element.text,
-                        e,
-                    )
-                    problems.append(msg)
-                    _logger.warn(msg)
-
-    return xml_root, problems
-
-
-def remove_timezone(xml_root, problems):
+def remove_timezone(element, mandatory, tree, problems):
     # remove timezone from type `xs:date` if any or
     # pyxb will fail to compare with
-
-    tree = etree.ElementTree(xml_root)
-
-    for path in date_types:
-        for element in xml_root.xpath(path):
-            result = pyxb.binding.datatypes.date(element.text.strip())
-            if result.tzinfo is not None:
-                result = result.replace(tzinfo=None)
-                element.text = result.XsdLiteral(result)
-                msg = (
-                    'removed timezone information from date only element '
-                    '%s: %s' % (tree.getpath(element), element.text)
-                )
-                problems.append(msg)
-                _logger.warn(msg)
-
-    return xml_root, problems
+    result = pyxb.binding.datatypes.date(element.text.strip())
+    if result.tzinfo is not None:
+        result = result.replace(tzinfo=None)
+        element.text = result.XsdLiteral(result)
+        msg = (
+            'removed timezone information from date only element '
+            '%s: %s' % (tree.getpath(element), element.text)
+        )
+        problems['timezone'].append(msg)
+        _logger.warn(msg)
+    return False
 
 
-def fix_trailing_spaces(xml_root, problems):
+def fix_trailing_spaces(element, mandatory, tree, problems):
     # fix trailing spaces in <PECDestinatario/> and <Email/>
-    for pec in xml_root.xpath("//PECDestinatario"):
-        pec.text = pec.text.strip()
+    element.text = element.text.strip()
+    return False
 
-    return xml_root, problems
 
+def take_valid_email(element, mandatory, tree, problems):
+    email_cleaned = element.text.strip()
+    try:
+        EmailType(email_cleaned)  # noqa: F405
+        element.text = email_cleaned
+    except SimpleFacetValueError:
+        msg = f'Invalid email: {email_cleaned}'
+        problems['email'].append(msg)
+        _logger.warn(msg)
+        return True
+    return False
+
+
+# Problems are reported grouped by kind, in this order
+SANITIZE_PROBLEM_KINDS = ('timezone', 'invalid_date', 'email')
+
+# Elements fixed whatever their parent is
+SANITIZE_TAG_FIXERS = {
+    'PECDestinatario': fix_trailing_spaces,
+    'Email': take_valid_email,
+}
+
+_sanitize_dispatch = None
+# Guards the first load of the types and of _sanitize_dispatch
+_sanitize_lock = threading.Lock()
+
+
+def compile_sanitizer():
+    """Compile the `//Parent/Child` paths of date_types and datetime_types
+    into a {(parent tag, child tag): [(fixer, mandatory)]} table"""
+    global _sanitize_dispatch
+    dispatch = {}
+    for types, fixer in (
+        (date_types, remove_timezone),
+        (datetime_types, remove_invalid_date),
+    ):
+        for path, mandatory in types.items():
+            parent_tag, tag = path.lstrip('/').split('/')
+            dispatch.setdefault((parent_tag, tag), []).append(
+                (fixer, mandatory))
+    _sanitize_dispatch = dispatch
+    return dispatch
+
+
+def get_sanitize_dispatch():
+    """Return the table of compile_sanitizer, loading the types
+    the first time"""
+    dispatch = _sanitize_dispatch
+    if dispatch is None:
+        with _sanitize_lock:
+            dispatch = _sanitize_dispatch
+            if dispatch is None:
+                load_types()
+                dispatch = compile_sanitizer()
+    return dispatch
 
-def take_valid_email(xml_root, problems):
-    for email in xml_root.xpath("//Email"):
-        email_cleaned = email.text.strip()
-        try:
-            EmailType(email_cleaned)  # noqa: F405
-            email.text = email_cleaned
-        except SimpleFacetValueError:
-            msg = f'Invalid email: {email_cleaned}'
-            problems.append(msg)
-            _logger.warn(msg)
-            email.getparent().remove(email)
 
-    return xml_root, problems
+def sanitize(xml_root):
+    """Fix dates, datetimes, PEC addresses and emails
+    in a single walk of the tree"""
+    sanitize_dispatch = get_sanitize_dispatch()
+    problems = {kind: [] for kind in SANITIZE_PROBLEM_KINDS}
+    tree = etree.ElementTree(xml_root)
+    to_remove = []
+    for event, element in etree.iterwalk(xml_root, events=('end',)):
+        tag = element.tag
+        parent = element.getparent()
+        fixers = []
+        if parent is not None:
+            fixers = sanitize_dispatch.get((parent.tag, tag), [])
+        if tag in SANITIZE_TAG_FIXERS:
+            fixers = fixers + [(SANITIZE_TAG_FIXERS[tag], False)]
+        for fixer, mandatory in fixers:
+            if fixer(element, mandatory, tree, problems):
+                to_remove.append(element)
+                break
+    # the tree cannot be changed while walking it
+    for element in to_remove:
+        element.getparent().remove(element)
+    return xml_root, [
+        msg for kind in SANITIZE_PROBLEM_KINDS for msg in problems[kind]]
+
+
+def _CreateFromTree(xml_root):
+    # Feed pyxb's SAX handler straight from the lxml tree:
+    # the document is not serialized and parsed again
+    saxer = pyxb.binding.saxer.make_parser(
+        fallback_namespace=Namespace.fallbackNamespace())  # noqa: F405
+    handler = saxer.getContentHandler()
+    sax.saxify(xml_root, handler)
+    return handler.rootObject()
+
+
+def CreateFromSanitizedTree(xml_root, problems):
+    """Build the binding object from a tree returned by sanitize,
+    with the problems found by it"""
+    fatturapa = _CreateFromTree(xml_root)
+    fatturapa._xmldoctor = problems
+    return fatturapa
 
 
-def sanitize(xml_root):
-    problems = []
-    xml_root, problems = remove_timezone(xml_root, problems)
-    xml_root, problems = remove_invalid_date(xml_root, problems)
-    xml_root, problems = fix_trailing_spaces(xml_root, problems)
-    xml_root, problems = take_valid_email(xml_root, problems)
-    return xml_root, problems
+def CreateFromTree(xml_root):
+    """Build the binding object from an already parsed lxml tree.
+
+    The tree is sanitized in place."""
+    return CreateFromSanitizedTree(*sanitize(xml_root))
 
 
 def CreateFromDocument(xml_string):
@@ -168,11 +344,111 @@ def CreateFromDocument(xml_string):
         _logger.warn('lxml was unable to parse xml: %s' % e)
         return _CreateFromDocument(xml_string)
 
-    root, problems = sanitize(root)
-
-    fatturapa = _CreateFromDocument(etree.tostring(root))
-    fatturapa._xmldoctor = problems
-    return fatturapa
-
-
-collect_types()
+    return CreateFromTree(root)
+
+
+def value_as_text(value):
+    """Text of a simple value, the same written by FatturapaBDS"""
+    if isinstance(value, pyxb.binding.datatypes.decimal) \
+            and hasattr(value, '_CF_pattern'):
+        return str(value)
+    if isinstance(value, (DataFatturaType, date)):  # noqa: F405
+        value = value.date()
+    if isinstance(value, simpleTypeDefinition):
+        return value.xsdLiteral()
+    return str(value)
+
+
+def _quote_text(element):
+    # minidom, used by pyxb's toxml, escapes double quotes in text too:
+    # write them as entity references to produce the same bytes
+    parts = element.text.split('"')
+    element.text = parts[0]
+    for part in parts[1:]:
+        quot = etree.Entity('quot')
+        quot.tail = part
+        element.append(quot)
+
+
+def _tag(expanded_name):
+    if expanded_name.namespaceURI():
+        return '{%s}%s' % (
+            expanded_name.namespaceURI(), expanded_name.localName())
+    return expanded_name.localName()
+
+
+def _fill_element(element, binding):
+    if binding._ContentTypeTag == binding._CT_SIMPLE:
+        element.text = value_as_text(binding.value())
+        return
+    # _ElementMap follows the order of the elements in the XSD sequences
+    for element_use in binding._ElementMap.values():
+        value = element_use.value(binding)
+        if value is None:
+            continue
+        for item in value if element_use.isPlural() else [value]:
+            child = etree.SubElement(element, _tag(element_use.name()))
+            if isinstance(item, complexTypeDefinition):
+                _fill_element(child, item)
+            else:
+                child.text = value_as_text(item)
+
+
+def _binding_attributes(binding):
+    attributes = []
+    for attribute_use in binding._AttributeMap.values():
+        value = attribute_use.value(binding)
+        if value is not None:
+            attributes.append(
+                (attribute_use.name().localName(), value_as_text(value)))
+    return attributes
+
+
+def CreateTreeFromBinding(fatturapa):
+    """Build the lxml tree of a FatturaElettronica binding object,
+    without going through pyxb's DOM and content model.
+
+    The tree is validated against XSD_SCHEMA,
+    etree.DocumentInvalid is raised if it is not valid."""
+    root_name = fatturapa._element().name()
+    root = etree.Element(
+        _tag(root_name), attrib=dict(_binding_attributes(fatturapa)),
+        nsmap={'ns1': root_name.namespaceURI()})
+    _fill_element(root, fatturapa)
+    schema = get_xml_schema()
+    with _xml_schema_lock:
+        schema.assertValid(root)
+    return root
+
+
+def _escape_attribute(value):
+    return value.replace('&', '&amp;').replace('<', '&lt;') \
+        .replace('"', '&quot;').replace('>', '&gt;')
+
+
+def CreateXMLFromBinding(fatturapa):
+    """Serialize a FatturaElettronica binding object with lxml.
+
+    The result is the same of
+    fatturapa.toxml(encoding='UTF-8', bds=FatturapaBDS())
+    but it is much faster for documents with many lines."""
+    root = CreateTreeFromBinding(fatturapa)
+    root_name = fatturapa._element().name()
+    # lxml would declare the namespace of the root in every child
+    # serialized on its own: move them to an element without namespaces
+    children = etree.Element('children')
+    children.extend(root)
+    for element in children.xpath('.//*[contains(text(), \'"\')]'):
+        _quote_text(element)
+    # lxml writes namespace declarations before the attributes,
+    # so the root tag is written as minidom does
+    start_tag = '<ns1:%s%s xmlns:ns1="%s">' % (
+        root_name.localName(),
+        ''.join(' %s="%s"' % (name, _escape_attribute(value))
+                for name, value in _binding_attributes(fatturapa)),
+        _escape_attribute(root_name.namespaceURI()))
+    return b''.join(
+        [b'<?xml version="1.0" encoding="UTF-8"?>',
+         start_tag.encode('UTF-8')] +
+        [etree.tostring(child, encoding='UTF-8') for child in children] +
+        [('</ns1:%s>' % root_name.localName()).encode('UTF-8')])
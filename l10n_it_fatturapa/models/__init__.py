@@ -1,3 +1,3 @@
 # Copyright 2014 Davide Corio <davide.corio@abstract.it>
 
-from . import account, company, ir_attachment, partner
+from . import account, company, ir_attachment, partner, preview
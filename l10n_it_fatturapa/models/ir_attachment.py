@@ -1,7 +1,8 @@
 import base64
 import binascii
+import copy
+import functools
 import logging
-import re
 from io import BytesIO
 
 import lxml.etree as ET
@@ -9,8 +10,12 @@ import lxml.etree as ET
 from odoo import api, fields, models
 from odoo.exceptions import UserError
 from odoo.modules import get_module_resource
+from odoo.tools import split_every
 from odoo.tools.translate import _
 
+from ..bindings import get_binding_module
+from ..bindings.cache import parsed_xml_cache
+
 _logger = logging.getLogger(__name__)
 
 try:
@@ -19,13 +24,60 @@ except (ImportError, IOError) as err:
     _logger.debug(err)
 
 
-re_base64 = re.compile(br'^([A-Za-z0-9+/]{4})*([A-Za-z0-9+/]{3}=|[A-Za-z0-9+/]{2}==)?$')
+# Default for the l10n_it_fatturapa.parsed_xml_cache_size parameter:
+# MB of memory taken by the parsed e-invoices kept by each process
+PARSED_XML_CACHE_SIZE = 64
+# Memory taken by the objects parsed from an e-invoice, compared to the
+# size of its XML. Measured on the test e-invoices: 4 for files with big
+# attachments, 9 to 13.5 for the others.
+PARSED_XML_SIZE_FACTOR = 14
+# Number of attachments whose XML is kept in memory by validate_fatturapa_xml
+XML_VALIDATION_CHUNK_SIZE = 500
+
+# Formats recognized by sniff_format
+XML_FORMAT = 'xml'
+CADES_FORMAT = 'cades'
+BASE64_FORMAT = 'base64'
+
+# Number of leading bytes inspected by sniff_format
+SNIFF_SIZE = 64
+WHITESPACE = frozenset(b' \t\r\n')
+BASE64_ALPHABET = frozenset(
+    b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=\r\n')
+UTF8_BOM = b'\xef\xbb\xbf'
+# DER encoding of the OID of CMS SignedData (1.2.840.113549.1.7.2),
+# the content type a CAdES file starts with
+SIGNED_DATA_OID = b'\x06\x09\x2a\x86\x48\x86\xf7\x0d\x01\x07\x02'
 
 
-def is_base64(s):
-    s = s or b""
-    s = s.replace(b"\r", b"").replace(b"\n", b"")
-    return re_base64.match(s)
+def sniff_format(data):
+    """Return the format of data looking at its leading bytes only:
+    XML_FORMAT, CADES_FORMAT, BASE64_FORMAT or None if it is unknown"""
+    view = memoryview(data)
+    start = 0
+    while start < len(view) and start < SNIFF_SIZE and view[start] in WHITESPACE:
+        start += 1
+    head = view[start:start + SNIFF_SIZE]
+    if not head:
+        return None
+    if head[0] == ord('<') or head[:len(UTF8_BOM)] == UTF8_BOM:
+        return XML_FORMAT
+    # ContentInfo is a DER SEQUENCE: tag, length, then the content type
+    if head[0] == 0x30 and len(head) > 1:
+        length_size = head[1] & 0x7f if head[1] > 0x80 else 0
+        oid_start = 2 + length_size
+        if head[oid_start:oid_start + len(SIGNED_DATA_OID)] == SIGNED_DATA_OID:
+            return CADES_FORMAT
+    if all(byte in BASE64_ALPHABET for byte in head):
+        return BASE64_FORMAT
+    return None
+
+
+@functools.lru_cache(maxsize=8)
+def get_preview_transform(style):
+    """XSLT of the preview style, compiled once per process"""
+    xsl_path = get_module_resource('l10n_it_fatturapa', 'data', style)
+    return ET.XSLT(ET.parse(xsl_path))
 
 
 class Attachment(models.Model):
@@ -40,7 +92,8 @@ class Attachment(models.Model):
         for att in self:
             att.ftpa_preview_link = '/fatturapa/preview/%s' % att.id
 
-    def remove_xades_sign(self, xml):
+    @staticmethod
+    def parse_xml(xml):
         # Recovering parser is needed for files where strings like
         # xmlns:ds="http://www.w3.org/2000/09/xmldsig#&quot;"
         # are present: even if lxml raises
@@ -48,71 +101,255 @@ class Attachment(models.Model):
         # 'http://www.w3.org/2000/09/xmldsig#"' is not a valid URI
         # such files are accepted by SDI
         recovering_parser = ET.XMLParser(recover=True)
-        root = ET.XML(xml, parser=recovering_parser)
+        return ET.XML(xml, parser=recovering_parser)
+
+    @staticmethod
+    def remove_xades_sign_element(root):
         for elem in root.iter('*'):
             if elem.tag.find('Signature') > -1:
                 elem.getparent().remove(elem)
                 break
+        return root
+
+    def remove_xades_sign(self, xml):
+        root = self.remove_xades_sign_element(self.parse_xml(xml))
         return ET.tostring(root)
 
     def strip_xml_content(self, xml):
-        recovering_parser = ET.XMLParser(recover=True)
-        root = ET.XML(xml, parser=recovering_parser)
-        return ET.tostring(root)
+        return ET.tostring(self.parse_xml(xml))
 
     @staticmethod
     def extract_cades(data):
         info = cms.ContentInfo.load(data)
         return info['content']['encap_content_info']['content'].native
 
+    def cleanup_xml_tree(self, xml_string):
+        """Parse the XML once and strip the XAdES signature in place"""
+        return self.remove_xades_sign_element(self.parse_xml(xml_string))
+
     def cleanup_xml(self, xml_string):
-        xml_string = self.remove_xades_sign(xml_string)
-        xml_string = self.strip_xml_content(xml_string)
-        return xml_string
+        return ET.tostring(self.cleanup_xml_tree(xml_string))
 
-    def get_xml_string(self):
+    # Elements not needed to summarize an e-invoice (supplier, bodies,
+    # totals and dates): they are dropped while the file is parsed.
+    # Only the first of the SUMMARY_TRIMMED_TAGS siblings is kept,
+    # because the schema requires at least one.
+    SUMMARY_SKIPPED_TAGS = ('Allegati', 'DatiPagamento', 'Signature')
+    SUMMARY_TRIMMED_TAGS = ('DettaglioLinee', 'DatiRiepilogo')
+
+    @classmethod
+    def parse_xml_summary(cls, xml):
+        """Parse the XML dropping invoice lines, attachments, payments
+        and the XAdES signature as soon as each of them is read,
+        so that they are never kept in memory all together"""
+        # recover=True for the same reason as in parse_xml
+        events = ET.iterparse(BytesIO(xml), events=('end', ), recover=True)
+        for event, element in events:
+            tag = element.tag.rpartition('}')[2]
+            if tag in cls.SUMMARY_SKIPPED_TAGS:
+                element.getparent().remove(element)
+            elif tag in cls.SUMMARY_TRIMMED_TAGS:
+                previous = element.getprevious()
+                if previous is not None and previous.tag == element.tag:
+                    element.getparent().remove(element)
+        return events.root
+
+    @staticmethod
+    def iterparse_xml_bodies(xml):
+        """Yield one document for each FatturaElettronicaBody,
+        containing a copy of the header and that body only.
+
+        Each body is moved out of the parsed tree before being yielded,
+        so only one body at a time is kept in memory."""
+        # recover=True for the same reason as in parse_xml
+        events = ET.iterparse(BytesIO(xml), events=('end', ), recover=True)
+        root_with_header = None
+        for event, element in events:
+            tag = element.tag.rpartition('}')[2]
+            if tag == 'FatturaElettronicaHeader':
+                # Copy the root to keep its namespaces even if they are
+                # invalid; the parser may already have added the beginning
+                # of the first body to the root, it is removed from the copy
+                root_with_header = copy.deepcopy(element.getparent())
+                for child in list(root_with_header):
+                    if child.tag != element.tag:
+                        root_with_header.remove(child)
+            elif tag == 'FatturaElettronicaBody':
+                if root_with_header is None:
+                    body_root = ET.Element(element.getparent().tag)
+                else:
+                    body_root = copy.deepcopy(root_with_header)
+                body_root.append(element)
+                yield body_root
+
+    def get_xml_content(self):
+        """Return the XML bytes, decoded from base64 and CAdES if needed"""
         try:
             data = base64.b64decode(self.datas)
         except binascii.Error as e:
             raise UserError(_('Corrupted attachment %s.') % e.args)
 
-        if is_base64(data):
+        data_format = sniff_format(data)
+        if data_format == BASE64_FORMAT:
+            # Line breaks are discarded by b64decode
             try:
                 data = base64.b64decode(data)
             except binascii.Error as e:
                 raise UserError(_('Base64 encoded file %s.') % e.args)
+            data_format = sniff_format(data)
 
         # Amazon sends xml files without <?xml declaration,
-        # so they cannot be easily detected using a pattern.
-        # We first try to parse as asn1, if it fails we assume xml
+        # so anything that is not CAdES is parsed as XML
+        if data_format == CADES_FORMAT:
+            # asn1crypto parser will raise ValueError
+            # if the asn1 cannot be parsed
+            # KeyError is raised if one of the needed key is not
+            # in the asn1 structure (info->content->encap_content_info->content)
+            try:
+                data = self.extract_cades(data)
+            except (ValueError, KeyError):
+                pass
 
-        # asn1crypto parser will raise ValueError
-        # if the asn1 cannot be parsed
-        # KeyError is raised if one of the needed key is not
-        # in the asn1 structure (info->content->encap_content_info->content)
-        try:
-            data = self.extract_cades(data)
-        except (ValueError, KeyError):
-            pass
+        return data
 
+    def get_xml_tree(self):
         try:
-            return self.cleanup_xml(data)
-        # cleanup_xml calls root.iter(), but root is None if the parser fails
-        # Invalid xml 'NoneType' object has no attribute 'iter'
+            return self.cleanup_xml_tree(self.get_xml_content())
+        # cleanup_xml_tree calls root.iter(), but root is None if the parser
+        # fails: Invalid xml 'NoneType' object has no attribute 'iter'
         except AttributeError as e:
             raise UserError(_('Invalid xml %s.') % e.args)
 
-    def get_fattura_elettronica_preview(self):
-        xsl_path = get_module_resource(
-            'l10n_it_fatturapa',
-            'data',
-            self.env.user.company_id.fatturapa_preview_style,
-        )
-        xslt = ET.parse(xsl_path)
-        xml_string = self.get_xml_string()
-        xml_file = BytesIO(xml_string)
-        recovering_parser = ET.XMLParser(recover=True)
-        dom = ET.parse(xml_file, parser=recovering_parser)
-        transform = ET.XSLT(xslt)
+    def get_xml_summary_tree(self):
+        """Like get_xml_tree, without invoice lines and attachments,
+        see parse_xml_summary"""
+        try:
+            root = self.parse_xml_summary(self.get_xml_content())
+        except ET.XMLSyntaxError as e:
+            raise UserError(_('Invalid xml %s.') % e.args)
+        if root is None:
+            raise UserError(_('Invalid xml %s.') % self.name)
+        return root
+
+    def get_xml_body_trees(self):
+        """Like get_xml_tree, one document for each body,
+        see iterparse_xml_bodies"""
+        bodies_number = 0
+        try:
+            for body_root in self.iterparse_xml_bodies(
+                    self.get_xml_content()):
+                bodies_number += 1
+                yield body_root
+        except ET.XMLSyntaxError as e:
+            raise UserError(_('Invalid xml %s.') % e.args)
+        if not bodies_number:
+            raise UserError(_('Invalid xml %s.') % self.name)
+
+    def _get_parsed_xml(self, kind, parse):
+        """Return parse(self), cached by checksum in parsed_xml_cache
+        of this process, see get_fatturapa_obj"""
+        self.ensure_one()
+        if not self.checksum:
+            return parse(self)
+        key = (self.checksum, kind, get_binding_module().XSD_SCHEMA)
+        parsed = parsed_xml_cache.get(key)
+        if parsed is None:
+            parsed = parse(self)
+            max_size = int(self.env['ir.config_parameter'].sudo().get_param(
+                'l10n_it_fatturapa.parsed_xml_cache_size',
+                PARSED_XML_CACHE_SIZE))
+            parsed_xml_cache.put(
+                key, parsed, self.file_size * PARSED_XML_SIZE_FACTOR,
+                max_size * 1024 * 1024)
+        return parsed
+
+    def get_fatturapa_obj(self):
+        """Binding object of the e-invoice.
+
+        It is cached, so it must not be changed"""
+        return self._get_parsed_xml(
+            'invoice', lambda attachment: get_binding_module()
+            .CreateFromTree(attachment.get_xml_tree()))
+
+    def get_fatturapa_summary_obj(self):
+        """Like get_fatturapa_obj, built from get_xml_summary_tree"""
+        return self._get_parsed_xml(
+            'summary', lambda attachment: get_binding_module()
+            .CreateFromTree(attachment.get_xml_summary_tree()))
+
+    def get_xml_validation_errors(self):
+        """Validate the XML file against the XSD schema.
+
+        Unlike get_xml_tree, the file is parsed by a strict parser
+        and the XAdES signature is kept. Return a list of dicts
+        with keys line, column, path and message, empty if the file
+        is valid"""
+        self.ensure_one()
+        try:
+            root = ET.XML(self.get_xml_content())
+        except UserError as e:
+            return [{
+                'line': 0, 'column': 0, 'path': '',
+                'message': e.name,
+            }]
+        except ET.XMLSyntaxError as e:
+            line, column = e.position
+            return [{
+                'line': line, 'column': column, 'path': '',
+                'message': e.msg,
+            }]
+        return [{
+            'line': error.line, 'column': error.column, 'path': error.path,
+            'message': error.message,
+        } for error in get_binding_module().get_validation_errors(root)]
+
+    @api.multi
+    def validate_fatturapa_xml(self):
+        """Validate the XML files against the XSD schema,
+        see get_xml_validation_errors.
+
+        Return a dict mapping the id of each attachment
+        to its list of errors"""
+        errors = {}
+        # Read the files in chunks, so that the content of thousands
+        # of attachments is not kept in the cache all together
+        for ids in split_every(XML_VALIDATION_CHUNK_SIZE, self.ids):
+            attachments = self.browse(ids)
+            for attachment in attachments:
+                errors[attachment.id] = attachment.get_xml_validation_errors()
+            attachments.invalidate_cache(ids=list(ids))
+        return errors
+
+    @api.multi
+    def write(self, vals):
+        if 'datas' in vals:
+            for checksum in set(self.mapped('checksum')):
+                parsed_xml_cache.invalidate(checksum)
+        return super(Attachment, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        for checksum in set(self.mapped('checksum')):
+            parsed_xml_cache.invalidate(checksum)
+        return super(Attachment, self).unlink()
+
+    def get_xml_string(self):
+        return ET.tostring(self.get_xml_tree())
+
+    def get_fattura_elettronica_preview(self, style=None):
+        if style is None:
+            style = self.env.user.company_id.fatturapa_preview_style
+        transform = get_preview_transform(style)
+        dom = self.get_xml_tree()
         newdom = transform(dom)
         return ET.tostring(newdom, pretty_print=True)
+
+    def get_fattura_elettronica_preview_pdf(self):
+        """PDF of get_fattura_elettronica_preview, cached in fatturapa.preview"""
+        self.ensure_one()
+        self.check('read')
+        style = self.env.user.company_id.fatturapa_preview_style
+        if not self.checksum:
+            html = self.get_fattura_elettronica_preview(style)
+            return self.env['ir.actions.report']._run_wkhtmltopdf([html])
+        return self.env['fatturapa.preview'].sudo().get_pdf(self.sudo(), style)
@@ -0,0 +1,62 @@
+import base64
+
+from psycopg2 import IntegrityError
+
+from odoo import api, fields, models
+
+# Default for the l10n_it_fatturapa.preview_cache_size parameter
+PREVIEW_CACHE_SIZE = 500
+
+
+class FatturapaPreview(models.Model):
+    """PDF previews of e-invoices, cached by checksum of the XML file
+    and preview style. The least recently opened previews are deleted
+    when there are more than l10n_it_fatturapa.preview_cache_size"""
+    _name = 'fatturapa.preview'
+    _description = "E-invoice preview"
+    _order = 'last_access desc, id desc'
+
+    checksum = fields.Char(required=True, index=True, readonly=True)
+    style = fields.Char(required=True, readonly=True)
+    pdf = fields.Binary(attachment=True, readonly=True)
+    last_access = fields.Datetime(readonly=True)
+
+    _sql_constraints = [(
+        'checksum_style_uniq',
+        'unique(checksum, style)',
+        'The preview of a file with this style already exists!')]
+
+    @api.model
+    def get_pdf(self, attachment, style):
+        """PDF preview of the ir.attachment with the given style,
+        rendered only if it is not in the cache"""
+        preview = self.search([
+            ('checksum', '=', attachment.checksum),
+            ('style', '=', style),
+        ], limit=1)
+        if preview:
+            preview.last_access = fields.Datetime.now()
+            return base64.b64decode(preview.pdf)
+
+        html = attachment.get_fattura_elettronica_preview(style)
+        pdf = self.env['ir.actions.report']._run_wkhtmltopdf([html])
+        try:
+            # Another request may be rendering the same preview
+            with self.env.cr.savepoint():
+                self.create({
+                    'checksum': attachment.checksum,
+                    'style': style,
+                    'pdf': base64.b64encode(pdf),
+                    'last_access': fields.Datetime.now(),
+                })
+        except IntegrityError:
+            pass
+        else:
+            self._evict()
+        return pdf
+
+    @api.model
+    def _evict(self):
+        max_size = int(self.env['ir.config_parameter'].sudo().get_param(
+            'l10n_it_fatturapa.preview_cache_size', PREVIEW_CACHE_SIZE))
+        self.search([], offset=max_size).unlink()
@@ -0,0 +1 @@
+from . import wizard_validate_xml
@@ -0,0 +1,73 @@
+from odoo import api, fields, models
+
+
+class WizardValidateXMLLine(models.TransientModel):
+    _name = 'wizard.fatturapa.validate.xml.line'
+    _description = "E-invoice XML validation error"
+    _order = 'attachment_id, line, column'
+
+    wizard_id = fields.Many2one(
+        comodel_name='wizard.fatturapa.validate.xml',
+        ondelete='cascade',
+    )
+    attachment_id = fields.Many2one(
+        'ir.attachment',
+        string='File',
+        readonly=True,
+    )
+    line = fields.Integer(readonly=True)
+    column = fields.Integer(readonly=True)
+    path = fields.Char(readonly=True)
+    message = fields.Text(readonly=True)
+
+
+class WizardValidateXML(models.TransientModel):
+    _name = 'wizard.fatturapa.validate.xml'
+    _description = "Validate e-invoice XML files"
+
+    state = fields.Selection(
+        [('draft', 'Draft'), ('done', 'Done')],
+        default='draft',
+    )
+    files_number = fields.Integer("Files", readonly=True)
+    invalid_files_number = fields.Integer("Invalid files", readonly=True)
+    line_ids = fields.One2many(
+        comodel_name='wizard.fatturapa.validate.xml.line',
+        inverse_name='wizard_id',
+        string='Errors',
+        readonly=True,
+    )
+
+    @api.model
+    def _get_attachments(self):
+        """ir.attachment records of the selected e-invoice files"""
+        records = self.env[self.env.context['active_model']].browse(
+            self.env.context.get('active_ids', []))
+        if 'ir_attachment_id' in records._fields:
+            return records.mapped('ir_attachment_id')
+        return records
+
+    @api.multi
+    def validate(self):
+        self.ensure_one()
+        attachments = self._get_attachments()
+        errors = attachments.validate_fatturapa_xml()
+        line_vals = []
+        for attachment_id, attachment_errors in errors.items():
+            for error in attachment_errors:
+                error_vals = dict(error, attachment_id=attachment_id)
+                line_vals.append((0, 0, error_vals))
+        self.write({
+            'state': 'done',
+            'files_number': len(errors),
+            'invalid_files_number': len([e for e in errors.values() if e]),
+            'line_ids': line_vals,
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+            'context': self.env.context,
+        }
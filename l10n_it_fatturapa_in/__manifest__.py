@@ -7,7 +7,7 @@
 
 {
     'name': 'ITA - Fattura elettronica - Ricezione',
-    'version': '12.0.2.6.1_8',
+    'version': '12.0.2.7.0',
     "development_status": "Beta",
     'category': 'Localization/Italy',
     'summary': 'Ricezione fatture elettroniche',
@@ -29,6 +29,9 @@
         'views/company_view.xml',
         'security/ir.model.access.csv',
         'security/rules.xml',
+        'views/import_job_view.xml',
+        'views/import_profile_view.xml',
+        'data/ir_cron.xml',
     ],
     "installable": True
 }
@@ -0,0 +1,51 @@
+from openupgradelib import openupgrade
+
+from odoo import fields
+from odoo.tools import split_every
+
+
+def get_bill_fingerprint(bill, fingerprints):
+    """Fingerprint of the e-bill of the file registered as `bill`,
+    among the fingerprints of all the e-bills of the file"""
+    if len(fingerprints) == 1:
+        return fingerprints[0]
+    # supplier|document type|number|date|total
+    matching = [
+        fingerprint for fingerprint in fingerprints
+        if fingerprint.split('|')[2:4] == [
+            (bill.reference or '').strip(),
+            fields.Date.to_string(bill.date_invoice)]]
+    if len(matching) == 1:
+        return matching[0]
+    return False
+
+
+def fill_bills_fingerprint(env):
+    """Bills registered before the fingerprint was introduced
+    take it from their e-bill file"""
+    bills = env['account.invoice'].with_context(active_test=False).search([
+        ('fatturapa_attachment_in_id.e_invoice_fingerprint', '!=', False),
+        ('e_invoice_fingerprint', '=', False),
+    ])
+    values = []
+    for bill in bills:
+        fingerprint = get_bill_fingerprint(
+            bill,
+            bill.fatturapa_attachment_in_id.e_invoice_fingerprint.split('\n'))
+        if fingerprint:
+            values.append((bill.id, fingerprint))
+    for chunk in split_every(1000, values):
+        openupgrade.logged_query(
+            env.cr,
+            "UPDATE account_invoice AS ai "
+            "SET e_invoice_fingerprint = v.fingerprint "
+            "FROM (VALUES " + ", ".join(["%s"] * len(chunk)) + ") "
+            "AS v(id, fingerprint) WHERE ai.id = v.id",
+            chunk)
+
+
+@openupgrade.migrate()
+def migrate(env, version):
+    if not version:
+        return
+    fill_bills_fingerprint(env)
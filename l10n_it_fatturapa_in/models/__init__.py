@@ -3,3 +3,7 @@ from . import attachment
 from . import account
 from . import partner
 from . import company
+from . import decimal_precision
+from . import import_job
+from . import import_profile
+from . import users
@@ -44,6 +44,10 @@ class AccountInvoice(models.Model):
     e_invoice_received_date = fields.Date(
         string='E-Bill Received Date')
 
+    e_invoice_fingerprint = fields.Char(
+        string="E-invoice fingerprint", readonly=True, copy=False,
+        index=True)
+
     @api.multi
     @api.depends('invoice_line_ids.price_subtotal', 'tax_line_ids.amount',
                  'tax_line_ids.amount_rounding', 'currency_id', 'company_id',
@@ -183,7 +187,11 @@ class AccountInvoice(models.Model):
 
     @api.depends('type', 'state', 'fatturapa_attachment_in_id',
                  'amount_untaxed', 'amount_tax', 'amount_total',
-                 'reference', 'date_invoice')
+                 'reference', 'date_invoice',
+                 'e_invoice_amount_untaxed', 'e_invoice_amount_tax',
+                 'e_invoice_amount_total', 'e_invoice_reference',
+                 'e_invoice_date_invoice', 'ftpa_withholding_ids.amount',
+                 'withholding_tax', 'withholding_tax_amount')
     def _compute_e_invoice_validation_error(self):
         bills_to_check = self.filtered(
             lambda inv:
@@ -4,12 +4,36 @@ import base64
 import zipfile
 from io import BytesIO
 from odoo import fields, models, api, _
-from odoo.tools import format_date
+from odoo.tools import format_date, split_every
 from odoo.exceptions import ValidationError
 
 import logging
 _logger = logging.getLogger(__name__)
 
+RECOMPUTE_CHUNK_SIZE = 500
+
+
+def get_e_invoice_fingerprint(FatturaElettronicaHeader, FatturaElettronicaBody):
+    """Identify an e-bill by supplier, document type, number, date
+    and total, whatever the name of the file it has been received with"""
+    DatiAnagrafici = FatturaElettronicaHeader.CedentePrestatore.DatiAnagrafici
+    if DatiAnagrafici.IdFiscaleIVA:
+        supplier = '%s%s' % (
+            DatiAnagrafici.IdFiscaleIVA.IdPaese,
+            DatiAnagrafici.IdFiscaleIVA.IdCodice)
+    else:
+        supplier = DatiAnagrafici.CodiceFiscale or ''
+    DatiGeneraliDocumento = \
+        FatturaElettronicaBody.DatiGenerali.DatiGeneraliDocumento
+    total = DatiGeneraliDocumento.ImportoTotaleDocumento
+    return '|'.join([
+        supplier.upper(),
+        DatiGeneraliDocumento.TipoDocumento,
+        DatiGeneraliDocumento.Numero.strip(),
+        fields.Date.to_string(DatiGeneraliDocumento.Data.date()),
+        '%.2f' % float(total) if total is not None else '',
+    ])
+
 
 class FatturaPAAttachmentIn(models.Model):
     _name = "fatturapa.attachment.in"
@@ -41,14 +65,26 @@ class FatturaPAAttachmentIn(models.Model):
         string="Invoices date", compute="_compute_xml_data", store=True)
     registered = fields.Boolean(
         "Registered", compute="_compute_registered", store=True)
+    e_invoice_fingerprint = fields.Char(
+        "Fingerprint", compute="_compute_xml_data", store=True, index=True,
+        help="Fingerprints of the e-bills of the file, one for each line, "
+             "used to find e-bills received more than once")
+    duplicated = fields.Boolean(
+        "Duplicated", compute="_compute_duplicates")
+    duplicate_attachment_ids = fields.Many2many(
+        'fatturapa.attachment.in', string="Files with the same e-bills",
+        compute="_compute_duplicates")
+    duplicate_invoice_ids = fields.Many2many(
+        'account.invoice', string="Bills already registered",
+        compute="_compute_duplicates")
 
     e_invoice_received_date = fields.Datetime(string='E-Bill Received Date')
 
     e_invoice_validation_error = fields.Boolean(
-        compute='_compute_e_invoice_validation_error')
+        compute='_compute_e_invoice_validation_error', store=True, index=True)
 
     e_invoice_validation_message = fields.Text(
-        compute='_compute_e_invoice_validation_error')
+        compute='_compute_e_invoice_validation_error', store=True)
 
     xml_has_attachment = fields.Boolean(default=False, compute='_get_has_attachment')
 
@@ -57,23 +93,41 @@ class FatturaPAAttachmentIn(models.Model):
         'unique(att_name)',
         'The name of the e-bill file must be unique!')]
 
-    @api.depends('in_invoice_ids.e_invoice_validation_error')
+    @api.multi
+    @api.depends('in_invoice_ids',
+                 'in_invoice_ids.type',
+                 'in_invoice_ids.state',
+                 'in_invoice_ids.number',
+                 'in_invoice_ids.currency_id',
+                 'in_invoice_ids.amount_untaxed',
+                 'in_invoice_ids.amount_tax',
+                 'in_invoice_ids.amount_total',
+                 'in_invoice_ids.reference',
+                 'in_invoice_ids.date_invoice',
+                 'in_invoice_ids.e_invoice_amount_untaxed',
+                 'in_invoice_ids.e_invoice_amount_tax',
+                 'in_invoice_ids.e_invoice_amount_total',
+                 'in_invoice_ids.e_invoice_reference',
+                 'in_invoice_ids.e_invoice_date_invoice',
+                 'in_invoice_ids.ftpa_withholding_ids.amount',
+                 'in_invoice_ids.withholding_tax',
+                 'in_invoice_ids.withholding_tax_amount')
     def _compute_e_invoice_validation_error(self):
+        # Stored, so that it is only computed when the bills change:
+        # the bills of all the attachments are read together.
+        # The bills' errors are not stored, so this depends
+        # on the stored fields they are computed from
+        bills_with_error = self.mapped('in_invoice_ids').filtered(
+            lambda b: b.e_invoice_validation_error)
+        errors_message_template = u"{bill}:\n{errors}"
         for att in self:
-            bills_with_error = att.in_invoice_ids.filtered(
-                lambda b: b.e_invoice_validation_error
-            )
-            if not bills_with_error:
-                continue
-            att.e_invoice_validation_error = True
-            errors_message_template = u"{bill}:\n{errors}"
-            error_messages = list()
-            for bill in bills_with_error:
-                error_messages.append(
-                    errors_message_template.format(
-                        bill=bill.display_name,
-                        errors=bill.e_invoice_validation_message))
-            att.e_invoice_validation_message = "\n\n".join(error_messages)
+            att_bills_with_error = att.in_invoice_ids & bills_with_error
+            att.e_invoice_validation_error = bool(att_bills_with_error)
+            att.e_invoice_validation_message = "\n\n".join(
+                errors_message_template.format(
+                    bill=bill.display_name,
+                    errors=bill.e_invoice_validation_message)
+                for bill in att_bills_with_error) or False
 
     @api.onchange('datas_fname')
     def onchagne_datas_fname(self):
@@ -82,23 +136,66 @@ class FatturaPAAttachmentIn(models.Model):
     def get_xml_string(self):
         return self.ir_attachment_id.get_xml_string()
 
+    def get_xml_tree(self):
+        return self.ir_attachment_id.get_xml_tree()
+
+    def get_xml_summary_tree(self):
+        return self.ir_attachment_id.get_xml_summary_tree()
+
+    def get_xml_body_trees(self):
+        return self.ir_attachment_id.get_xml_body_trees()
+
+    def get_fatturapa_obj(self):
+        return self.ir_attachment_id.get_fatturapa_obj()
+
+    def get_fatturapa_summary_obj(self):
+        return self.ir_attachment_id.get_fatturapa_summary_obj()
+
+    @api.multi
+    def validate_xml(self):
+        """Validate the XML files against the XSD schema, return a dict
+        mapping the id of each e-bill file to its list of errors,
+        see ir.attachment.get_xml_validation_errors"""
+        errors = self.mapped('ir_attachment_id').validate_fatturapa_xml()
+        return {att.id: errors[att.ir_attachment_id.id] for att in self}
+
     @api.multi
     def recompute_xml_fields(self):
-        self._compute_xml_data()
-        self._compute_registered()
+        fields_to_recompute = [
+            self._fields[name] for name in (
+                'xml_supplier_id', 'invoices_number', 'invoices_total',
+                'invoices_date', 'registered')
+        ]
+        # Recompute in chunks, so that the cache and the XML
+        # of thousands of e-bills are not kept in memory together
+        for ids in split_every(RECOMPUTE_CHUNK_SIZE, self.ids):
+            attachments = self.browse(ids)
+            for field in fields_to_recompute:
+                self.env.add_todo(field, attachments)
+            attachments.recompute()
+            self.env.invalidate_all()
 
     @api.multi
     @api.depends('ir_attachment_id.datas')
     def _compute_xml_data(self):
+        lang_env = self.with_context(lang=self.env.user.lang).env
         for att in self:
             wiz_obj = self.env['wizard.import.fatturapa'] \
                 .with_context(from_attachment=att)
-            fatt = wiz_obj.get_invoice_obj(att)
+            # Only supplier and general data are needed here
+            fatt = wiz_obj.get_invoice_summary_obj(att)
             cedentePrestatore = fatt.FatturaElettronicaHeader.CedentePrestatore
             dati_generali_documento = fatt.FatturaElettronicaBody[0].DatiGenerali.DatiGeneraliDocumento
-            partner_id = wiz_obj.getCedPrest(cedentePrestatore, dati_generali_documento)
+            # Partners are only searched here: they are created and
+            # updated by the import, not every time a file is saved
+            partner_id = wiz_obj.searchCedPrest(
+                cedentePrestatore, dati_generali_documento)
             att.xml_supplier_id = partner_id
             att.invoices_number = len(fatt.FatturaElettronicaBody)
+            att.e_invoice_fingerprint = '\n'.join(
+                get_e_invoice_fingerprint(
+                    fatt.FatturaElettronicaHeader, invoice_body)
+                for invoice_body in fatt.FatturaElettronicaBody)
             att.invoices_total = 0
             invoices_date = []
             for invoice_body in fatt.FatturaElettronicaBody:
@@ -107,13 +204,68 @@ class FatturaPAAttachmentIn(models.Model):
                     ImportoTotaleDocumento or 0
                 )
                 invoice_date = format_date(
-                    att.with_context(
-                        lang=att.env.user.lang).env, fields.Date.from_string(
-                            invoice_body.DatiGenerali.DatiGeneraliDocumento.Data))
+                    lang_env, fields.Date.from_string(
+                        invoice_body.DatiGenerali.DatiGeneraliDocumento.Data))
                 if invoice_date not in invoices_date:
                     invoices_date.append(invoice_date)
             att.invoices_date = ' '.join(invoices_date)
 
+    def init(self):
+        # Used by _compute_duplicates to find the files
+        # sharing any e-bill with other files
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS
+                fatturapa_attachment_in_e_invoice_fingerprints_index
+            ON fatturapa_attachment_in
+            USING gin (string_to_array(e_invoice_fingerprint, E'\\n'))
+        """)
+
+    @api.multi
+    @api.depends('e_invoice_fingerprint')
+    def _compute_duplicates(self):
+        # Files and bills are searched once for all the files,
+        # matching each e-bill of a file on its own
+        fingerprints = {
+            att: set(att.e_invoice_fingerprint.split('\n'))
+            for att in self if att.e_invoice_fingerprint}
+        if not fingerprints:
+            return
+        all_fingerprints = list(set().union(*fingerprints.values()))
+        self.env.cr.execute("""
+            SELECT id, e_invoice_fingerprint
+            FROM fatturapa_attachment_in
+            WHERE string_to_array(e_invoice_fingerprint, E'\\n')
+                && %s::text[]
+        """, (all_fingerprints, ))
+        attachment_fingerprints = dict(self.env.cr.fetchall())
+        # Only the files the user can read
+        attachments = self.search(
+            [('id', 'in', list(attachment_fingerprints))])
+        invoices = self.env['account.invoice'].search([
+            ('e_invoice_fingerprint', 'in', all_fingerprints),
+            ('state', '!=', 'cancel'),
+        ])
+        for att, att_fingerprints in fingerprints.items():
+            att.duplicate_attachment_ids = attachments.filtered(
+                lambda a: a != att and att_fingerprints.intersection(
+                    attachment_fingerprints[a.id].split('\n')))
+            att.duplicate_invoice_ids = invoices.filtered(
+                lambda i: i.fatturapa_attachment_in_id != att
+                and i.e_invoice_fingerprint in att_fingerprints)
+            att.duplicated = bool(
+                att.duplicate_attachment_ids or att.duplicate_invoice_ids)
+
+    @api.model
+    def create(self, vals):
+        att = super(FatturaPAAttachmentIn, self).create(vals)
+        if att.duplicated:
+            att.message_post(body=_(
+                "The e-bills of this file have already been received: "
+                "%s") % ', '.join(
+                    (att.duplicate_attachment_ids.mapped('name') +
+                     att.duplicate_invoice_ids.mapped('display_name'))))
+        return att
+
     @api.multi
     @api.depends('in_invoice_ids')
     def _compute_registered(self):
@@ -0,0 +1,36 @@
+import threading
+from contextlib import contextmanager
+
+from odoo import api, models
+
+# Precisions overridden in the current thread, see override_precisions
+_local = threading.local()
+
+
+@contextmanager
+def override_precisions(digits):
+    """Use the given digits, a dict {application: digits}, in place of
+    the decimal.precision records, in the current thread only.
+
+    Float fields get their digits from decimal.precision.precision_get
+    with a new environment and cursor, where the context of the caller
+    is not available: this is why the override is bound to the thread
+    of the request, like the rest of its state."""
+    previous = getattr(_local, 'digits', None)
+    _local.digits = dict(previous or {})
+    _local.digits.update(digits)
+    try:
+        yield
+    finally:
+        _local.digits = previous
+
+
+class DecimalPrecision(models.Model):
+    _inherit = 'decimal.precision'
+
+    @api.model
+    def precision_get(self, application):
+        digits = getattr(_local, 'digits', None)
+        if digits and application in digits:
+            return digits[application]
+        return super(DecimalPrecision, self).precision_get(application)
@@ -0,0 +1,228 @@
+import logging
+import time
+
+from psycopg2.extensions import TransactionRollbackError
+
+from odoo import api, fields, models
+from odoo.tools.translate import _
+
+from ..wizard.import_session import ImportSession
+
+_logger = logging.getLogger(__name__)
+
+# Default for the l10n_it_fatturapa_in.import_job_chunk_size parameter
+IMPORT_JOB_CHUNK_SIZE = 50
+# Seconds after which the cron stops taking new chunks
+CRON_TIME_BUDGET = 240
+
+
+class FatturaPAImportJob(models.Model):
+    """Import of e-bills run in background by the cron.
+
+    The e-bill files are split in chunks, each chunk is committed at its
+    end. The chunks are processed one at a time by the cron, the locks
+    only keep a chunk from being taken twice."""
+    _name = "fatturapa.import.job"
+    _description = "E-bills background import"
+    _order = 'id desc'
+
+    name = fields.Char(required=True, readonly=True)
+    user_id = fields.Many2one(
+        'res.users', string="User", required=True, readonly=True,
+        default=lambda self: self.env.user)
+    company_id = fields.Many2one(
+        'res.company', string="Company", required=True, readonly=True,
+        default=lambda self: self.env.user.company_id)
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+    ], default='pending', required=True, readonly=True)
+    e_invoice_detail_level = fields.Selection([
+        ('0', 'Minimum'),
+        ('1', 'Tax rate'),
+        ('2', 'Maximum'),
+    ], string="E-bills Detail Level", required=True, readonly=True)
+    price_decimal_digits = fields.Integer(
+        "Prices decimal digits", required=True, readonly=True)
+    quantity_decimal_digits = fields.Integer(
+        "Quantities decimal digits", required=True, readonly=True)
+    discount_decimal_digits = fields.Integer(
+        "Discounts decimal digits", required=True, readonly=True)
+    line_ids = fields.One2many(
+        'fatturapa.import.job.line', 'job_id', string="Files", readonly=True)
+    files_number = fields.Integer(
+        "Files", compute='_compute_progress')
+    imported_number = fields.Integer(
+        "Imported", compute='_compute_progress')
+    failed_number = fields.Integer(
+        "Failed", compute='_compute_progress')
+    progress = fields.Float(
+        "Progress", compute='_compute_progress')
+    date_start = fields.Datetime("Started", readonly=True)
+    date_end = fields.Datetime("Ended", readonly=True)
+
+    @api.multi
+    def _compute_progress(self):
+        line_model = self.env['fatturapa.import.job.line']
+        counts = {}
+        for group in line_model.read_group(
+                [('job_id', 'in', self.ids)], ['job_id', 'state'],
+                ['job_id', 'state'], lazy=False):
+            counts[(group['job_id'][0], group['state'])] = group['__count']
+        for job in self:
+            imported = counts.get((job.id, 'done'), 0)
+            failed = counts.get((job.id, 'failed'), 0)
+            total = imported + failed + counts.get((job.id, 'pending'), 0)
+            job.files_number = total
+            job.imported_number = imported
+            job.failed_number = failed
+            job.progress = total and 100.0 * (imported + failed) / total
+
+    @api.model
+    def create_from_wizard(self, wizard, fatturapa_attachments):
+        chunk_size = int(self.env['ir.config_parameter'].sudo().get_param(
+            'l10n_it_fatturapa_in.import_job_chunk_size',
+            IMPORT_JOB_CHUNK_SIZE))
+        return self.create({
+            'name': _("Import of %d e-bill files") % len(fatturapa_attachments),
+            'e_invoice_detail_level': wizard.e_invoice_detail_level,
+            'price_decimal_digits': wizard.price_decimal_digits,
+            'quantity_decimal_digits': wizard.quantity_decimal_digits,
+            'discount_decimal_digits': wizard.discount_decimal_digits,
+            'line_ids': [(0, 0, {
+                'attachment_id': attachment.id,
+                'chunk': index // chunk_size,
+            }) for index, attachment in enumerate(fatturapa_attachments)],
+        })
+
+    @api.model
+    def _lock_next_chunk(self):
+        """Lock the pending lines of the first chunk that is not
+        being processed by another worker, return them"""
+        self.env.cr.execute("""
+            SELECT job_id, chunk FROM fatturapa_import_job_line
+            WHERE state = 'pending'
+            ORDER BY job_id, chunk
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """)
+        row = self.env.cr.fetchone()
+        if not row:
+            return self.env['fatturapa.import.job.line']
+        self.env.cr.execute("""
+            SELECT id FROM fatturapa_import_job_line
+            WHERE job_id = %s AND chunk = %s AND state = 'pending'
+            ORDER BY id
+            FOR UPDATE SKIP LOCKED
+        """, row)
+        return self.env['fatturapa.import.job.line'].browse(
+            [line_id for line_id, in self.env.cr.fetchall()])
+
+    @api.multi
+    def _import_lines(self, lines):
+        """Import each file of lines in its own savepoint, so that a
+        failing file does not roll back the others"""
+        self.ensure_one()
+        wizard_model = self.env['wizard.import.fatturapa'].sudo(self.user_id)
+        wizard_model = wizard_model.with_context(
+            force_company=self.company_id.id,
+            fatturapa_import_session=ImportSession())
+        wizard_vals = {
+            'e_invoice_detail_level': self.e_invoice_detail_level,
+            'price_decimal_digits': self.price_decimal_digits,
+            'quantity_decimal_digits': self.quantity_decimal_digits,
+            'discount_decimal_digits': self.discount_decimal_digits,
+        }
+        for line in lines:
+            start = time.time()
+            vals = {'state': 'done'}
+            try:
+                with self.env.cr.savepoint():
+                    wizard = wizard_model.with_context(
+                        active_id=line.attachment_id.id,
+                        active_ids=line.attachment_id.ids,
+                        active_model='fatturapa.attachment.in',
+                    ).create(wizard_vals)
+                    res = wizard.importFatturaPA()
+                    vals['invoice_ids'] = [(6, 0, res['domain'][0][2])]
+            except Exception as e:
+                _logger.info(
+                    "E-bill file %s not imported", line.attachment_id.name,
+                    exc_info=True)
+                vals = {
+                    'state': 'failed',
+                    'message': getattr(e, 'name', None) or str(e),
+                }
+                # records created by the failed import have been rolled back
+                wizard_model = wizard_model.with_context(
+                    fatturapa_import_session=ImportSession())
+                self.env.clear()
+            vals['duration'] = time.time() - start
+            line.write(vals)
+
+    @api.model
+    def process_next_chunk(self):
+        """Import the next chunk of pending files and commit,
+        return False if there are no pending files"""
+        lines = self._lock_next_chunk()
+        if not lines:
+            return False
+        job = lines.mapped('job_id')
+        # Only the worker of the first chunk writes on the job when
+        # it starts, the job is closed by _close_finished_jobs
+        if lines[0].chunk == 0:
+            job.write({'state': 'running', 'date_start': fields.Datetime.now()})
+        job._import_lines(lines)
+        self.env.cr.commit()
+        return True
+
+    @api.model
+    def _close_finished_jobs(self):
+        """Set as done the jobs without pending files, and commit"""
+        try:
+            with self.env.cr.savepoint():
+                self.env.cr.execute("""
+                    UPDATE fatturapa_import_job job
+                    SET state = 'done', date_end = now() at time zone 'UTC'
+                    WHERE state != 'done' AND NOT EXISTS (
+                        SELECT 1 FROM fatturapa_import_job_line line
+                        WHERE line.job_id = job.id AND line.state = 'pending')
+                """)
+        except TransactionRollbackError:
+            # Closed by another worker, or still being processed:
+            # the next run closes it
+            return
+        self.invalidate_cache(['state', 'date_end'])
+        self.env.cr.commit()
+
+    @api.model
+    def _cron_process_chunks(self):
+        start = time.time()
+        while time.time() - start < CRON_TIME_BUDGET:
+            if not self.process_next_chunk():
+                break
+        self._close_finished_jobs()
+
+
+class FatturaPAImportJobLine(models.Model):
+    _name = "fatturapa.import.job.line"
+    _description = "E-bill file of a background import"
+    _order = 'job_id, id'
+
+    job_id = fields.Many2one(
+        'fatturapa.import.job', string="Import", required=True,
+        ondelete='cascade', index=True, readonly=True)
+    attachment_id = fields.Many2one(
+        'fatturapa.attachment.in', string="E-bill file", required=True,
+        ondelete='cascade', readonly=True)
+    chunk = fields.Integer(required=True, readonly=True)
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('done', 'Imported'),
+        ('failed', 'Failed'),
+    ], default='pending', required=True, readonly=True, index=True)
+    invoice_ids = fields.Many2many(
+        'account.invoice', string="Bills", readonly=True)
+    message = fields.Text(readonly=True)
+    duration = fields.Float("Duration (s)", readonly=True)
@@ -0,0 +1,31 @@
+from odoo import fields, models
+
+PROFILE_PHASES = [
+    ('parse', 'Decode and parse'),
+    ('sanitize', 'Sanitize'),
+    ('partner', 'Partners'),
+    ('header', 'Bill header'),
+    ('lines', 'Lines'),
+    ('taxes', 'Taxes'),
+    ('payments', 'Payments'),
+    ('attachments', 'Attachments'),
+    ('checks', 'Amount checks'),
+]
+
+
+class FatturaPAImportProfile(models.Model):
+    """Time spent in a phase of the import of an e-bill file,
+    recorded when the import is profiled"""
+    _name = "fatturapa.import.profile"
+    _description = "E-bill import profile"
+    _order = 'id desc'
+    _rec_name = 'phase'
+
+    attachment_id = fields.Many2one(
+        'fatturapa.attachment.in', string="E-bill file",
+        ondelete='cascade', index=True, readonly=True,
+        help="Empty for the phases done once for all the imported files")
+    phase = fields.Selection(PROFILE_PHASES, required=True, readonly=True)
+    calls = fields.Integer(readonly=True)
+    duration = fields.Float("Duration (s)", digits=(16, 4), readonly=True)
+    queries = fields.Integer("SQL Queries", readonly=True)
@@ -0,0 +1,10 @@
+from odoo import fields, models
+
+
+class ResUsers(models.Model):
+    _inherit = 'res.users'
+
+    fatturapa_import_profile = fields.Boolean(
+        "Profile E-bill Imports",
+        help="Record time and SQL queries of each phase of the e-bill "
+             "imports of this user, see E-bills Import Profiles")
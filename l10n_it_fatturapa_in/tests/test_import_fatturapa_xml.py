@@ -1,8 +1,13 @@
+import base64
+import mock
 from psycopg2 import IntegrityError
 
 from datetime import date
 
 from odoo.tools import mute_logger
+from odoo.addons.l10n_it_fatturapa.bindings.cache import parsed_xml_cache
+from odoo.addons.l10n_it_fatturapa.models.ir_attachment import sniff_format
+from ..wizard.import_session import ImportSession
 from .fatturapa_common import FatturapaCommon
 from odoo.exceptions import UserError
 
@@ -699,6 +704,23 @@ class TestFatturaPAXMLValidation(FatturapaCommon):
         # Due to multiple SQL transactions, we cannot test the correct importation.
         # IT01234567890_FPR14.xml should be tested manually
 
+    def test_47_xml_import_price_digits(self):
+        precision_model = self.env['decimal.precision']
+        price_digits = precision_model.precision_get('Product Price')
+        res = self.run_wizard(
+            'test47_price_digits', 'IT01234567890_FPR14.xml',
+            datas_fname='IT01234567890_FPR14_price_digits.xml',
+            wiz_values={'price_decimal_digits': 8})
+        invoice_id = res.get('domain')[0][2][0]
+        invoice = self.invoice_model.browse(invoice_id)
+        self.assertEqual(
+            invoice.invoice_line_ids.mapped('price_unit'),
+            [1.35580114, 1.2217518])
+        self.assertAlmostEqual(invoice.amount_untaxed, 44519.26)
+        # decimal.precision is not changed
+        self.assertEqual(
+            precision_model.precision_get('Product Price'), price_digits)
+
     def test_48_xml_import(self):
         # my company bank account is the same as the one in XML:
         # invoice creation must not be blocked
@@ -720,6 +742,369 @@ class TestFatturaPAXMLValidation(FatturapaCommon):
         invoice = self.invoice_model.browse(invoice_id)
         self.assertEqual(invoice.carrier_id.vat, "IT04102770965")
 
+    def test_50_xml_summary_fields(self):
+        self.env.user.lang = 'it_IT'
+        attachment = self.attach_model.create({
+            'name': 'test50',
+            'datas': self.getFile('IT01234567890_FPR03.xml')[1],
+            'datas_fname': 'IT01234567890_FPR03.xml',
+        })
+        summary_tree = attachment.get_xml_summary_tree()
+        self.assertEqual(len(summary_tree.findall('.//DettaglioLinee')), 2)
+        self.assertEqual(len(attachment.get_xml_tree().findall(
+            './/DettaglioLinee')), 3)
+        attachment.recompute_xml_fields()
+        self.assertEqual(attachment.xml_supplier_id.vat, 'IT02780790107')
+        self.assertEqual(attachment.invoices_number, 2)
+        self.assertEqual(attachment.invoices_date, '18/12/2014 20/12/2014')
+        self.assertFalse(attachment.registered)
+
+    def test_51_xml_body_obj(self):
+        attachment = self.attach_model.create({
+            'name': 'test51_bodies',
+            'datas': self.getFile('IT01234567890_FPR03.xml')[1],
+            'datas_fname': 'IT01234567890_FPR03.xml',
+        })
+        fatt = self.wizard_model.get_invoice_obj(attachment)
+        body_objs = list(self.wizard_model.iter_invoice_body_obj(attachment))
+        self.assertEqual(len(body_objs), 2)
+        for body_obj, fattura in zip(body_objs, fatt.FatturaElettronicaBody):
+            self.assertEqual(len(body_obj.FatturaElettronicaBody), 1)
+            self.assertEqual(
+                body_obj.FatturaElettronicaHeader.toxml(),
+                fatt.FatturaElettronicaHeader.toxml())
+            self.assertEqual(
+                body_obj.FatturaElettronicaBody[0].toxml(), fattura.toxml())
+
+    def test_52_xml_parsed_cache(self):
+        attachment = self.attach_model.create({
+            'name': 'test52_cache',
+            'datas': self.getFile('IT02780790107_11005.xml')[1],
+            'datas_fname': 'IT02780790107_11005.xml',
+        })
+        fatt = self.wizard_model.get_invoice_obj(attachment)
+        hits = parsed_xml_cache.stats()['hits']
+        self.assertIs(self.wizard_model.get_invoice_obj(attachment), fatt)
+        self.assertEqual(parsed_xml_cache.stats()['hits'], hits + 1)
+        attachment.datas = self.getFile('IT02780790107_11004.xml')[1]
+        new_fatt = self.wizard_model.get_invoice_obj(attachment)
+        self.assertIsNot(new_fatt, fatt)
+        self.assertEqual(
+            new_fatt.FatturaElettronicaBody[0].DatiGenerali.
+            DatiGeneraliDocumento.Numero, '123')
+
+    def test_53_xml_validation(self):
+        valid = self.attach_model.create({
+            'name': 'test53_valid',
+            'datas': self.getFile('IT01234567890_FPR03.xml')[1],
+            'datas_fname': 'IT01234567890_FPR03.xml',
+        })
+        invalid = self.attach_model.create({
+            'name': 'test53_invalid',
+            'datas': self.getFile('IT01234567890_FPR04.xml')[1],
+            'datas_fname': 'IT01234567890_FPR04.xml',
+        })
+        not_xml = self.attach_model.create({
+            'name': 'test53_not_xml',
+            'datas': self.getFile('IT02780790107_11004.xml')[1],
+            'datas_fname': 'IT02780790107_11004.xml',
+        })
+        errors = (valid | invalid | not_xml).validate_xml()
+        self.assertEqual(errors[valid.id], [])
+        self.assertEqual(len(errors[invalid.id]), 1)
+        self.assertEqual(errors[invalid.id][0]['line'], 54)
+        self.assertTrue(errors[invalid.id][0]['path'].endswith(
+            'DatiGeneraliDocumento/Data'))
+        self.assertIn('xmldsig', errors[not_xml.id][0]['message'])
+
+        wizard = self.env['wizard.fatturapa.validate.xml'].with_context(
+            active_model=self.attach_model._name,
+            active_ids=(valid | invalid).ids,
+        ).create({})
+        wizard.validate()
+        self.assertEqual(wizard.state, 'done')
+        self.assertEqual(wizard.files_number, 2)
+        self.assertEqual(wizard.invalid_files_number, 1)
+        self.assertEqual(
+            wizard.line_ids.mapped('attachment_id'), invalid.ir_attachment_id)
+
+    def test_54_sniff_format(self):
+        for file_name, data_format in [
+                ('IT01234567890_FPR03.xml', 'xml'),
+                ('IT01234567890_FPR03.xml.p7m', 'cades'),
+                ('IT01234567890_FPR03.base64.xml.p7m', 'base64'),
+                ('IT05979361218_fake.xml.p7m', None)]:
+            with open(self.getFile(file_name)[0], 'rb') as data:
+                self.assertEqual(sniff_format(data.read()), data_format)
+        self.assertEqual(sniff_format(b'\xef\xbb\xbf<?xml'), 'xml')
+        self.assertEqual(sniff_format(b'\n  <FatturaElettronica/>'), 'xml')
+        self.assertIsNone(sniff_format(b''))
+        attachment = self.attach_model.create({
+            'name': 'test54_sniff',
+            'datas': self.getFile('IT01234567890_FPR03.base64.xml.p7m')[1],
+            'datas_fname': 'IT01234567890_FPR03.base64.xml.p7m',
+        })
+        self.assertEqual(sniff_format(attachment.get_xml_content()), 'xml')
+
+    def test_55_preview_cache(self):
+        attachment = self.attach_model.create({
+            'name': 'test55_preview',
+            'datas': self.getFile('IT01234567890_FPR03.xml')[1],
+            'datas_fname': 'IT01234567890_FPR03.xml',
+        })
+        report_model = type(self.env['ir.actions.report'])
+        with mock.patch.object(
+                report_model, '_run_wkhtmltopdf',
+                return_value=b'%PDF-1.4 preview') as run_wkhtmltopdf:
+            for _ in range(2):
+                pdf = attachment.ir_attachment_id \
+                    .get_fattura_elettronica_preview_pdf()
+                self.assertEqual(pdf, b'%PDF-1.4 preview')
+        self.assertEqual(run_wkhtmltopdf.call_count, 1)
+        preview = self.env['fatturapa.preview'].search(
+            [('checksum', '=', attachment.checksum)])
+        self.assertEqual(
+            preview.style, self.env.user.company_id.fatturapa_preview_style)
+
+    def test_56_import_session(self):
+        session = ImportSession()
+        wizard = self.wizard_model.with_context(
+            fatturapa_import_session=session)
+        italy = wizard.CountryByCode('IT')
+        self.assertEqual(italy, self.env.ref('base.it'))
+        self.assertEqual(wizard.CountryByCode('IT'), italy)
+        self.assertEqual(session.hits['country'], 1)
+        self.assertEqual(session.misses['country'], 1)
+        wizard._invalidate_cached_search('country', 'IT')
+        wizard.CountryByCode('IT')
+        self.assertEqual(session.misses['country'], 2)
+        self.assertEqual(session.format_stats(), 'country 1/3')
+
+    def test_57_prefetch_suppliers(self):
+        attachments = self.attach_model.browse()
+        for file_name in ('IT01234567890_FPR03.xml', 'IT02780790107_11005.xml',
+                          'IT05979361218_001.xml'):
+            attachments |= self.attach_model.create({
+                'name': 'test57_prefetch_%s' % file_name,
+                'datas': self.getFile(file_name)[1],
+                'datas_fname': file_name,
+            })
+        session = ImportSession()
+        wizard = self.wizard_model.with_context(
+            fatturapa_import_session=session)
+        wizard.prefetch_suppliers(attachments)
+        searches = session.misses['partner']
+        vats = set()
+        for attachment in attachments:
+            fatt = wizard.get_invoice_summary_obj(attachment)
+            partner_id = wizard.getPartnerBase(
+                fatt.FatturaElettronicaHeader.CedentePrestatore.DatiAnagrafici)
+            vats.add(self.env['res.partner'].browse(partner_id).sanitized_vat)
+        self.assertEqual(vats, {'IT02780790107', 'IT05979361218'})
+        self.assertEqual(session.misses['partner'], searches)
+
+    def test_58_import_job(self):
+        attachments = self.attach_model.browse()
+        for file_name in ('IT05979361218_002.xml', 'IT05979361218_fake.xml.p7m'):
+            attachments |= self.attach_model.create({
+                'name': 'test58_job_%s' % file_name,
+                'datas': self.getFile(file_name)[1],
+                'datas_fname': file_name,
+            })
+        wizard = self.wizard_model.with_context(
+            active_ids=attachments.ids,
+            active_model='fatturapa.attachment.in',
+        ).create({})
+        res = wizard.importFatturaPAInBackground()
+        job = self.env['fatturapa.import.job'].browse(res['res_id'])
+        self.assertEqual(job.line_ids.mapped('attachment_id'), attachments)
+        self.assertEqual(job.line_ids.mapped('state'), ['pending', 'pending'])
+
+        job._import_lines(job.line_ids)
+        imported, failed = job.line_ids
+        self.assertEqual(imported.state, 'done')
+        self.assertEqual(imported.invoice_ids, attachments[0].in_invoice_ids)
+        self.assertTrue(imported.invoice_ids)
+        self.assertEqual(failed.state, 'failed')
+        self.assertTrue(failed.message)
+        self.assertFalse(attachments[1].in_invoice_ids)
+        job.invalidate_cache()
+        self.assertEqual(job.progress, 100)
+        self.assertEqual(job.failed_number, 1)
+
+    def test_59_batch_lines(self):
+        line_model = type(self.env['account.invoice.line'])
+        e_line_model = type(self.env['einvoice.line'])
+        with mock.patch.object(
+                line_model, 'create', autospec=True,
+                side_effect=line_model.create) as line_create, \
+                mock.patch.object(
+                    e_line_model, 'create', autospec=True,
+                    side_effect=e_line_model.create) as e_line_create:
+            res = self.run_wizard('test59_batch', 'IT02780790107_11005.xml')
+        self.assertEqual(line_create.call_count, 1)
+        self.assertEqual(e_line_create.call_count, 1)
+        invoice = self.invoice_model.browse(res.get('domain')[0][2][0])
+        self.assertEqual(len(invoice.invoice_line_ids), 2)
+        self.assertEqual(
+            invoice.e_invoice_line_ids.mapped('line_number'), [1, 2])
+        self.assertEqual(
+            invoice.e_invoice_line_ids[0].cod_article_ids.mapped('code_val'),
+            ['12345'])
+
+    def test_60_supplier_search(self):
+        partner_model = self.env['res.partner']
+        partners_number = partner_model.search_count([])
+        # test_43 has created the supplier of this e-bill:
+        # use a VAT number of no partner
+        with open(self.getFile('ITBNCMRA80A01D548T_20001.xml')[0], 'rb') \
+                as xml_file:
+            xml_content = xml_file.read().replace(
+                b'01484710387', b'07918570644')
+        attachment = self.attach_model.create({
+            'name': 'test60_supplier_search',
+            'datas': base64.b64encode(xml_content),
+            'datas_fname': 'ITBNCMRA80A01D548T_20001.xml',
+        })
+        self.assertFalse(attachment.xml_supplier_id)
+        self.assertEqual(partner_model.search_count([]), partners_number)
+
+        wizard = self.wizard_model.with_context(
+            active_ids=attachment.ids,
+            active_model='fatturapa.attachment.in',
+        ).create({})
+        res = wizard.importFatturaPA()
+        invoice = self.invoice_model.browse(res.get('domain')[0][2][0])
+        self.assertTrue(invoice.partner_id)
+        self.assertEqual(attachment.xml_supplier_id, invoice.partner_id)
+        attachment.recompute_xml_fields()
+        self.assertEqual(attachment.xml_supplier_id, invoice.partner_id)
+
+    def test_61_supplier_products(self):
+        attachment = self.attach_model.create({
+            'name': 'test61_supplier_products',
+            'datas': self.getFile('IT02780790107_11005.xml')[1],
+            'datas_fname': 'IT02780790107_11005.xml',
+        })
+        partner = self.env['res.partner'].create({
+            'name': 'Supplier with codes',
+        })
+        product = self.env.ref('product.product_product_5')
+        self.env['product.supplierinfo'].create({
+            'name': partner.id,
+            'product_tmpl_id': product.product_tmpl_id.id,
+            'product_id': product.id,
+            'product_code': '12345',
+        })
+        session = ImportSession()
+        wizard = self.wizard_model.with_context(
+            fatturapa_import_session=session)
+        lines = wizard.get_invoice_obj(attachment) \
+            .FatturaElettronicaBody[0].DatiBeniServizi.DettaglioLinee
+        self.assertEqual(wizard.get_line_product(lines[0], partner), product)
+        self.assertIsNone(wizard.get_line_product(lines[1], partner))
+
+        default_product = self.env.ref('product.product_product_6')
+        partner.e_invoice_default_product_id = default_product
+        session.invalidate('supplier_products')
+        self.assertEqual(wizard.get_line_product(lines[0], partner), product)
+        self.assertEqual(
+            wizard.get_line_product(lines[1], partner), default_product)
+        self.assertEqual(session.misses['supplier_products'], 2)
+        self.assertEqual(session.hits['supplier_products'], 2)
+
+    def test_62_fingerprint(self):
+        attachments = self.attach_model.browse()
+        # No other test imports this e-bill
+        for name in ('test62_fingerprint_1', 'test62_fingerprint_2'):
+            attachments |= self.attach_model.create({
+                'name': name,
+                'datas': self.getFile('IT05979361218_006.XML')[1],
+                'datas_fname': 'IT05979361218_006.XML',
+            })
+        first, second = attachments
+        self.assertEqual(
+            first.e_invoice_fingerprint,
+            'IT05979361218|TD01|FT/2015/0011|2015-02-17|')
+        self.assertEqual(second.duplicate_attachment_ids, first)
+        self.assertTrue(second.duplicated)
+        self.assertTrue(second.message_ids.filtered(
+            lambda m: 'already been received' in (m.body or '')))
+
+        wizard = self.wizard_model.with_context(
+            active_ids=first.ids,
+            active_model='fatturapa.attachment.in',
+        ).create({})
+        self.assertFalse(wizard.duplicate_invoice_ids)
+        res = wizard.importFatturaPA()
+        invoice = self.invoice_model.browse(res.get('domain')[0][2][0])
+        self.assertEqual(
+            invoice.e_invoice_fingerprint, first.e_invoice_fingerprint)
+        second.invalidate_cache()
+        self.assertEqual(second.duplicate_invoice_ids, invoice)
+        self.assertFalse(first.duplicate_invoice_ids)
+        wizard = self.wizard_model.with_context(
+            active_ids=second.ids,
+            active_model='fatturapa.attachment.in',
+        ).create({})
+        self.assertEqual(wizard.duplicate_invoice_ids, invoice)
+        # Files sharing only some of their e-bills are duplicates too
+        second.e_invoice_fingerprint = '\n'.join([
+            first.e_invoice_fingerprint,
+            'IT05979361218|TD01|FT/2015/0012|2015-02-17|'])
+        first.invalidate_cache()
+        self.assertEqual(first.duplicate_attachment_ids, second)
+        self.assertEqual(second.duplicate_attachment_ids, first)
+
+    def test_63_import_profile(self):
+        self.env.user.fatturapa_import_profile = True
+        try:
+            res = self.run_wizard('test63_profile', 'IT05979361218_002.xml')
+        finally:
+            self.env.user.fatturapa_import_profile = False
+        invoice = self.invoice_model.browse(res.get('domain')[0][2][0])
+        profiles = self.env['fatturapa.import.profile'].search([
+            ('attachment_id', '=', invoice.fatturapa_attachment_in_id.id)])
+        self.assertTrue({
+            'parse', 'sanitize', 'partner', 'header', 'lines', 'taxes',
+            'payments', 'attachments', 'checks',
+        } <= set(profiles.mapped('phase')))
+        self.assertTrue(all(p.duration >= 0 for p in profiles))
+        self.assertTrue(sum(profiles.mapped('queries')))
+
+    def test_64_attachment_validation_error(self):
+        # The stored error of the e-bill file follows the bill amounts
+        res = self.run_wizard('test64', 'IT05979361218_004.xml')
+        invoice = self.invoice_model.browse(res.get('domain')[0][2][0])
+        attachment = invoice.fatturapa_attachment_in_id
+        error_domain = [
+            ('id', '=', attachment.id),
+            ('e_invoice_validation_error', '=', True)]
+        self.assertFalse(self.attach_model.search(error_domain))
+        line = invoice.invoice_line_ids[0]
+        price_unit = line.price_unit
+        line.price_unit = price_unit + 10
+        self.assertEqual(self.attach_model.search(error_domain), attachment)
+        self.assertTrue(attachment.e_invoice_validation_error)
+        line.price_unit = price_unit
+        self.assertFalse(self.attach_model.search(error_domain))
+        self.assertFalse(attachment.e_invoice_validation_error)
+
+    def test_65_attachment_validation_message(self):
+        # No Ritenuta lines set
+        res = self.run_wizard('test65', 'IT01234567890_FPR08.xml')
+        invoice = self.invoice_model.browse(res.get('domain')[0][2][0])
+        self.assertTrue(invoice.e_invoice_validation_error)
+        attachment = invoice.fatturapa_attachment_in_id
+        self.assertIn(
+            invoice.e_invoice_validation_message,
+            attachment.e_invoice_validation_message)
+        self.assertIn(attachment, self.attach_model.search(
+            [('e_invoice_validation_error', '=', True)]))
+        invoice.action_invoice_cancel()
+        self.assertNotIn(attachment, self.attach_model.search(
+            [('e_invoice_validation_error', '=', True)]))
+
     def test_01_xml_link(self):
         """
         E-invoice lines are created.
@@ -0,0 +1,54 @@
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+@contextmanager
+def no_profile():
+    yield
+
+
+class ImportProfiler(object):
+    """Wall time and SQL queries of the phases of an e-bill import,
+    for each e-bill file.
+
+    Phases can be nested: the time and the queries of a phase do not
+    include the ones of the phases nested in it."""
+
+    def __init__(self, cr):
+        self.cr = cr
+        self.attachment_id = False
+        self._stack = []
+        # (attachment id, phase): [calls, duration, queries]
+        self.results = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        # start time, start queries, nested time, nested queries
+        frame = [time.time(), self.cr.sql_log_count, 0.0, 0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            duration = time.time() - frame[0]
+            queries = self.cr.sql_log_count - frame[1]
+            if self._stack:
+                self._stack[-1][2] += duration
+                self._stack[-1][3] += queries
+            result = self.results.setdefault(
+                (self.attachment_id, name), [0, 0.0, 0])
+            result[0] += 1
+            result[1] += duration - frame[2]
+            result[2] += queries - frame[3]
+
+    def get_vals_list(self):
+        """Values of the fatturapa.import.profile records of the results"""
+        return [{
+            'attachment_id': attachment_id,
+            'phase': phase,
+            'calls': calls,
+            'duration': duration,
+            'queries': queries,
+        } for (attachment_id, phase), (calls, duration, queries)
+            in self.results.items()]
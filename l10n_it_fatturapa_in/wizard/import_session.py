@@ -0,0 +1,45 @@
+from collections import Counter
+
+
+class ImportSession(object):
+    """Results of the searches done while importing a batch of e-bills.
+
+    Every lookup is identified by a name and a key, for instance
+    ('currency', 'EUR'); the ids found by the first search are reused
+    by the following ones. Lookups whose records may be created by the
+    import itself must be invalidated after the creation."""
+
+    def __init__(self):
+        self._results = {}
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def get(self, lookup, key, search):
+        """ids found for key by lookup, search() is called to get them
+        the first time"""
+        results = self._results.setdefault(lookup, {})
+        if key in results:
+            self.hits[lookup] += 1
+            return results[key]
+        self.misses[lookup] += 1
+        ids = results[key] = search()
+        return ids
+
+    def set(self, lookup, key, ids):
+        """Store ids found for key by lookup without searching,
+        for results computed in bulk"""
+        self._results.setdefault(lookup, {})[key] = ids
+
+    def invalidate(self, lookup, key=None):
+        results = self._results.get(lookup, {})
+        if key is None:
+            results.clear()
+        else:
+            results.pop(key, None)
+
+    def format_stats(self):
+        return ', '.join(
+            '%s %d/%d' % (
+                lookup, self.hits[lookup],
+                self.hits[lookup] + self.misses[lookup])
+            for lookup in sorted(set(self.hits) | set(self.misses)))
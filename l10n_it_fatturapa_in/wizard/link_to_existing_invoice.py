@@ -3,12 +3,12 @@
 from odoo import models, api, fields
 from odoo.tools.translate import _
 from odoo.exceptions import UserError
-from odoo.addons.l10n_it_fatturapa.bindings import fatturapa
+
+from ..models.attachment import get_e_invoice_fingerprint
 
 
 def get_invoice_obj(fatturapa_attachment):
-    xml_string = fatturapa_attachment.get_xml_string()
-    return fatturapa.CreateFromDocument(xml_string)
+    return fatturapa_attachment.get_fatturapa_obj()
 
 
 class WizardLinkToInvoiceLine(models.TransientModel):
@@ -54,6 +54,8 @@ class WizardLinkToInvoiceLine(models.TransientModel):
         cedentePrestatore = fatt.FatturaElettronicaHeader.CedentePrestatore
 
         self.invoice_id.fatturapa_attachment_in_id = fatturapa_attachment
+        self.invoice_id.e_invoice_fingerprint = get_e_invoice_fingerprint(
+            fatt.FatturaElettronicaHeader, FatturaBody)
 
         self.invoice_id.set_einvoice_data(FatturaBody)
 
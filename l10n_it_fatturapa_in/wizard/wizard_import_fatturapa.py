@@ -2,15 +2,19 @@
 
 import logging
 import re
-import odoo
 from odoo import models, api, fields
 from odoo.tools import float_is_zero
 from odoo.tools.translate import _
 from odoo.exceptions import UserError
 
-from odoo.addons.l10n_it_fatturapa.bindings import fatturapa
+from odoo.addons.l10n_it_fatturapa.bindings import get_binding_module
 from odoo.addons.base_iban.models.res_partner_bank import pretty_iban
 
+from ..models.attachment import get_e_invoice_fingerprint
+from ..models.decimal_precision import override_precisions
+from .import_profiler import ImportProfiler, no_profile
+from .import_session import ImportSession
+
 _logger = logging.getLogger(__name__)
 
 WT_CODES_MAPPING = {
@@ -56,6 +60,10 @@ class WizardImportFatturapa(models.TransientModel):
         "Discounts decimal digits", required=True,
         help="Decimal digits used for discount field. See \"Prices decimal digits\"."
     )
+    duplicate_invoice_ids = fields.Many2many(
+        'account.invoice', string="Bills already registered", readonly=True,
+        help="Bills registered from other files with the same e-bills "
+             "of the files being imported.")
 
     @api.model
     def default_get(self, fields):
@@ -70,6 +78,7 @@ class WizardImportFatturapa(models.TransientModel):
         fatturapa_attachment_ids = self.env.context.get('active_ids', False)
         fatturapa_attachment_obj = self.env['fatturapa.attachment.in']
         partners = self.env['res.partner']
+        duplicate_invoices = self.env['account.invoice']
         for fatturapa_attachment_id in fatturapa_attachment_ids:
             fatturapa_attachment = fatturapa_attachment_obj.browse(
                 fatturapa_attachment_id)
@@ -78,6 +87,7 @@ class WizardImportFatturapa(models.TransientModel):
                     _("File %s is linked to bills yet.")
                     % fatturapa_attachment.name)
             partners |= fatturapa_attachment.xml_supplier_id
+            duplicate_invoices |= fatturapa_attachment.duplicate_invoice_ids
             if len(partners) == 1:
                 res['e_invoice_detail_level'] = (
                     partners[0].e_invoice_detail_level)
@@ -90,18 +100,45 @@ class WizardImportFatturapa(models.TransientModel):
                 if partners[0].e_invoice_discount_decimal_digits >= 0:
                     res["discount_decimal_digits"] = (
                         partners[0].e_invoice_discount_decimal_digits)
+        res['duplicate_invoice_ids'] = [(6, 0, duplicate_invoices.ids)]
         return res
 
+    def _cached_search(self, lookup, key, model_name, domain, **kwargs):
+        """Search model_name, remembering the result for key in the
+        import session of the context if any, see ImportSession"""
+        model = self.env[model_name]
+        session = self.env.context.get('fatturapa_import_session')
+        if session is None:
+            return model.search(domain, **kwargs)
+        return model.browse(session.get(
+            lookup, key, lambda: model.search(domain, **kwargs).ids))
+
+    def _profile(self, phase):
+        """Context manager timing phase of the import, if the import
+        is profiled, see ImportProfiler"""
+        profiler = self.env.context.get('fatturapa_import_profiler')
+        if profiler is None:
+            return no_profile()
+        return profiler.phase(phase)
+
+    def _invalidate_cached_search(self, lookup, key=None):
+        """To be called when records that lookup could find are created"""
+        session = self.env.context.get('fatturapa_import_session')
+        if session is not None:
+            session.invalidate(lookup, key)
+
     def CountryByCode(self, CountryCode):
-        country_model = self.env['res.country']
-        return country_model.search([('code', '=', CountryCode)])
+        return self._cached_search(
+            'country', CountryCode,
+            'res.country', [('code', '=', CountryCode)])
 
     def ProvinceByCode(self, provinceCode):
-        province_model = self.env['res.country.state']
-        return province_model.search([
-            ('code', '=', provinceCode),
-            ('country_id.code', '=', 'IT')
-        ])
+        return self._cached_search(
+            'province', provinceCode,
+            'res.country.state', [
+                ('code', '=', provinceCode),
+                ('country_id.code', '=', 'IT')
+            ])
 
     def log_inconsistency(self, message):
         inconsistencies = self.env.context.get('inconsistencies', '')
@@ -146,25 +183,73 @@ class WizardImportFatturapa(models.TransientModel):
                 % (DatiAnagrafici.Anagrafica.Cognome, partner.lastname)
             )
 
-    def getPartnerBase(self, DatiAnagrafici, supplier=True):
-        if not DatiAnagrafici:
-            return False
-
-        def search_partner(domain):
-            if (
-                self.env.context.get('from_attachment') and
-                res_partner_rule and res_partner_rule.active
-            ):
-                att = self.env.context.get('from_attachment')
-                domain.extend([
-                    '|',
-                    ('company_id', 'child_of', att.company_id.id),
-                    ('company_id', '=', False)
-                ])
-            return partner_model.search(domain)
+    def _get_partner_rule_active(self):
+        def get_rule_active():
+            res_partner_rule = self.env['ir.model.data'].sudo().xmlid_to_object(
+                "base.res_partner_rule", raise_if_not_found=False)
+            return bool(res_partner_rule and res_partner_rule.active)
+
+        session = self.env.context.get('fatturapa_import_session')
+        if session is None:
+            return get_rule_active()
+        return session.get('partner_rule', None, get_rule_active)
+
+    def _get_partner_company_domain(self):
+        """Partners visible from the attachment company, if the partner
+        is searched while computing the data of an attachment"""
+        att = self.env.context.get('from_attachment')
+        if att and self._get_partner_rule_active():
+            return [
+                '|',
+                ('company_id', 'child_of', att.company_id.id),
+                ('company_id', '=', False)
+            ]
+        return []
+
+    @staticmethod
+    def _get_partner_search_domain(vat, cf):
+        domain = []
+        if vat:
+            domain.append(('sanitized_vat', '=', vat))
+        if cf:
+            domain.append(('fiscalcode', '=', cf))
+        return domain
+
+    def _get_partner_search_key(self, vat, cf):
+        att = self.env.context.get('from_attachment')
+        return vat, cf, att and att.company_id.id
+
+    @staticmethod
+    def _get_partner_search_keys(vat, cf):
+        """(vat, cf) pairs searched by _search_partners_by_priority"""
+        keys = []
+        if vat and cf:
+            keys.append((vat, cf))
+        if vat:
+            keys.append((vat, False))
+        if cf:
+            keys.append((False, cf))
+        return keys
+
+    def _search_partner(self, vat, cf):
+        """Partners with both vat and cf, or the one of them that is set"""
+        return self._cached_search(
+            'partner', self._get_partner_search_key(vat, cf),
+            'res.partner',
+            self._get_partner_search_domain(vat, cf) +
+            self._get_partner_company_domain())
+
+    def _search_partners_by_priority(self, vat, cf):
+        partners = self.env['res.partner']
+        if vat and cf:
+            partners = self._search_partner(vat, cf)
+        if not partners and vat:
+            partners = self._search_partner(vat, False)
+        if not partners and cf:
+            partners = self._search_partner(False, cf)
+        return partners
 
-        partner_model = self.env['res.partner']
-        cf = DatiAnagrafici.CodiceFiscale or False
+    def _get_partner_vat(self, DatiAnagrafici, supplier=True):
         vat = False
         if DatiAnagrafici.IdFiscaleIVA:
             # Format Italian VAT ID to always have 11 char
@@ -193,22 +278,51 @@ class WizardImportFatturapa(models.TransientModel):
                     DatiAnagrafici.IdFiscaleIVA.IdPaese.upper(),
                     re.sub(r'\W+', '', DatiAnagrafici.IdFiscaleIVA.IdCodice).upper()
                 )
-        partners = partner_model
-        res_partner_rule = self.env['ir.model.data'].sudo().xmlid_to_object(
-            "base.res_partner_rule", raise_if_not_found=False)
+        return vat
 
-        if vat and cf:
-            domain = [
-                ('sanitized_vat', '=', vat),
-                ('fiscalcode', '=', cf)
-            ]
-            partners = search_partner(domain)
-        if not partners and vat:
-            domain = [('sanitized_vat', '=', vat)]
-            partners = search_partner(domain)
-        if not partners and cf:
-            domain = [('fiscalcode', '=', cf)]
-            partners = search_partner(domain)
+    def _prepare_partner_vals(self, DatiAnagrafici, vat, cf, supplier=True):
+        country_id = False
+        if DatiAnagrafici.IdFiscaleIVA:
+            CountryCode = DatiAnagrafici.IdFiscaleIVA.IdPaese
+            countries = self.CountryByCode(CountryCode)
+            if countries:
+                country_id = countries[0].id
+            else:
+                raise UserError(
+                    _("Country Code %s not found in system.") % CountryCode
+                )
+        vals = {
+            'vat': vat,
+            'fiscalcode': cf,
+            'customer': False,
+            'supplier': supplier,
+            'is_company': (
+                DatiAnagrafici.Anagrafica.Denominazione and True or False),
+            'eori_code': DatiAnagrafici.Anagrafica.CodEORI or '',
+            'country_id': country_id,
+        }
+        if DatiAnagrafici.Anagrafica.Nome:
+            vals['firstname'] = DatiAnagrafici.Anagrafica.Nome
+        if DatiAnagrafici.Anagrafica.Cognome:
+            vals['lastname'] = DatiAnagrafici.Anagrafica.Cognome
+        if DatiAnagrafici.Anagrafica.Denominazione:
+            vals['name'] = DatiAnagrafici.Anagrafica.Denominazione
+        return vals
+
+    def _invalidate_partner_search(self, vat, cf):
+        """Searches that can find a partner created with vat and cf"""
+        for key in self._get_partner_search_keys(vat, cf):
+            self._invalidate_cached_search(
+                'partner', self._get_partner_search_key(*key))
+
+    def getPartnerBase(self, DatiAnagrafici, supplier=True):
+        if not DatiAnagrafici:
+            return False
+
+        partner_model = self.env['res.partner']
+        cf = DatiAnagrafici.CodiceFiscale or False
+        vat = self._get_partner_vat(DatiAnagrafici, supplier=supplier)
+        partners = self._search_partners_by_priority(vat, cf)
         commercial_partner_id = False
         if len(partners) > 1:
             for partner in partners:
@@ -230,34 +344,110 @@ class WizardImportFatturapa(models.TransientModel):
             return commercial_partner_id
         else:
             # partner to be created
-            country_id = False
-            if DatiAnagrafici.IdFiscaleIVA:
-                CountryCode = DatiAnagrafici.IdFiscaleIVA.IdPaese
-                countries = self.CountryByCode(CountryCode)
-                if countries:
-                    country_id = countries[0].id
-                else:
-                    raise UserError(
-                        _("Country Code %s not found in system.") % CountryCode
-                    )
-            vals = {
-                'vat': vat,
-                'fiscalcode': cf,
-                'customer': False,
-                'supplier': supplier,
-                'is_company': (
-                    DatiAnagrafici.Anagrafica.Denominazione and True or False),
-                'eori_code': DatiAnagrafici.Anagrafica.CodEORI or '',
-                'country_id': country_id,
-            }
-            if DatiAnagrafici.Anagrafica.Nome:
-                vals['firstname'] = DatiAnagrafici.Anagrafica.Nome
-            if DatiAnagrafici.Anagrafica.Cognome:
-                vals['lastname'] = DatiAnagrafici.Anagrafica.Cognome
-            if DatiAnagrafici.Anagrafica.Denominazione:
-                vals['name'] = DatiAnagrafici.Anagrafica.Denominazione
+            vals = self._prepare_partner_vals(
+                DatiAnagrafici, vat, cf, supplier=supplier)
+            partner_id = partner_model.create(vals).id
+            self._invalidate_partner_search(vat, cf)
+            return partner_id
+
+    def prefetch_suppliers(self, fatturapa_attachments):
+        """Resolve the suppliers of all the e-bills with one search,
+        and create the missing ones with one create.
+
+        The partners found are stored in the import session of the context,
+        where getPartnerBase reads them"""
+        session = self.env.context.get('fatturapa_import_session')
+        if session is None or self.env.context.get('from_attachment'):
+            return
+        suppliers = []
+        for fatturapa_attachment in fatturapa_attachments:
+            fatt = self.get_invoice_summary_obj(fatturapa_attachment)
+            dati_generali_documento = fatt.FatturaElettronicaBody[0] \
+                .DatiGenerali.DatiGeneraliDocumento
+            if dati_generali_documento.TipoDocumento in ('TD17', 'TD18', 'TD19'):
+                # the partner of self-invoices is read from the related invoice
+                continue
+            DatiAnagrafici = \
+                fatt.FatturaElettronicaHeader.CedentePrestatore.DatiAnagrafici
+            cf = DatiAnagrafici.CodiceFiscale or False
+            vat = self._get_partner_vat(DatiAnagrafici)
+            if vat or cf:
+                suppliers.append((vat, cf, DatiAnagrafici))
+        if not suppliers:
+            return
 
-            return partner_model.create(vals).id
+        partner_model = self.env['res.partner']
+        vats = list({vat for vat, cf, dati in suppliers if vat})
+        cfs = list({cf for vat, cf, dati in suppliers if cf})
+        candidates = partner_model.search(
+            ['|', ('sanitized_vat', 'in', vats), ('fiscalcode', 'in', cfs)])
+        for vat, cf, dati in suppliers:
+            for key in self._get_partner_search_keys(vat, cf):
+                domain_vat, domain_cf = key
+                session.set(
+                    'partner', self._get_partner_search_key(*key),
+                    [partner.id for partner in candidates if (
+                        (not domain_vat or partner.sanitized_vat == domain_vat) and
+                        (not domain_cf or partner.fiscalcode == domain_cf))])
+
+        # Suppliers that getPartnerBase would create: like there,
+        # a supplier with the VAT number, or else the fiscal code,
+        # of one created before is not created again
+        to_create = []
+        for vat, cf, dati in suppliers:
+            if self._search_partners_by_priority(vat, cf):
+                continue
+            created_vats = [created_vat for created_vat, c, v in to_create]
+            created_cfs = [created_cf for v, created_cf, c in to_create]
+            if (vat and vat in created_vats) or (cf and cf in created_cfs):
+                continue
+            to_create.append(
+                (vat, cf, self._prepare_partner_vals(dati, vat, cf)))
+        if not to_create:
+            return
+        partners = partner_model.create([vals for vat, cf, vals in to_create])
+        for partner, (vat, cf, vals) in zip(partners, to_create):
+            for key in self._get_partner_search_keys(vat, cf):
+                session.set(
+                    'partner', self._get_partner_search_key(*key),
+                    partner.ids)
+
+    @staticmethod
+    def _get_autoinvoice_info(dati_generali):
+        return dict([
+            value.split(':') for value in dati_generali.Causale or []
+            if ':' in value])
+
+    def _get_autoinvoice_partner(self, invoice_info):
+        """Partner of the bill that self-invoice refers to, if any"""
+        autoinvoices = self.env['account.invoice'].search([
+            ('number', '=', invoice_info['Riferimento interno'].strip()),
+            ('reference', '=', invoice_info['Riferimento'].strip()),
+            ('type', 'in', ('in_invoice', 'in_refund'))
+        ], limit=1)
+        return autoinvoices.partner_id.id
+
+    def searchPartnerBase(self, DatiAnagrafici, supplier=True):
+        """Existing partner of DatiAnagrafici, like getPartnerBase
+        but without creating or checking partners"""
+        if not DatiAnagrafici:
+            return False
+        cf = DatiAnagrafici.CodiceFiscale or False
+        vat = self._get_partner_vat(DatiAnagrafici, supplier=supplier)
+        commercial_partners = self._search_partners_by_priority(
+            vat, cf).mapped('commercial_partner_id')
+        if len(commercial_partners) != 1:
+            return False
+        return commercial_partners.id
+
+    def searchCedPrest(self, cedPrest, dati_generali):
+        """Existing partner of the supplier, without any write:
+        getCedPrest creates or updates it during the import"""
+        if dati_generali.TipoDocumento in ('TD17', 'TD18', 'TD19'):
+            invoice_info = self._get_autoinvoice_info(dati_generali)
+            if invoice_info:
+                return self._get_autoinvoice_partner(invoice_info)
+        return self.searchPartnerBase(cedPrest.DatiAnagrafici)
 
     def getCedPrest(self, cedPrest, dati_generali):
         partner_model = self.env['res.partner']
@@ -272,16 +462,10 @@ class WizardImportFatturapa(models.TransientModel):
             #     ('fiscal_document_type_id.code', '=', dati_generali.TipoDocumento),
             #     ('type', 'in', ('out_invoice', 'out_refund'))
             # ])
-            invoice_info = dict([value.split(':') for value in dati_generali.Causale if ':' in value])
+            invoice_info = self._get_autoinvoice_info(dati_generali)
             if invoice_info:
-                autoinvoices = self.env['account.invoice'].search([
-                    ('number', '=', invoice_info['Riferimento interno'].strip()),
-                    ('reference', '=', invoice_info['Riferimento'].strip()),
-                    ('type', 'in', ('in_invoice', 'in_refund'))
-                ])
-                if autoinvoices:
-                    partner_id = autoinvoices[0].partner_id.id
-                else:
+                partner_id = self._get_autoinvoice_partner(invoice_info)
+                if not partner_id:
                     message = f"Can't find relative partner for Autoinvoice {dati_generali.Numero} del {dati_generali.Data}"
                     _logger.info(message)
                     raise Exception(message)
@@ -412,24 +596,50 @@ class WizardImportFatturapa(models.TransientModel):
             retLine['invoice_line_tax_ids'] = [(6, 0, [account_taxes[0].id])]
         return retLine
 
-    def get_account_taxes(self, AliquotaIVA, Natura):
-        account_tax_model = self.env['account.tax']
-        # check if a default tax exists and generate def_purchase_tax object
+    def get_default_purchase_tax(self):
+        """First of the default supplier taxes of products, if any"""
         ir_values = self.env['ir.default']
         company_id = self.env['res.company']._company_default_get(
             'account.invoice.line').id
-        supplier_taxes_ids = ir_values.get(
-            'product.product', 'supplier_taxes_id', company_id=company_id)
-        def_purchase_tax = False
+        session = self.env.context.get('fatturapa_import_session')
+        if session is None:
+            supplier_taxes_ids = ir_values.get(
+                'product.product', 'supplier_taxes_id', company_id=company_id)
+        else:
+            supplier_taxes_ids = session.get(
+                'default_supplier_taxes', company_id,
+                lambda: ir_values.get(
+                    'product.product', 'supplier_taxes_id',
+                    company_id=company_id))
         if supplier_taxes_ids:
-            def_purchase_tax = account_tax_model.browse(supplier_taxes_ids)[0]
+            return self.env['account.tax'].browse(supplier_taxes_ids)[0]
+        return False
+
+    def search_taxes_by_nature(self, Natura):
+        return self._cached_search(
+            'tax_by_nature', Natura,
+            'account.tax', [
+                ('type_tax_use', '=', 'purchase'),
+                ('kind_id.code', '=', Natura),
+                ('amount', '=', 0.0),
+            ], order='sequence')
+
+    def search_taxes_by_rate(self, AliquotaIVA):
+        return self._cached_search(
+            'tax_by_rate', float(AliquotaIVA),
+            'account.tax', [
+                ('type_tax_use', '=', 'purchase'),
+                ('amount', '=', float(AliquotaIVA)),
+                ('price_include', '=', False),
+                # partially deductible VAT must be set by user
+                ('children_tax_ids', '=', False),
+            ], order='sequence')
+
+    def get_account_taxes(self, AliquotaIVA, Natura):
+        # check if a default tax exists and generate def_purchase_tax object
+        def_purchase_tax = self.get_default_purchase_tax()
         if float(AliquotaIVA) == 0.0 and Natura:
-            account_taxes = account_tax_model.search(
-                [
-                    ('type_tax_use', '=', 'purchase'),
-                    ('kind_id.code', '=', Natura),
-                    ('amount', '=', 0.0),
-                ], order='sequence')
+            account_taxes = self.search_taxes_by_nature(Natura)
             if not account_taxes:
                 self.log_inconsistency(
                     _('No tax with percentage '
@@ -443,14 +653,7 @@ class WizardImportFatturapa(models.TransientModel):
                     % (AliquotaIVA, Natura,
                        account_taxes[0].description))
         else:
-            account_taxes = account_tax_model.search(
-                [
-                    ('type_tax_use', '=', 'purchase'),
-                    ('amount', '=', float(AliquotaIVA)),
-                    ('price_include', '=', False),
-                    # partially deductible VAT must be set by user
-                    ('children_tax_ids', '=', False),
-                ], order='sequence')
+            account_taxes = self.search_taxes_by_rate(AliquotaIVA)
             if not account_taxes:
                 self.log_inconsistency(
                     _(
@@ -476,27 +679,51 @@ class WizardImportFatturapa(models.TransientModel):
                     account_taxes = def_purchase_tax
         return account_taxes
 
+    def _get_supplier_products(self, partner):
+        """Map the product codes of partner to the ids of their products,
+        the id of the default product of partner is under key False.
+
+        The map is read once for each supplier in the import session"""
+        def read_supplier_products():
+            codes = {}
+            supplier_infos = self.env['product.supplierinfo'].search([
+                ('name', '=', partner.id),
+                ('product_code', '!=', False),
+            ])
+            for supplier_info in supplier_infos:
+                products, templates = codes.setdefault(
+                    supplier_info.product_code, (set(), set()))
+                if supplier_info.product_id:
+                    products.add(supplier_info.product_id)
+                templates.add(supplier_info.product_tmpl_id)
+            supplier_products = {
+                False: partner.e_invoice_default_product_id.id}
+            for code, (products, templates) in codes.items():
+                product = None
+                if len(products) == 1:
+                    product = products.pop()
+                elif len(templates) == 1:
+                    template = templates.pop()
+                    product = (template.product_variant_ids and
+                               template.product_variant_ids[0])
+                supplier_products[code] = product and product.id
+            return supplier_products
+
+        session = self.env.context.get('fatturapa_import_session')
+        if session is None:
+            return read_supplier_products()
+        return session.get(
+            'supplier_products', partner.id, read_supplier_products)
+
     def get_line_product(self, line, partner):
-        product = None
-        supplier_info = self.env['product.supplierinfo']
+        supplier_products = self._get_supplier_products(partner)
+        product_id = False
         if len(line.CodiceArticolo) == 1:
             supplier_code = line.CodiceArticolo[0].CodiceValore
-            supplier_infos = supplier_info.search([
-                ('product_code', '=', supplier_code),
-                ('name', '=', partner.id)
-            ])
-            if supplier_infos:
-                products = supplier_infos.mapped('product_id')
-                if len(products) == 1:
-                    product = products[0]
-                else:
-                    templates = supplier_infos.mapped('product_tmpl_id')
-                    if len(templates) == 1:
-                        product = (templates.product_variant_ids
-                                   and templates.product_variant_ids[0])
-        if not product and partner.e_invoice_default_product_id:
-            product = partner.e_invoice_default_product_id
-        return product
+            product_id = supplier_products.get(supplier_code)
+        if not product_id:
+            product_id = supplier_products[False]
+        return self.env['product.product'].browse(product_id) or None
 
     def adjust_accounting_data(self, product, line_vals):
         if product.product_tmpl_id.property_account_expense_id:
@@ -636,9 +863,9 @@ class WizardImportFatturapa(models.TransientModel):
         Natura = line.Natura or False
         kind_id = False
         if Natura:
-            kind = self.env['account.tax.kind'].search([
-                ('code', '=', Natura)
-            ])
+            kind = self._cached_search(
+                'tax_kind', Natura,
+                'account.tax.kind', [('code', '=', Natura)])
             if not kind:
                 self.log_inconsistency(
                     _("Tax kind %s not found") % Natura
@@ -647,14 +874,13 @@ class WizardImportFatturapa(models.TransientModel):
                 kind_id = kind[0].id
 
         RiferimentoAmministrazione = line.RiferimentoAmministrazione or ''
-        WelfareTypeModel = self.env['welfare.fund.type']
         if not TipoCassa:
             raise UserError(
                 _('Welfare Fund is not defined.')
             )
-        WelfareType = WelfareTypeModel.search(
-            [('name', '=', TipoCassa)]
-        )
+        WelfareType = self._cached_search(
+            'welfare_fund_type', TipoCassa,
+            'welfare.fund.type', [('name', '=', TipoCassa)])
 
         res = {
             'welfare_rate_tax': AlCassa,
@@ -746,13 +972,13 @@ class WizardImportFatturapa(models.TransientModel):
         details = line.DettaglioPagamento or False
         if details:
             PaymentModel = self.env['fatturapa.payment.detail']
-            PaymentMethodModel = self.env['fatturapa.payment_method']
             BankModel = self.env['res.bank']
             PartnerBankModel = self.env['res.partner.bank']
             for dline in details:
-                method = PaymentMethodModel.search(
-                    [('code', '=', dline.ModalitaPagamento)]
-                )
+                method = self._cached_search(
+                    'payment_method', dline.ModalitaPagamento,
+                    'fatturapa.payment_method',
+                    [('code', '=', dline.ModalitaPagamento)])
                 if not method:
                     raise UserError(
                         _(
@@ -807,9 +1033,9 @@ class WizardImportFatturapa(models.TransientModel):
                 bank = False
                 payment_bank_id = False
                 if dline.BIC:
-                    banks = BankModel.search(
-                        [('bic', '=', dline.BIC.strip())]
-                    )
+                    banks = self._cached_search(
+                        'bank', dline.BIC.strip(),
+                        'res.bank', [('bic', '=', dline.BIC.strip())])
                     if not banks:
                         if not dline.IstitutoFinanziario:
                             self.log_inconsistency(
@@ -823,6 +1049,8 @@ class WizardImportFatturapa(models.TransientModel):
                                     'bic': dline.BIC,
                                 }
                             )
+                            self._invalidate_cached_search(
+                                'bank', dline.BIC.strip())
                     else:
                         bank = banks[0]
                 if dline.IBAN:
@@ -835,7 +1063,9 @@ class WizardImportFatturapa(models.TransientModel):
                         ('partner_id', '=', partner_id),
                     ]
                     payment_bank_id = False
-                    payment_banks = PartnerBankModel.search(SearchDom)
+                    payment_banks = self._cached_search(
+                        'partner_bank', (iban, partner_id),
+                        'res.partner.bank', SearchDom)
                     if not payment_banks and not bank:
                         self.log_inconsistency(
                             _(
@@ -867,6 +1097,8 @@ class WizardImportFatturapa(models.TransientModel):
                                     'bank_bic': dline.BIC or bank.bic
                                 }
                             ).id
+                            self._invalidate_cached_search(
+                                'partner_bank', (iban, partner_id))
                     if payment_banks:
                         payment_bank_id = payment_banks[0].id
 
@@ -892,9 +1124,9 @@ class WizardImportFatturapa(models.TransientModel):
                 CedentePrestatore.StabileOrganizzazione.Nazione)
 
     def get_purchase_journal(self, company):
-        journal_model = self.env['account.journal']
-        journals = journal_model.search(
-            [
+        journals = self._cached_search(
+            'purchase_journal', company.id,
+            'account.journal', [
                 ('type', '=', 'purchase'),
                 ('company_id', '=', company.id)
             ],
@@ -908,8 +1140,8 @@ class WizardImportFatturapa(models.TransientModel):
             )
         return journals[0]
 
-    def create_e_invoice_line(self, line):
-        vals = {
+    def _prepare_e_invoice_line(self, line):
+        return {
             'line_number': int(line.NumeroLinea or 0),
             'service_type': line.TipoCessionePrestazione,
             'name': line.Descrizione,
@@ -924,44 +1156,49 @@ class WizardImportFatturapa(models.TransientModel):
             'tax_kind': line.Natura,
             'admin_ref': line.RiferimentoAmministrazione,
         }
-        einvoiceline = self.env['einvoice.line'].create(vals)
-        if line.CodiceArticolo:
-            for caline in line.CodiceArticolo:
-                self.env['fatturapa.article.code'].create(
-                    {
-                        'name': caline.CodiceTipo or '',
-                        'code_val': caline.CodiceValore or '',
-                        'e_invoice_line_id': einvoiceline.id
-                    }
-                )
-        if line.ScontoMaggiorazione:
-            for DiscRisePriceLine in line.ScontoMaggiorazione:
-                DiscRisePriceVals = self.with_context(
+
+    def create_e_invoice_lines(self, lines):
+        """Create the e-bill lines of `lines` and their article codes,
+        discounts and other data, with one create for each model"""
+        einvoicelines = self.env['einvoice.line'].create(
+            [self._prepare_e_invoice_line(line) for line in lines])
+        article_codes = []
+        disc_rise_prices = []
+        other_datas = []
+        for line, einvoiceline in zip(lines, einvoicelines):
+            for caline in line.CodiceArticolo or []:
+                article_codes.append({
+                    'name': caline.CodiceTipo or '',
+                    'code_val': caline.CodiceValore or '',
+                    'e_invoice_line_id': einvoiceline.id
+                })
+            for DiscRisePriceLine in line.ScontoMaggiorazione or []:
+                disc_rise_prices.append(self.with_context(
                     drtype='e_invoice_line_id'
                 )._prepareDiscRisePriceLine(
                     einvoiceline.id, DiscRisePriceLine
-                )
-                self.env['discount.rise.price'].create(DiscRisePriceVals)
-        if line.AltriDatiGestionali:
-            for dato in line.AltriDatiGestionali:
-                self.env['einvoice.line.other.data'].create(
-                    {
-                        'name': dato.TipoDato,
-                        'text_ref': dato.RiferimentoTesto,
-                        'num_ref': float(dato.RiferimentoNumero or 0),
-                        'date_ref': dato.RiferimentoData,
-                        'e_invoice_line_id': einvoiceline.id
-                    }
-                )
-        return einvoiceline
+                ))
+            for dato in line.AltriDatiGestionali or []:
+                other_datas.append({
+                    'name': dato.TipoDato,
+                    'text_ref': dato.RiferimentoTesto,
+                    'num_ref': float(dato.RiferimentoNumero or 0),
+                    'date_ref': dato.RiferimentoData,
+                    'e_invoice_line_id': einvoiceline.id
+                })
+        self.env['fatturapa.article.code'].create(article_codes)
+        self.env['discount.rise.price'].create(disc_rise_prices)
+        self.env['einvoice.line.other.data'].create(other_datas)
+        return einvoicelines
+
+    def create_e_invoice_line(self, line):
+        return self.create_e_invoice_lines([line])
 
     def invoiceCreate(
         self, fatt, fatturapa_attachment, FatturaBody, partner_id
     ):
         partner_model = self.env['res.partner']
         invoice_model = self.env['account.invoice']
-        currency_model = self.env['res.currency']
-        ftpa_doctype_model = self.env['fiscal.document.type']
         rel_docs_model = self.env['fatturapa.related_document_type']
 
         company = self.env.user.company_id
@@ -969,13 +1206,10 @@ class WizardImportFatturapa(models.TransientModel):
         pay_acc_id = partner.property_account_payable_id.id
 
         # currency 2.1.1.2
-        currency = currency_model.search(
-            [
-                (
-                    'name', '=',
-                    FatturaBody.DatiGenerali.DatiGeneraliDocumento.Divisa
-                )
-            ])
+        Divisa = FatturaBody.DatiGenerali.DatiGeneraliDocumento.Divisa
+        currency = self._cached_search(
+            'currency', Divisa,
+            'res.currency', [('name', '=', Divisa)])
         if not currency:
             raise UserError(
                 _(
@@ -991,11 +1225,9 @@ class WizardImportFatturapa(models.TransientModel):
         invtype = 'in_invoice'
         docType = FatturaBody.DatiGenerali.DatiGeneraliDocumento.TipoDocumento
         if docType:
-            docType_record = ftpa_doctype_model.search(
-                [
-                    ('code', '=', docType)
-                ]
-            )
+            docType_record = self._cached_search(
+                'document_type', docType,
+                'fiscal.document.type', [('code', '=', docType)])
             if docType_record:
                 docType_id = docType_record[0].id
             else:
@@ -1034,6 +1266,8 @@ class WizardImportFatturapa(models.TransientModel):
             'payment_term_id': partner.property_supplier_payment_term_id.id,
             'company_id': company.id,
             'fatturapa_attachment_in_id': fatturapa_attachment.id,
+            'e_invoice_fingerprint': get_e_invoice_fingerprint(
+                fatt.FatturaElettronicaHeader, FatturaBody),
             'comment': comment
         }
 
@@ -1047,10 +1281,12 @@ class WizardImportFatturapa(models.TransientModel):
         wt_founds = self.set_withholding_tax(FatturaBody, invoice_data)
 
         # 2.2.1
-        self.set_invoice_line_ids(
-            FatturaBody, credit_account_id, partner, wt_founds, invoice_data)
+        with self._profile('lines'):
+            self.set_invoice_line_ids(
+                FatturaBody, credit_account_id, partner, wt_founds,
+                invoice_data)
 
-        self.set_e_invoice_lines(FatturaBody, invoice_data)
+            self.set_e_invoice_lines(FatturaBody, invoice_data)
 
         invoice = invoice_model.create(invoice_data)
 
@@ -1107,20 +1343,23 @@ class WizardImportFatturapa(models.TransientModel):
         self.set_vehicles_data(FatturaBody, invoice)
 
         # 2.4
-        self.set_payments_data(FatturaBody, invoice_id, partner_id)
+        with self._profile('payments'):
+            self.set_payments_data(FatturaBody, invoice_id, partner_id)
 
         # 2.5
-        self.set_attachments_data(FatturaBody, invoice_id)
+        with self._profile('attachments'):
+            self.set_attachments_data(FatturaBody, invoice_id)
 
         self._addGlobalDiscount(
             invoice_id, FatturaBody.DatiGenerali.DatiGeneraliDocumento)
 
-        self.set_roundings(FatturaBody, invoice)
+        with self._profile('taxes'):
+            self.set_roundings(FatturaBody, invoice)
 
-        # compute the invoice
-        invoice.compute_taxes()
-        # this can happen with refunds with negative amounts
-        invoice.process_negative_lines()
+            # compute the invoice
+            invoice.compute_taxes()
+            # this can happen with refunds with negative amounts
+            invoice.process_negative_lines()
 
         # fiscal_document_type_id is wrong and overrides document type so we should reset it here
         if docType_id:
@@ -1299,14 +1538,15 @@ class WizardImportFatturapa(models.TransientModel):
                 self.env['account.invoice'].browse(invoice_id).date_due = due_dates[0]
         if PaymentsData:
             PaymentDataModel = self.env['fatturapa.payment.data']
-            PaymentTermsModel = self.env['fatturapa.payment_term']
             for PaymentLine in PaymentsData:
                 cond = PaymentLine.CondizioniPagamento or False
                 if not cond:
                     raise UserError(
                         _('Payment method code not found in document.')
                     )
-                terms = PaymentTermsModel.search([('code', '=', cond)])
+                terms = self._cached_search(
+                    'payment_term', cond,
+                    'fatturapa.payment_term', [('code', '=', cond)])
                 if not terms:
                     raise UserError(
                         _('Payment method code %s is incorrect.') % cond
@@ -1330,9 +1570,12 @@ class WizardImportFatturapa(models.TransientModel):
         invoice_data['ftpa_withholding_ids'] = []
         wt_founds = []
         for Withholding in Withholdings:
-            wts = self.env['withholding.tax'].search([
-                ('causale_pagamento_id.code', '=', Withholding.CausalePagamento)
-            ])
+            wts = self._cached_search(
+                'withholding_tax', Withholding.CausalePagamento,
+                'withholding.tax', [
+                    ('causale_pagamento_id.code', '=',
+                     Withholding.CausalePagamento)
+                ])
             if not wts:
                 raise UserError(_(
                     "The bill contains withholding tax with "
@@ -1461,21 +1704,16 @@ class WizardImportFatturapa(models.TransientModel):
                 summary_data_model.create(summary_line)
 
     def set_e_invoice_lines(self, FatturaBody, invoice_data):
-        e_invoice_lines = self.env['einvoice.line'].browse()
-        for line in FatturaBody.DatiBeniServizi.DettaglioLinee:
-            e_invoice_lines |= self.create_e_invoice_line(line)
+        e_invoice_lines = self.create_e_invoice_lines(
+            FatturaBody.DatiBeniServizi.DettaglioLinee)
         if e_invoice_lines:
             invoice_data['e_invoice_line_ids'] = [(6, 0, e_invoice_lines.ids)]
 
-    def _set_invoice_lines(self, product, invoice_line_data, invoice_lines,
-                           invoice_line_model):
-
+    def _set_invoice_lines(self, product, invoice_line_data, invoice_lines_vals):
         if product:
             invoice_line_data['product_id'] = product.id
             self.adjust_accounting_data(product, invoice_line_data)
-        invoice_line_id = invoice_line_model.create(
-            invoice_line_data).id
-        invoice_lines.append(invoice_line_id)
+        invoice_lines_vals.append(invoice_line_data)
 
     def set_invoice_line_ids(
             self, FatturaBody, credit_account_id, partner, wt_founds,
@@ -1484,26 +1722,29 @@ class WizardImportFatturapa(models.TransientModel):
         if self.e_invoice_detail_level == '0':
             return
 
-        invoice_lines = []
-        invoice_line_model = self.env['account.invoice.line']
+        # the lines are created together, the bill totals are computed
+        # once when they are linked to the bill
+        invoice_lines_vals = []
         if self.e_invoice_detail_level == '1':
             for nline, line in enumerate(FatturaBody.DatiBeniServizi.DatiRiepilogo):
                 invoice_line_data = self._prepareInvoiceLineAliquota(
                     credit_account_id, line, nline)
 
                 product = partner.e_invoice_default_product_id
-                self._set_invoice_lines(product, invoice_line_data, invoice_lines,
-                                        invoice_line_model)
+                self._set_invoice_lines(
+                    product, invoice_line_data, invoice_lines_vals)
 
         elif self.e_invoice_detail_level == '2':
             for line in FatturaBody.DatiBeniServizi.DettaglioLinee:
                 invoice_line_data = self._prepareInvoiceLine(
                     credit_account_id, line, wt_founds)
                 product = self.get_line_product(line, partner)
-                self._set_invoice_lines(product, invoice_line_data, invoice_lines,
-                                        invoice_line_model)
+                self._set_invoice_lines(
+                    product, invoice_line_data, invoice_lines_vals)
 
-        invoice_data['invoice_line_ids'] = [(6, 0, invoice_lines)]
+        invoice_lines = self.env['account.invoice.line'].create(
+            invoice_lines_vals)
+        invoice_data['invoice_line_ids'] = [(6, 0, invoice_lines.ids)]
 
     def check_invoice_amount(self, invoice, FatturaElettronicaBody):
         if (
@@ -1543,57 +1784,90 @@ class WizardImportFatturapa(models.TransientModel):
                 )
 
     def get_invoice_obj(self, fatturapa_attachment):
-        xml_string = fatturapa_attachment.get_xml_string()
-        return fatturapa.CreateFromDocument(xml_string)
-
-    def _set_decimal_precision(self, precision_name, field_name):
-        precision = self.env["decimal.precision"].search([
-            ("name", "=", precision_name)], limit=1)
-        different_precisions = original_precision = None
-        if precision:
-            precision_id = precision.id
-            original_precision = precision.digits
-            different_precisions = (
-                self[field_name] != original_precision)
-            if different_precisions:
-                with odoo.registry(self.env.cr.dbname).cursor() as new_cr:
-                    # We need a new env (and cursor) because 'digits' property of Float
-                    # fields is retrieved with a new LazyCursor,
-                    # see class Float at odoo.fields,
-                    # so we need to write (commit) to DB in order to make the new
-                    # precision available
-                    new_env = api.Environment(new_cr, self.env.uid, self.env.context)
-                    new_precision = new_env["decimal.precision"].browse(precision_id)
-                    new_precision.sudo().write({"digits": self[field_name]})
-                    new_cr.commit()
-        return precision, different_precisions, original_precision
-
-    def _restore_original_precision(self, precision, original_precision):
-        with odoo.registry(self.env.cr.dbname).cursor() as new_cr:
-            new_env = api.Environment(new_cr, self.env.uid, self.env.context)
-            new_price_precision = new_env["decimal.precision"].browse(precision.id)
-            new_price_precision.sudo().write({"digits": original_precision})
-            new_cr.commit()
+        return fatturapa_attachment.get_fatturapa_obj()
+
+    def iter_invoice_body_obj(self, fatturapa_attachment):
+        """Yield a binding object for each body of the e-bill,
+        containing the header and that body only: bodies are parsed
+        one at a time, when needed"""
+        binding = get_binding_module()
+        xml_roots = fatturapa_attachment.get_xml_body_trees()
+        while True:
+            with self._profile('parse'):
+                xml_root = next(xml_roots, None)
+            if xml_root is None:
+                return
+            with self._profile('sanitize'):
+                xml_root, problems = binding.sanitize(xml_root)
+            with self._profile('parse'):
+                fatt = binding.CreateFromSanitizedTree(xml_root, problems)
+            yield fatt
+
+    def get_invoice_summary_obj(self, fatturapa_attachment):
+        """Binding object with headers and general data of every body,
+        without lines, payments and attachments"""
+        return fatturapa_attachment.get_fatturapa_summary_obj()
 
     @api.multi
     def importFatturaPA(self):
         self.ensure_one()
+        # Prices, quantities and discounts are imported with the digits
+        # of the wizard, without changing decimal.precision for other users
+        with override_precisions({
+            "Product Price": self.price_decimal_digits,
+            "Product Unit of Measure": self.quantity_decimal_digits,
+            "Discount": self.discount_decimal_digits,
+        }):
+            return self._importFatturaPA()
+
+    @api.multi
+    def importFatturaPAInBackground(self):
+        """Import the selected files in background,
+        see fatturapa.import.job"""
+        self.ensure_one()
+        fatturapa_attachments = self.env['fatturapa.attachment.in'].browse(
+            self.env.context.get('active_ids', []))
+        job = self.env['fatturapa.import.job'].create_from_wizard(
+            self, fatturapa_attachments)
+        return {
+            'view_type': 'form',
+            'name': "E-bills Import",
+            'view_mode': 'form',
+            'res_model': 'fatturapa.import.job',
+            'res_id': job.id,
+            'type': 'ir.actions.act_window',
+        }
+
+    def _importFatturaPA(self):
         fatturapa_attachment_obj = self.env['fatturapa.attachment.in']
         fatturapa_attachment_ids = self.env.context.get('active_ids', False)
         invoice_model = self.env['account.invoice']
 
-        price_precision, different_price_precisions, original_price_precision =\
-            self._set_decimal_precision(
-                "Product Price", "price_decimal_digits")
-        qty_precision, different_qty_precisions, original_qty_precision =\
-            self._set_decimal_precision(
-                "Product Unit of Measure", "quantity_decimal_digits")
-        discount_precision, different_discount_precisions,\
-            original_discount_precision = self._set_decimal_precision(
-                "Discount", "discount_decimal_digits")
+        # Lookups repeated for every bill and line are done once per batch,
+        # the batch can span several imports sharing the session
+        session = self.env.context.get('fatturapa_import_session')
+        if session is None:
+            session = ImportSession()
+            self.__dict__.update(
+                self.with_context(fatturapa_import_session=session).__dict__
+            )
+
+        profiler = None
+        if (self.env.context.get('fatturapa_import_profile') or
+                self.env.user.fatturapa_import_profile):
+            profiler = ImportProfiler(self.env.cr)
+            self.__dict__.update(
+                self.with_context(fatturapa_import_profiler=profiler).__dict__
+            )
+
+        with self._profile('partner'):
+            self.prefetch_suppliers(
+                fatturapa_attachment_obj.browse(fatturapa_attachment_ids))
 
         new_invoices = []
         for fatturapa_attachment_id in fatturapa_attachment_ids:
+            if profiler is not None:
+                profiler.attachment_id = fatturapa_attachment_id
             self.__dict__.update(
                 self.with_context(inconsistencies='').__dict__
             )
@@ -1602,59 +1876,73 @@ class WizardImportFatturapa(models.TransientModel):
             if fatturapa_attachment.in_invoice_ids:
                 raise UserError(
                     _("File is linked to bills yet."))
-            fatt = self.get_invoice_obj(fatturapa_attachment)
-            cedentePrestatore = fatt.FatturaElettronicaHeader.CedentePrestatore
-            # 1.2
-            dati_generali_documento = fatt.FatturaElettronicaBody[0].DatiGenerali.DatiGeneraliDocumento
-            partner_id = self.getCedPrest(cedentePrestatore, dati_generali_documento)
-            # 1.3
-            TaxRappresentative = fatt.FatturaElettronicaHeader.\
-                RappresentanteFiscale
-            # 1.5
-            Intermediary = fatt.FatturaElettronicaHeader.\
-                TerzoIntermediarioOSoggettoEmittente
-
-            generic_inconsistencies = ''
-            if self.env.context.get('inconsistencies'):
-                generic_inconsistencies = (
-                    self.env.context['inconsistencies'] + '\n\n')
-
-            xmlproblems = getattr(fatt, '_xmldoctor', None)
-            if xmlproblems:  # None or []
-                generic_inconsistencies += '\n'.join(xmlproblems) + '\n\n'
-
             # 2
-            for fattura in fatt.FatturaElettronicaBody:
+            for body_nbr, fatt in enumerate(
+                    self.iter_invoice_body_obj(fatturapa_attachment)):
+                fattura = fatt.FatturaElettronicaBody[0]
+
+                if not body_nbr:
+                    # the header is the same for every body
+                    cedentePrestatore = \
+                        fatt.FatturaElettronicaHeader.CedentePrestatore
+                    # 1.2
+                    dati_generali_documento = \
+                        fattura.DatiGenerali.DatiGeneraliDocumento
+                    with self._profile('partner'):
+                        partner_id = self.getCedPrest(
+                            cedentePrestatore, dati_generali_documento)
+                        if fatturapa_attachment.xml_supplier_id.id != partner_id:
+                            # the supplier has been created during the import
+                            fatturapa_attachment.xml_supplier_id = partner_id
+                    # 1.3
+                    TaxRappresentative = fatt.FatturaElettronicaHeader.\
+                        RappresentanteFiscale
+                    # 1.5
+                    Intermediary = fatt.FatturaElettronicaHeader.\
+                        TerzoIntermediarioOSoggettoEmittente
+
+                    generic_inconsistencies = ''
+                    if self.env.context.get('inconsistencies'):
+                        generic_inconsistencies = (
+                            self.env.context['inconsistencies'] + '\n\n')
+
+                body_inconsistencies = generic_inconsistencies
+                xmlproblems = getattr(fatt, '_xmldoctor', None)
+                if xmlproblems:  # None or []
+                    body_inconsistencies += '\n'.join(xmlproblems) + '\n\n'
 
                 # reset inconsistencies
                 self.__dict__.update(
                     self.with_context(inconsistencies='').__dict__
                 )
 
-                invoice_id = self.invoiceCreate(
-                    fatt, fatturapa_attachment, fattura, partner_id)
-                invoice = invoice_model.browse(invoice_id)
-                self.set_StabileOrganizzazione(cedentePrestatore, invoice)
-                if TaxRappresentative:
-                    tax_partner_id = self.getPartnerBase(
-                        TaxRappresentative.DatiAnagrafici, supplier=False)
-                    invoice.write(
-                        {
-                            'tax_representative_id': tax_partner_id
-                        }
-                    )
-                if Intermediary:
-                    Intermediary_id = self.getPartnerBase(
-                        Intermediary.DatiAnagrafici, supplier=False)
-                    invoice.write(
-                        {
-                            'intermediary': Intermediary_id
-                        }
-                    )
+                with self._profile('header'):
+                    invoice_id = self.invoiceCreate(
+                        fatt, fatturapa_attachment, fattura, partner_id)
+                    invoice = invoice_model.browse(invoice_id)
+                    self.set_StabileOrganizzazione(cedentePrestatore, invoice)
+                with self._profile('partner'):
+                    if TaxRappresentative:
+                        tax_partner_id = self.getPartnerBase(
+                            TaxRappresentative.DatiAnagrafici, supplier=False)
+                        invoice.write(
+                            {
+                                'tax_representative_id': tax_partner_id
+                            }
+                        )
+                    if Intermediary:
+                        Intermediary_id = self.getPartnerBase(
+                            Intermediary.DatiAnagrafici, supplier=False)
+                        invoice.write(
+                            {
+                                'intermediary': Intermediary_id
+                            }
+                        )
                 new_invoices.append(invoice_id)
-                self.check_invoice_amount(invoice, fattura)
+                with self._profile('checks'):
+                    self.check_invoice_amount(invoice, fattura)
 
-                invoice.set_einvoice_data(fattura)
+                    invoice.set_einvoice_data(fattura)
 
                 if self.env.context.get('inconsistencies'):
                     invoice_inconsistencies = (
@@ -1662,17 +1950,13 @@ class WizardImportFatturapa(models.TransientModel):
                 else:
                     invoice_inconsistencies = ''
                 invoice.inconsistencies = (
-                    generic_inconsistencies + invoice_inconsistencies)
-
-        if price_precision and different_price_precisions:
-            self._restore_original_precision(
-                price_precision, original_price_precision)
-        if qty_precision and different_qty_precisions:
-            self._restore_original_precision(
-                qty_precision, original_qty_precision)
-        if discount_precision and different_discount_precisions:
-            self._restore_original_precision(
-                discount_precision, original_discount_precision)
+                    body_inconsistencies + invoice_inconsistencies)
+
+        _logger.info(
+            "E-bill import lookups, hits/total: %s", session.format_stats())
+        if profiler is not None:
+            self.env['fatturapa.import.profile'].create(
+                profiler.get_vals_list())
 
         return {
             'view_type': 'form',
@@ -24,23 +24,10 @@ class WizardImportFatturapa(models.TransientModel):
         else:
             default_vat_into_default_account = False
 
-        account_tax_model = self.env['account.tax']
         # check if a default tax exists and generate def_purchase_tax object
-        ir_values = self.env['ir.default']
-        company_id = self.env['res.company']._company_default_get(
-            'account.invoice.line').id
-        supplier_taxes_ids = ir_values.get(
-            'product.product', 'supplier_taxes_id', company_id=company_id)
-        def_purchase_tax = False
-        if supplier_taxes_ids:
-            def_purchase_tax = account_tax_model.browse(supplier_taxes_ids)[0]
+        def_purchase_tax = self.get_default_purchase_tax()
         if float(AliquotaIVA) == 0.0 and Natura:
-            account_taxes = account_tax_model.search(
-                [
-                    ('type_tax_use', '=', 'purchase'),
-                    ('kind_id.code', '=', Natura),
-                    ('amount', '=', 0.0),
-                ], order='sequence')
+            account_taxes = self.search_taxes_by_nature(Natura)
             if not account_taxes:
                 msg = _('No tax with percentage %s and nature %s found. '
                         'Please configure this tax.') % (AliquotaIVA, Natura)
@@ -58,14 +45,7 @@ class WizardImportFatturapa(models.TransientModel):
             if default_vat_into_default_account and float(AliquotaIVA) == default_vat_into_default_account.amount:
                 return default_vat_into_default_account
 
-            account_taxes = account_tax_model.search(
-                [
-                    ('type_tax_use', '=', 'purchase'),
-                    ('amount', '=', float(AliquotaIVA)),
-                    ('price_include', '=', False),
-                    # partially deductible VAT must be set by user
-                    ('children_tax_ids', '=', False),
-                ], order='sequence')
+            account_taxes = self.search_taxes_by_rate(AliquotaIVA)
             if not account_taxes:
                 msg = _("XML contains tax with percentage '%s' but it does not "
                         "exist in your system") % AliquotaIVA
@@ -1,9 +1,24 @@
 # Copyright 2014 Davide Corio
 # Copyright 2016-2018 Lorenzo Battistini - Agile Business Group
 
-from odoo import fields, models, api, _
+import re
+import string
+
+from odoo import fields, models, api, tools, _
 from odoo.exceptions import UserError
 
+# The progressive of the e-invoice file name is a base-36 number
+FILE_ID_CHARS = string.digits + string.ascii_uppercase
+FILE_ID_SIZE = 5
+
+
+def encode_file_id(number):
+    file_id = ''
+    for dummy in range(FILE_ID_SIZE):
+        number, digit = divmod(number, len(FILE_ID_CHARS))
+        file_id = FILE_ID_CHARS[digit] + file_id
+    return file_id
+
 
 class FatturaPAAttachment(models.Model):
     _name = "fatturapa.attachment.out"
@@ -50,6 +65,19 @@ class FatturaPAAttachment(models.Model):
         'unique(att_name)',
         'The name of the e-invoice file must be unique!')]
 
+    def init(self):
+        # Taking the progressive of a file name is then only a nextval
+        self._create_file_id_sequences(self.env['res.company'].search([]))
+
+    @api.model
+    def _get_company_file_vat(self, company):
+        """TIN in the e-invoice file names of `company`, False if not set"""
+        if company.fatturapa_sender_partner:
+            vat = company.fatturapa_sender_partner.vat
+        else:
+            vat = company.vat
+        return vat and vat.replace(' ', '').replace('.', '').replace('-', '')
+
     @api.model
     def get_file_vat(self):
         company = self.env.user.company_id
@@ -59,14 +87,65 @@ class FatturaPAAttachment(models.Model):
                     _('Partner %s TIN not set.')
                     % company.fatturapa_sender_partner.display_name
                 )
-            vat = company.fatturapa_sender_partner.vat
         else:
             if not company.vat:
                 raise UserError(
                     _('Company %s TIN not set.') % company.display_name)
-            vat = company.vat
-        vat = vat.replace(' ', '').replace('.', '').replace('-', '')
-        return vat
+        return self._get_company_file_vat(company)
+
+    @api.model
+    def _get_file_id_sequence(self, vat):
+        """Name of the database sequence of the file names of TIN `vat`"""
+        return 'fatturapa_attachment_out_file_id_%s' % re.sub(
+            '[^a-z0-9]', '', vat.lower())
+
+    @api.model
+    def _create_file_id_sequences(self, companies):
+        """Create the missing sequences of the file names of `companies`,
+        called when the module is updated and when their TIN changes"""
+        vats = {self._get_company_file_vat(company) for company in companies}
+        for vat in vats - {False, None, ''}:
+            self.env.cr.execute(
+                "CREATE SEQUENCE IF NOT EXISTS %s"
+                % self._get_file_id_sequence(vat))
+
+    @tools.ormcache('vat')
+    def _get_used_file_numbers(self, vat):
+        """Progressives of the existing file names of TIN `vat`, like the
+        random ones of older versions, read once: the sequence skips them"""
+        self.env.cr.execute(
+            "SELECT a.datas_fname FROM fatturapa_attachment_out o "
+            "JOIN ir_attachment a ON a.id = o.ir_attachment_id "
+            "WHERE a.datas_fname LIKE %s",
+            (r'%s\_%%' % vat, ))
+        numbers = set()
+        for file_name, in self.env.cr.fetchall():
+            file_id = file_name[len(vat) + 1:].split('.')[0]
+            if (
+                len(file_id) == FILE_ID_SIZE and
+                all(char in FILE_ID_CHARS for char in file_id)
+            ):
+                numbers.add(int(file_id, len(FILE_ID_CHARS)))
+        return frozenset(numbers)
+
+    @api.model
+    def get_next_file_id(self):
+        """Progressive of the next e-invoice file name of the sender TIN.
+
+        It is taken from a database sequence for each TIN, so parallel
+        exports never get the same progressive."""
+        vat = self.get_file_vat()
+        sequence = self._get_file_id_sequence(vat)
+        used_numbers = self._get_used_file_numbers(vat)
+        while True:
+            self.env.cr.execute("SELECT nextval(%s)", (sequence, ))
+            number = self.env.cr.fetchone()[0]
+            if number >= len(FILE_ID_CHARS) ** FILE_ID_SIZE:
+                raise UserError(
+                    _("All the e-invoice file names of TIN %s have been used.")
+                    % vat)
+            if number not in used_numbers:
+                return encode_file_id(number)
 
     def file_name_exists(self, file_id):
         vat = self.get_file_vat()
@@ -117,6 +196,14 @@ class FatturaPAAttachment(models.Model):
                 # one attachment having is_pdf_invoice_print = True
                 attachment_out.has_pdf_invoice_print = True
 
+    @api.multi
+    def validate_xml(self):
+        """Validate the XML files against the XSD schema, return a dict
+        mapping the id of each e-invoice file to its list of errors,
+        see ir.attachment.get_xml_validation_errors"""
+        errors = self.mapped('ir_attachment_id').validate_fatturapa_xml()
+        return {att.id: errors[att.ir_attachment_id.id] for att in self}
+
     @api.multi
     def reset_to_ready(self):
         for attachment_out in self:
@@ -14,6 +14,35 @@ class ResCompany(models.Model):
         default=0,
         help="Customer default for maximum number of invoices to group "
              "in a single XML file. 0=Unlimited")
+    fatturapa_xml_serializer = fields.Selection(
+        [('pyxb', 'PyXB'), ('lxml', 'lxml')],
+        string='E-invoice XML serializer',
+        default='pyxb', required=True,
+        help="lxml writes the same XML as PyXB, much faster for invoices "
+             "with many lines, and validates it against the XSD.")
+    fatturapa_export_workers = fields.Integer(
+        string='E-invoice export workers',
+        default=0,
+        help="Number of processes writing the XML files when many "
+             "e-invoices are exported together. Only used by servers "
+             "running with workers, and when no installed module changes "
+             "how the files are saved. 0 or 1=The server process "
+             "writes them")
+
+    @api.model
+    def create(self, vals):
+        company = super(ResCompany, self).create(vals)
+        attachment_model = self.env['fatturapa.attachment.out'].sudo()
+        attachment_model._create_file_id_sequences(company)
+        return company
+
+    @api.multi
+    def write(self, vals):
+        res = super(ResCompany, self).write(vals)
+        if 'vat' in vals or 'fatturapa_sender_partner' in vals:
+            attachment_model = self.env['fatturapa.attachment.out'].sudo()
+            attachment_model._create_file_id_sequences(self)
+        return res
 
     @api.constrains('max_invoice_in_xml')
     def _validate_max_invoice_in_xml(self):
@@ -22,12 +51,23 @@ class ResCompany(models.Model):
                 _("The customer default for max number of invoices to group "
                   "can't be negative"))
 
+    @api.constrains('fatturapa_export_workers')
+    def _validate_fatturapa_export_workers(self):
+        if self.fatturapa_export_workers < 0:
+            raise ValidationError(
+                _("The number of e-invoice export workers "
+                  "can't be negative"))
+
 
 class AccountConfigSettings(models.TransientModel):
     _inherit = 'res.config.settings'
 
     max_invoice_in_xml = fields.Integer(
         related='company_id.max_invoice_in_xml', readonly=False)
+    fatturapa_xml_serializer = fields.Selection(
+        related='company_id.fatturapa_xml_serializer', readonly=False)
+    fatturapa_export_workers = fields.Integer(
+        related='company_id.fatturapa_export_workers', readonly=False)
 
     @api.onchange('company_id')
     def onchange_company_id(self):
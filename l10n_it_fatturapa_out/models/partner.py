@@ -20,3 +20,17 @@ class ResPartner(models.Model):
         if self.max_invoice_in_xml < 0:
             raise ValidationError(
                 _("The max number of invoice to group can't be negative"))
+
+    @api.multi
+    def write(self, vals):
+        res = super(ResPartner, self).write(vals)
+        if 'vat' in vals:
+            companies = self.env['res.company'].sudo().search([
+                '|',
+                ('partner_id', 'in', self.ids),
+                ('fatturapa_sender_partner', 'in', self.ids),
+            ])
+            if companies:
+                attachment_model = self.env['fatturapa.attachment.out'].sudo()
+                attachment_model._create_file_id_sequences(companies)
+        return res
@@ -2,3 +2,4 @@
 
 from . import fatturapa_common
 from . import test_fatturapa_xml_validation
+from . import test_xml_serializer
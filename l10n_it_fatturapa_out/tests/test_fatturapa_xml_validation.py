@@ -3,11 +3,20 @@
 # Copyright 2018-2019 Alex Comba - Agile Business Group
 
 import base64
+import io
 import re
 
 from psycopg2 import IntegrityError
+from PyPDF2 import PdfFileReader
 
+from odoo.modules.module import get_module_resource
 from odoo.tools import mute_logger
+from odoo.addons.l10n_it_fatturapa_out.models.attachment import (
+    encode_file_id,
+)
+from odoo.addons.l10n_it_fatturapa_out.wizard.wizard_export_fatturapa import (
+    split_pdf,
+)
 from .fatturapa_common import FatturaPACommon
 
 
@@ -599,6 +608,114 @@ class TestFatturaPAXMLValidation(FatturaPACommon):
         xml_content = base64.decodebytes(attachment.datas)
         self.check_content(xml_content, 'IT06363391001_00013.xml')
 
+    def test_14_prefetch_invoices(self):
+        invoices = self.invoice_model.browse()
+        for _i in range(2):
+            invoice = self._create_invoice()
+            invoice.payment_term_id = self.account_payment_term
+            invoice.invoice_line_ids.uom_id = self.product_uom_unit
+            invoice.action_invoice_open()
+            invoices |= invoice
+        wizard = self.wizard_model.create({})
+        invoices.invalidate_cache()
+        wizard._prefetch_invoices(invoices)
+        queries = self.cr.sql_log_count
+        for invoice in invoices:
+            for line in invoice.invoice_line_ids:
+                line.invoice_line_tax_ids.kind_id.code
+                line.uom_id.name
+                line.product_id.default_code
+            invoice.tax_line_ids.tax_id.amount
+            invoice.payment_term_id.fatturapa_pt_id.code
+            invoice.move_id.line_ids.mapped('date_maturity')
+        self.assertEqual(self.cr.sql_log_count, queries)
+
+    def test_15_file_id(self):
+        self.assertEqual(encode_file_id(1), '00001')
+        self.assertEqual(encode_file_id(36 * 36 + 35), '0010Z')
+        file_id = self.attach_model.get_next_file_id()
+        self.assertRegex(file_id, '^[0-9A-Z]{5}$')
+        next_file_id = self.attach_model.get_next_file_id()
+        self.assertEqual(int(next_file_id, 36), int(file_id, 36) + 1)
+        # Taking a progressive is a single query
+        queries = self.cr.sql_log_count
+        next_file_id = self.attach_model.get_next_file_id()
+        self.assertEqual(self.cr.sql_log_count, queries + 1)
+        # The progressives of the files existing when they are read,
+        # like the random ones of older versions, are skipped:
+        # the export takes next_file_id + 1, its file is renamed to + 2
+        used_file_id = encode_file_id(int(next_file_id, 36) + 2)
+        self.set_e_invoice_file_id(
+            self._create_e_invoice(),
+            '%s_%s.xml' % (self.attach_model.get_file_vat(), used_file_id))
+        self.attach_model.clear_caches()
+        self.assertEqual(
+            int(self.attach_model.get_next_file_id(), 36),
+            int(used_file_id, 36) + 1)
+
+    def test_16_attach_reports(self):
+        invoices = self.invoice_model.browse()
+        for _i in range(2):
+            invoice = self._create_invoice()
+            invoice.action_invoice_open()
+            invoices |= invoice
+        wizard = self.wizard_model.create({
+            'report_print_menu': self.env.ref('account.account_invoices').id,
+        })
+        res = wizard.with_context(
+            {'active_ids': invoices.ids}).exportFatturaPA()
+        attachment = self.attach_model.browse(res['res_id'])
+        self.assertEqual(attachment.out_invoice_ids, invoices)
+        self.assertTrue(attachment.has_pdf_invoice_print)
+        for invoice in invoices:
+            prints = invoice.fatturapa_doc_attachments.filtered(
+                'is_pdf_invoice_print')
+            self.assertEqual(len(prints), 1)
+            self.assertEqual(prints.datas_fname, '%s.pdf' % invoice.number)
+
+    def test_17_check_xml(self):
+        invoice = self._create_invoice()
+        invoice.action_invoice_open()
+        no_tax_invoice = self._create_invoice()
+        no_tax_invoice.invoice_line_ids.invoice_line_tax_ids = False
+        no_tax_invoice.action_invoice_open()
+        invoices = invoice | no_tax_invoice
+        wizard = self.wizard_model.create({})
+        res = wizard.with_context(
+            {'active_ids': invoices.ids}).action_check_xml()
+        checks = self.env[res['res_model']].search(res['domain'])
+        self.assertEqual(checks.mapped('invoice_id'), invoices)
+        check = checks.filtered(lambda c: c.invoice_id == invoice)
+        self.assertEqual(check.state, 'valid')
+        self.assertFalse(check.message)
+        no_tax_check = checks - check
+        self.assertEqual(no_tax_check.state, 'error')
+        self.assertIn('does not have tax', no_tax_check.message)
+        # Nothing has been written on the invoices
+        invoices.invalidate_cache()
+        self.assertFalse(any(invoices.mapped(
+            'invoice_line_ids.ftpa_line_number')))
+        self.assertFalse(any(invoices.mapped('fatturapa_attachment_out_id')))
+
+    def test_18_split_pdf(self):
+        # Two invoices printed together, on pages 1-2 and on page 3
+        pdf_path = get_module_resource(
+            'l10n_it_fatturapa_out', 'tests', 'data', 'report_2_invoices.pdf')
+        with open(pdf_path, 'rb') as pdf_file:
+            pdf_content = pdf_file.read()
+        pdfs = split_pdf(pdf_content, 2)
+        readers = [PdfFileReader(io.BytesIO(pdf)) for pdf in pdfs]
+        self.assertEqual([reader.numPages for reader in readers], [2, 1])
+        self.assertIn(
+            'INV/2020/0002', readers[1].getPage(0).extractText())
+        # Not one destination per invoice
+        self.assertIsNone(split_pdf(pdf_content, 3))
+        with mute_logger(
+                'odoo.addons.l10n_it_fatturapa_out.wizard'
+                '.wizard_export_fatturapa'):
+            self.assertIsNone(split_pdf(b'Not a PDF', 2))
+            self.assertIsNone(split_pdf(pdf_content[:200], 2))
+
     def test_unlink(self):
         e_invoice = self._create_e_invoice()
         e_invoice.unlink()
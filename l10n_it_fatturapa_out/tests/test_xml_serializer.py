@@ -0,0 +1,114 @@
+import glob
+import multiprocessing
+import os
+
+import mock
+
+from odoo.modules.module import get_module_resource
+from odoo.addons.l10n_it_fatturapa.bindings.fatturapa import (
+    CreateFromDocument,
+    CreateXMLFromBinding,
+)
+from odoo.addons.l10n_it_fatturapa_out.wizard import wizard_export_fatturapa
+from odoo.addons.l10n_it_fatturapa_out.wizard.wizard_export_fatturapa import (
+    fatturapaBDS,
+)
+from .fatturapa_common import FatturaPACommon
+
+
+class TestXMLSerializer(FatturaPACommon):
+
+    def pyxb_xml(self, fatturapa):
+        xml = fatturapa.toxml(encoding="UTF-8", bds=fatturapaBDS)
+        fatturapaBDS.reset()
+        return xml
+
+    def test_fixtures(self):
+        """lxml writes the same bytes as PyXB for every exported fixture"""
+        data_path = get_module_resource('l10n_it_fatturapa_out', 'tests', 'data')
+        for file_path in glob.glob(os.path.join(data_path, '*.xml')):
+            with open(file_path, 'rb') as xml_file:
+                fatturapa = CreateFromDocument(xml_file.read())
+            self.assertEqual(
+                CreateXMLFromBinding(fatturapa), self.pyxb_xml(fatturapa),
+                file_path)
+
+    def test_quotes_and_escapes(self):
+        file_path = get_module_resource(
+            'l10n_it_fatturapa_out', 'tests', 'data',
+            'IT06363391001_00001.xml')
+        with open(file_path, 'rb') as xml_file:
+            fatturapa = CreateFromDocument(xml_file.read())
+        line = fatturapa.FatturaElettronicaBody[0].DatiBeniServizi \
+            .DettaglioLinee[0]
+        line.Descrizione = 'Monitor 24" & <cavo> l\'altro "HDMI"'
+        self.assertEqual(
+            CreateXMLFromBinding(fatturapa), self.pyxb_xml(fatturapa))
+
+    def test_company_serializer(self):
+        invoice = self.invoice_model.create({
+            'date_invoice': '2016-01-07',
+            'partner_id': self.res_partner_fatturapa_0.id,
+            'journal_id': self.sales_journal.id,
+            'account_id': self.a_recv.id,
+            'payment_term_id': self.account_payment_term.id,
+            'type': 'out_invoice',
+            'currency_id': self.EUR.id,
+            'invoice_line_ids': [(0, 0, {
+                'account_id': self.a_sale.id,
+                'product_id': self.product_product_10.id,
+                'name': 'Mouse "Optical"',
+                'quantity': 1,
+                'uom_id': self.product_uom_unit.id,
+                'price_unit': 10,
+                'invoice_line_tax_ids': [(6, 0, {self.tax_22.id})],
+            })],
+        })
+        invoice.action_invoice_open()
+        wizard = self.wizard_model.create({})
+        fatturapa, number = wizard.exportInvoiceXML(
+            self.env.user.company_id, invoice.partner_id, invoice.ids)
+        company = self.env.user.company_id
+        company.fatturapa_xml_serializer = 'pyxb'
+        pyxb_xml = wizard.serializeFatturaPA(fatturapa)
+        company.fatturapa_xml_serializer = 'lxml'
+        self.assertEqual(wizard.serializeFatturaPA(fatturapa), pyxb_xml)
+
+    def pool_fatturapas(self):
+        data_path = get_module_resource('l10n_it_fatturapa_out', 'tests', 'data')
+        fatturapas = []
+        for file_path in sorted(glob.glob(os.path.join(data_path, '*.xml')))[:4]:
+            with open(file_path, 'rb') as xml_file:
+                fatturapas.append(CreateFromDocument(xml_file.read()))
+        return fatturapas
+
+    def test_serializer_pool(self):
+        """The worker processes write the XML files in the given order"""
+        fatturapas = self.pool_fatturapas()
+        wizard = self.wizard_model.create({})
+        for serializer in ('pyxb', 'lxml'):
+            self.env.user.company_id.fatturapa_xml_serializer = serializer
+            self.assertEqual(
+                wizard.serializeFatturaPAPool(fatturapas, 2),
+                [wizard.serializeFatturaPA(fatturapa)
+                 for fatturapa in fatturapas])
+
+    def test_serializer_pool_workers(self):
+        """Forked workers write the same XML files as the server process"""
+        fatturapas = self.pool_fatturapas()
+        wizard = self.wizard_model.create({})
+        # The test server runs other threads: let the pool fork anyway
+        with mock.patch.object(
+                wizard_export_fatturapa.threading, 'active_count',
+                return_value=1), \
+                mock.patch.object(
+                    wizard_export_fatturapa.multiprocessing, 'get_context',
+                    wraps=multiprocessing.get_context) as get_context:
+            for serializer in ('pyxb', 'lxml'):
+                self.env.user.company_id.fatturapa_xml_serializer = serializer
+                self.assertEqual(
+                    wizard.serializeFatturaPAPool(fatturapas, 2),
+                    [wizard.serializeFatturaPA(fatturapa)
+                     for fatturapa in fatturapas])
+        self.assertEqual(get_context.call_count, 2)
+        get_context.assert_called_with('fork')
@@ -9,5 +9,6 @@ _logger = logging.getLogger(__name__)
 try:
     from . import wizard_export_fatturapa
     from . import wizard_export_fatturapa_regenerate
+    from . import export_check
 except ImportError:
     _logger.debug('Cannot `import pyxb`.')  # Avoid init error if not installed
@@ -0,0 +1,38 @@
+from odoo import api, fields, models
+
+
+class FatturaPAExportCheck(models.TransientModel):
+    """Result of the validation of the XML of an invoice,
+    built without exporting it"""
+    _name = "fatturapa.export.check"
+    _description = "E-invoice export check"
+    _order = 'id'
+    _rec_name = 'invoice_id'
+
+    invoice_id = fields.Many2one(
+        'account.invoice', string="Invoice", readonly=True,
+        ondelete='cascade')
+    partner_id = fields.Many2one(
+        related='invoice_id.partner_id', readonly=True)
+    state = fields.Selection(
+        [('valid', 'Valid'), ('error', 'Error')], readonly=True)
+    message = fields.Text(readonly=True)
+
+    @api.model
+    def create_checks(self, results):
+        """Create the checks of `results`, a list of
+        (invoice id, error message or False), with one query"""
+        if not results:
+            return self.browse()
+        now = fields.Datetime.now()
+        rows = [
+            (invoice_id, error and 'error' or 'valid', error or None,
+             self.env.uid, now, self.env.uid, now)
+            for invoice_id, error in results]
+        self.env.cr.execute(
+            "INSERT INTO fatturapa_export_check "
+            "(invoice_id, state, message, "
+            "create_uid, create_date, write_uid, write_date) "
+            "VALUES " + ", ".join(["%s"] * len(rows)) + " RETURNING id",
+            rows)
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
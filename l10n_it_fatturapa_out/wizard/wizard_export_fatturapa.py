@@ -6,11 +6,18 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 
 import base64
+import io
 import logging
 import os
 import string
 import random
 import itertools
+import multiprocessing
+import threading
+
+import psycopg2
+from lxml import etree
+from PyPDF2 import PdfFileReader, PdfFileWriter
 
 from odoo import api, fields, models
 from odoo.tools.translate import _
@@ -18,39 +25,7 @@ from odoo.exceptions import UserError
 from odoo.addons.l10n_it_account.tools.account_tools import encode_for_export
 from odoo.tools.float_utils import float_round
 
-from odoo.addons.l10n_it_fatturapa.bindings.fatturapa import (
-    FatturaElettronica,
-    FatturaElettronicaHeaderType,
-    DatiTrasmissioneType,
-    IdFiscaleType,
-    ContattiTrasmittenteType,
-    CedentePrestatoreType,
-    AnagraficaType,
-    IndirizzoType,
-    IscrizioneREAType,
-    CessionarioCommittenteType,
-    RappresentanteFiscaleType,
-    DatiAnagraficiCedenteType,
-    DatiAnagraficiCessionarioType,
-    DatiAnagraficiRappresentanteType,
-    TerzoIntermediarioSoggettoEmittenteType,
-    DatiAnagraficiTerzoIntermediarioType,
-    FatturaElettronicaBodyType,
-    DatiGeneraliType,
-    DettaglioLineeType,
-    DatiBeniServiziType,
-    DatiRiepilogoType,
-    DatiGeneraliDocumentoType,
-    DatiDocumentiCorrelatiType,
-    ContattiType,
-    DatiPagamentoType,
-    DettaglioPagamentoType,
-    AllegatiType,
-    ScontoMaggiorazioneType,
-    CodiceArticoloType,
-    AltriDatiGestionaliType,
-    DataFatturaType
-)
+from odoo.addons.l10n_it_fatturapa.bindings import get_binding_module
 from datetime import date
 from odoo.addons.l10n_it_fatturapa.models.account import (
     RELATED_DOCUMENT_TYPES)
@@ -68,6 +43,28 @@ except ImportError as err:
 FORMATO_TRASMISSIONE_PA = 'FPA12'  # Valid for Format 1.2 and 1.2.1
 FORMATO_TRASMISSIONE_PR = 'FPR12'  # Valid for Format 1.2 and 1.2.1
 SOFTWARE_IN_USE = 'powERP'
+# ProgressivoInvio of the XML built to be validated only
+CHECK_FILE_ID = '00000'
+
+# Paths read in one go for all the exported invoices before building the
+# XML files, so that the ORM cache already holds what the XML builders read
+INVOICE_PREFETCH_FIELDS = [
+    'partner_id.country_id.code',
+    'partner_id.parent_id.is_pa',
+    'fiscal_document_type_id.code',
+    'currency_id.name',
+    'invoice_line_ids.invoice_line_tax_ids.kind_id.code',
+    'invoice_line_ids.uom_id.name',
+    'invoice_line_ids.product_id.default_code',
+    'invoice_line_ids.related_documents.type',
+    'related_documents.type',
+    'tax_line_ids.tax_id.kind_id.code',
+    'partner_bank_id.bank_id.name',
+    'payment_term_id.fatturapa_pt_id.code',
+    'payment_term_id.fatturapa_pm_id.code',
+    'move_id.line_ids.account_id',
+    'fatturapa_doc_attachments.ir_attachment_id',
+]
 
 
 def id_generator(
@@ -80,13 +77,14 @@ def id_generator(
 class FatturapaBDS(domutils.BindingDOMSupport):
 
     def valueAsText(self, value, enable_default_namespace=True):
+        binding = get_binding_module()
         if isinstance(value, pyxb_decimal) and hasattr(value, '_CF_pattern'):
             # PyXB changes the text representation of decimals
             # so that it breaks pattern matching.
             # We have to use directly the string value
             # instead of letting PyXB edit it
             return str(value)
-        elif isinstance(value, (DataFatturaType, date)):
+        elif isinstance(value, (binding.DataFatturaType, date)):
             value = value.date()
         return super(FatturapaBDS, self) \
             .valueAsText(value, enable_default_namespace)
@@ -95,6 +93,85 @@ class FatturapaBDS(domutils.BindingDOMSupport):
 fatturapaBDS = FatturapaBDS()
 
 
+def serialize_fatturapa(fatturapa, serializer):
+    """XML of the e-invoice `fatturapa`, written by `serializer`
+    ('pyxb' or 'lxml')"""
+    binding = get_binding_module()
+    if serializer == 'lxml':
+        return binding.CreateXMLFromBinding(fatturapa)
+    attach_str = fatturapa.toxml(
+        encoding="UTF-8",
+        bds=fatturapaBDS,
+    )
+    fatturapaBDS.reset()
+    return attach_str
+
+
+def split_pdf(pdf_content, count):
+    """PDF of each of the `count` records rendered together in
+    `pdf_content`, None if it can't be split.
+
+    wkhtmltopdf writes a named destination where each record starts."""
+    try:
+        return _split_pdf(pdf_content, count)
+    except Exception:
+        # PyPDF2 raises all sorts of errors on PDFs it can't read
+        _logger.warning("Report PDF can't be split", exc_info=True)
+        return None
+
+
+def _split_pdf(pdf_content, count):
+    reader = PdfFileReader(io.BytesIO(pdf_content))
+    dests = reader.trailer['/Root'].get('/Dests')
+    if not dests:
+        return None
+    page_numbers = {
+        reader.getPage(page_number).indirectRef.idnum: page_number
+        for page_number in range(reader.numPages)}
+    starts = set()
+    for dest in dests.getObject().values():
+        dest = dest.getObject()
+        if isinstance(dest, dict):
+            dest = dest['/D'].getObject()
+        starts.add(page_numbers.get(dest[0].idnum))
+    if None in starts or len(starts) != count or 0 not in starts:
+        return None
+    starts = sorted(starts)
+    pdfs = []
+    for start, end in zip(starts, starts[1:] + [reader.numPages]):
+        writer = PdfFileWriter()
+        for page_number in range(start, end):
+            writer.addPage(reader.getPage(page_number))
+        stream = io.BytesIO()
+        writer.write(stream)
+        pdfs.append(stream.getvalue())
+    return pdfs
+
+
+# E-invoices of the pool the current worker process belongs to.
+# Only set in the worker processes, by _init_pool_worker.
+_worker_fatturapas = []
+
+
+def _init_pool_worker(fatturapas):
+    # Runs in a worker process right after the fork: the e-invoices are
+    # inherited with the memory of the server process, not pickled
+    _worker_fatturapas[:] = fatturapas
+
+
+def _serialize_fatturapa_result(fatturapa, serializer):
+    try:
+        return serialize_fatturapa(fatturapa, serializer), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _serialize_pool_fatturapa(args):
+    # Runs in a worker process: it must not use the database
+    index, serializer = args
+    return _serialize_fatturapa_result(_worker_fatturapas[index], serializer)
+
+
 class WizardExportFatturapa(models.TransientModel):
     _name = "wizard.export.fatturapa"
     _description = "Export E-invoice"
@@ -111,15 +188,70 @@ class WizardExportFatturapa(models.TransientModel):
         domain=_domain_ir_values,
         help='This report will be automatically included in the created XML')
 
+    def serializeFatturaPA(self, fatturapa):
+        """XML of the e-invoice, written by the serializer
+        chosen in the company settings"""
+        serializer = self.env.user.company_id.fatturapa_xml_serializer
+        try:
+            return serialize_fatturapa(fatturapa, serializer)
+        except etree.DocumentInvalid as e:
+            raise UserError(
+                _("The e-invoice XML is not valid:\n%s") % e)
+
+    def serializeFatturaPAPool(self, fatturapas, workers):
+        """XML of the e-invoices `fatturapas`, in the same order,
+        written by up to `workers` processes.
+
+        The workers are forked, so that they inherit the e-invoices and the
+        loaded addons: PyXB bindings can't be pickled, and the addons can't
+        be imported by spawned processes. Forking is only safe when no other
+        thread can hold a lock, so a multi-threaded server writes
+        the XML files itself."""
+        serializer = self.env.user.company_id.fatturapa_xml_serializer
+        if threading.active_count() > 1:
+            _logger.info(
+                "Multi-threaded server: writing %d e-invoices without "
+                "worker processes", len(fatturapas))
+            results = [
+                _serialize_fatturapa_result(fatturapa, serializer)
+                for fatturapa in fatturapas]
+        else:
+            pool_context = multiprocessing.get_context('fork')
+            # The workers never use the database, and leave the inherited
+            # connections alone: they exit without running any cleanup
+            with pool_context.Pool(
+                    min(workers, len(fatturapas)),
+                    initializer=_init_pool_worker,
+                    initargs=(fatturapas,)) as pool:
+                results = pool.map(
+                    _serialize_pool_fatturapa,
+                    [(index, serializer) for index in range(len(fatturapas))],
+                    chunksize=1)
+        for attach_str, error in results:
+            if error:
+                raise UserError(
+                    _("The e-invoice XML is not valid:\n%s") % error)
+        return [attach_str for attach_str, error in results]
+
     def saveAttachment(self, fatturapa, number):
+        attach_str = self.serializeFatturaPA(fatturapa)
+        return self.saveAttachmentXML(attach_str, number)
+
+    def _get_export_workers(self, company):
+        """Number of processes writing the XML files of the export,
+        0 if each file is written by saveAttachment"""
+        if self._context.get('simulation', False):
+            return 0
+        # The files written by the workers are saved by saveAttachmentXML:
+        # keep saveAttachment when a module overrides it
+        if type(self).saveAttachment is not WizardExportFatturapa.saveAttachment:
+            return 0
+        return company.fatturapa_export_workers
+
+    def saveAttachmentXML(self, attach_str, number):
         attach_obj = self.env['fatturapa.attachment.out']
         vat = attach_obj.get_file_vat()
 
-        attach_str = fatturapa.toxml(
-            encoding="UTF-8",
-            bds=fatturapaBDS,
-        )
-        fatturapaBDS.reset()
         attach_vals = {
             'name': '%s_%s.xml' % (vat, number),
             'datas_fname': '%s_%s.xml' % (vat, number),
@@ -134,10 +266,7 @@ class WizardExportFatturapa(models.TransientModel):
             # to get XXXXX
             file_id = attach.name.split('_')[1].split('.')[0]
         else:
-            file_id = id_generator()
-            Attachment = self.env['fatturapa.attachment.out']
-            while Attachment.file_name_exists(file_id):
-                file_id = id_generator()
+            file_id = self.env['fatturapa.attachment.out'].get_next_file_id()
 
         try:
             fatturapa.FatturaElettronicaHeader.DatiTrasmissione.\
@@ -152,6 +281,7 @@ class WizardExportFatturapa(models.TransientModel):
 
     def _setIdTrasmittente(self, company, fatturapa):
 
+        binding = get_binding_module()
         if not company.country_id:
             raise UserError(
                 _('Company %s, Country not set.') % company.display_name)
@@ -167,7 +297,7 @@ class WizardExportFatturapa(models.TransientModel):
                 % company.display_name)
 
         fatturapa.FatturaElettronicaHeader.DatiTrasmissione.\
-            IdTrasmittente = IdFiscaleType(
+            IdTrasmittente = binding.IdFiscaleType(
                 IdPaese=IdPaese, IdCodice=IdCodice)
 
         return True
@@ -208,17 +338,19 @@ class WizardExportFatturapa(models.TransientModel):
         return True
 
     def _setContattiTrasmittente(self, company, fatturapa):
+        binding = get_binding_module()
         Telefono = company.phone
         Email = company.email
         fatturapa.FatturaElettronicaHeader.DatiTrasmissione.\
-            ContattiTrasmittente = ContattiTrasmittenteType(
+            ContattiTrasmittente = binding.ContattiTrasmittenteType(
                 Telefono=Telefono or None, Email=Email or None)
 
         return True
 
     def setDatiTrasmissione(self, company, partner, fatturapa):
+        binding = get_binding_module()
         fatturapa.FatturaElettronicaHeader.DatiTrasmissione = (
-            DatiTrasmissioneType())
+            binding.DatiTrasmissioneType())
         self._setIdTrasmittente(company, fatturapa)
         self._setFormatoTrasmissione(partner.commercial_partner_id, fatturapa)
         if partner.electronic_invoice_use_this_address:
@@ -230,10 +362,11 @@ class WizardExportFatturapa(models.TransientModel):
 
     def _setDatiAnagraficiCedente(self, CedentePrestatore, company):
 
+        binding = get_binding_module()
         if not company.vat:
             raise UserError(
                 _('TIN not set.'))
-        CedentePrestatore.DatiAnagrafici = DatiAnagraficiCedenteType()
+        CedentePrestatore.DatiAnagrafici = binding.DatiAnagraficiCedenteType()
         fatturapa_fp = company.fatturapa_fiscal_position_id
         if not fatturapa_fp:
             raise UserError(_(
@@ -242,9 +375,9 @@ class WizardExportFatturapa(models.TransientModel):
                 '(Go to Accounting / Configuration / Settings / '
                 'Electronic Invoice)' % company.display_name
             ))
-        CedentePrestatore.DatiAnagrafici.IdFiscaleIVA = IdFiscaleType(
+        CedentePrestatore.DatiAnagrafici.IdFiscaleIVA = binding.IdFiscaleType(
             IdPaese=company.country_id.code, IdCodice=company.vat[2:])
-        CedentePrestatore.DatiAnagrafici.Anagrafica = AnagraficaType(
+        CedentePrestatore.DatiAnagrafici.Anagrafica = binding.AnagraficaType(
             Denominazione=company.name)
 
         if company.partner_id.fiscalcode:
@@ -264,6 +397,7 @@ class WizardExportFatturapa(models.TransientModel):
 
     def _setSedeCedente(self, CedentePrestatore, company):
 
+        binding = get_binding_module()
         if not company.street:
             raise UserError(
                 _('Company %s, Street is not set.') % company.display_name)
@@ -278,7 +412,7 @@ class WizardExportFatturapa(models.TransientModel):
                 _('Company %s, Country is not set.') % company.display_name)
         # TODO: manage address number in <NumeroCivico>
         # see https://github.com/OCA/partner-contact/pull/96
-        CedentePrestatore.Sede = IndirizzoType(
+        CedentePrestatore.Sede = binding.IndirizzoType(
             Indirizzo=encode_for_export(company.street, 60),
             CAP=company.zip,
             Comune=encode_for_export(company.city, 60),
@@ -289,6 +423,7 @@ class WizardExportFatturapa(models.TransientModel):
         return True
 
     def _setStabileOrganizzazione(self, CedentePrestatore, company):
+        binding = get_binding_module()
         if company.fatturapa_stabile_organizzazione:
             stabile_organizzazione = company.fatturapa_stabile_organizzazione
             if not stabile_organizzazione.street:
@@ -307,7 +442,7 @@ class WizardExportFatturapa(models.TransientModel):
                 raise UserError(
                     _('Country is not set for %s.') %
                     stabile_organizzazione.name)
-            CedentePrestatore.StabileOrganizzazione = IndirizzoType(
+            CedentePrestatore.StabileOrganizzazione = binding.IndirizzoType(
                 Indirizzo=stabile_organizzazione.street,
                 CAP=stabile_organizzazione.zip,
                 Comune=stabile_organizzazione.city,
@@ -319,13 +454,14 @@ class WizardExportFatturapa(models.TransientModel):
 
     def _setRea(self, CedentePrestatore, company):
 
+        binding = get_binding_module()
         if (
             company.rea_office and company.rea_code and
             company.rea_liquidation_state
         ):
             # The required fields for IscrizioneREA (not required) are
             # Ufficio, NumeroREA and StatoLiquidazione
-            CedentePrestatore.IscrizioneREA = IscrizioneREAType(
+            CedentePrestatore.IscrizioneREA = binding.IscrizioneREAType(
                 Ufficio=(company.rea_office.code or None),
                 NumeroREA=company.rea_code,
                 CapitaleSociale=(
@@ -336,7 +472,8 @@ class WizardExportFatturapa(models.TransientModel):
                 )
 
     def _setContatti(self, CedentePrestatore, company):
-        CedentePrestatore.Contatti = ContattiType(
+        binding = get_binding_module()
+        CedentePrestatore.Contatti = binding.ContattiType(
             Telefono=company.partner_id.phone or None,
             Email=company.partner_id.email or None
             )
@@ -347,8 +484,9 @@ class WizardExportFatturapa(models.TransientModel):
                 company.fatturapa_pub_administration_ref)
 
     def setCedentePrestatore(self, company, fatturapa):
+        binding = get_binding_module()
         fatturapa.FatturaElettronicaHeader.CedentePrestatore = (
-            CedentePrestatoreType())
+            binding.CedentePrestatoreType())
         self._setDatiAnagraficiCedente(
             fatturapa.FatturaElettronicaHeader.CedentePrestatore,
             company)
@@ -373,8 +511,9 @@ class WizardExportFatturapa(models.TransientModel):
             company)
 
     def _setDatiAnagraficiCessionario(self, partner, fatturapa):
+        binding = get_binding_module()
         fatturapa.FatturaElettronicaHeader.CessionarioCommittente.\
-            DatiAnagrafici = DatiAnagraficiCessionarioType()
+            DatiAnagrafici = binding.DatiAnagraficiCessionarioType()
         if not partner.vat and not partner.fiscalcode:
             if (
                     partner.codice_destinatario == 'XXXXXXX'
@@ -385,7 +524,7 @@ class WizardExportFatturapa(models.TransientModel):
                 # fake IdCodice and a valid IdPaese
                 # Otherwise raise error if we have no VAT# and no Fiscal code
                 fatturapa.FatturaElettronicaHeader.CessionarioCommittente.\
-                    DatiAnagrafici.IdFiscaleIVA = IdFiscaleType(
+                    DatiAnagrafici.IdFiscaleIVA = binding.IdFiscaleType(
                         IdPaese=partner.country_id.code,
                         IdCodice='99999999999')
             else:
@@ -397,16 +536,16 @@ class WizardExportFatturapa(models.TransientModel):
                 DatiAnagrafici.CodiceFiscale = partner.fiscalcode
         if partner.vat:
             fatturapa.FatturaElettronicaHeader.CessionarioCommittente.\
-                DatiAnagrafici.IdFiscaleIVA = IdFiscaleType(
+                DatiAnagrafici.IdFiscaleIVA = binding.IdFiscaleType(
                     IdPaese=partner.vat[0:2], IdCodice=partner.vat[2:])
         if partner.company_name:
             # This is valorized by e-commerce orders typically
             fatturapa.FatturaElettronicaHeader.CessionarioCommittente.\
-                DatiAnagrafici.Anagrafica = AnagraficaType(
+                DatiAnagrafici.Anagrafica = binding.AnagraficaType(
                     Denominazione=partner.company_name)
         elif partner.company_type == 'company':
             fatturapa.FatturaElettronicaHeader.CessionarioCommittente.\
-                DatiAnagrafici.Anagrafica = AnagraficaType(
+                DatiAnagrafici.Anagrafica = binding.AnagraficaType(
                     Denominazione=encode_for_export(partner.name, 80))
         elif partner.company_type == 'person':
             if not partner.lastname or not partner.firstname:
@@ -414,7 +553,7 @@ class WizardExportFatturapa(models.TransientModel):
                     _("Partner %s must have name and surname.") %
                     partner.name)
             fatturapa.FatturaElettronicaHeader.CessionarioCommittente.\
-                DatiAnagrafici.Anagrafica = AnagraficaType(
+                DatiAnagrafici.Anagrafica = binding.AnagraficaType(
                     Cognome=encode_for_export(partner.lastname, 60),
                     Nome=encode_for_export(partner.firstname, 60)
                 )
@@ -426,10 +565,11 @@ class WizardExportFatturapa(models.TransientModel):
         return True
 
     def _setDatiAnagraficiRappresentanteFiscale(self, partner, fatturapa):
+        binding = get_binding_module()
         fatturapa.FatturaElettronicaHeader.RappresentanteFiscale = (
-            RappresentanteFiscaleType())
+            binding.RappresentanteFiscaleType())
         fatturapa.FatturaElettronicaHeader.RappresentanteFiscale.\
-            DatiAnagrafici = DatiAnagraficiRappresentanteType()
+            DatiAnagrafici = binding.DatiAnagraficiRappresentanteType()
         if not partner.vat and not partner.fiscalcode:
             raise UserError(
                 _('VAT number and fiscal code are not set for %s.') %
@@ -439,10 +579,10 @@ class WizardExportFatturapa(models.TransientModel):
                 DatiAnagrafici.CodiceFiscale = partner.fiscalcode
         if partner.vat:
             fatturapa.FatturaElettronicaHeader.RappresentanteFiscale.\
-                DatiAnagrafici.IdFiscaleIVA = IdFiscaleType(
+                DatiAnagrafici.IdFiscaleIVA = binding.IdFiscaleType(
                     IdPaese=partner.vat[0:2], IdCodice=partner.vat[2:])
         fatturapa.FatturaElettronicaHeader.RappresentanteFiscale.\
-            DatiAnagrafici.Anagrafica = AnagraficaType(
+            DatiAnagrafici.Anagrafica = binding.AnagraficaType(
                 Denominazione=encode_for_export(partner.name, 80))
         if partner.eori_code:
             fatturapa.FatturaElettronicaHeader.RappresentanteFiscale.\
@@ -451,13 +591,14 @@ class WizardExportFatturapa(models.TransientModel):
         return True
 
     def _setTerzoIntermediarioOSoggettoEmittente(self, partner, fatturapa):
+        binding = get_binding_module()
         fatturapa.FatturaElettronicaHeader.\
             TerzoIntermediarioOSoggettoEmittente = (
-                TerzoIntermediarioSoggettoEmittenteType()
+                binding.TerzoIntermediarioSoggettoEmittenteType()
             )
         fatturapa.FatturaElettronicaHeader.\
             TerzoIntermediarioOSoggettoEmittente.\
-            DatiAnagrafici = DatiAnagraficiTerzoIntermediarioType()
+            DatiAnagrafici = binding.DatiAnagraficiTerzoIntermediarioType()
         if not partner.vat and not partner.fiscalcode:
             raise UserError(
                 _('Partner VAT number and fiscal code are not set for %s.'
@@ -469,11 +610,11 @@ class WizardExportFatturapa(models.TransientModel):
         if partner.vat:
             fatturapa.FatturaElettronicaHeader.\
                 TerzoIntermediarioOSoggettoEmittente.\
-                DatiAnagrafici.IdFiscaleIVA = IdFiscaleType(
+                DatiAnagrafici.IdFiscaleIVA = binding.IdFiscaleType(
                     IdPaese=partner.vat[0:2], IdCodice=partner.vat[2:])
         fatturapa.FatturaElettronicaHeader.\
             TerzoIntermediarioOSoggettoEmittente.\
-            DatiAnagrafici.Anagrafica = AnagraficaType(
+            DatiAnagrafici.Anagrafica = binding.AnagraficaType(
                 Denominazione=partner.name)
         if partner.eori_code:
             fatturapa.FatturaElettronicaHeader.\
@@ -484,6 +625,7 @@ class WizardExportFatturapa(models.TransientModel):
 
     def _setSedeCessionario(self, partner, fatturapa):
 
+        binding = get_binding_module()
         if not partner.street:
             raise UserError(
                 _('Customer street is not set for %s.' % partner.name))
@@ -497,7 +639,7 @@ class WizardExportFatturapa(models.TransientModel):
         # TODO: manage address number in <NumeroCivico>
         if partner.codice_destinatario == 'XXXXXXX':
             fatturapa.FatturaElettronicaHeader.CessionarioCommittente.Sede = (
-                IndirizzoType(
+                binding.IndirizzoType(
                     Indirizzo=encode_for_export(partner.street, 60),
                     CAP='00000',
                     Comune=encode_for_export(partner.city, 60),
@@ -509,7 +651,7 @@ class WizardExportFatturapa(models.TransientModel):
                     _('Customer ZIP not set for %s.' % partner.name))
 
             fatturapa.FatturaElettronicaHeader.CessionarioCommittente.Sede = (
-                IndirizzoType(
+                binding.IndirizzoType(
                     Indirizzo=encode_for_export(partner.street, 60),
                     CAP=partner.zip,
                     Comune=encode_for_export(partner.city, 60),
@@ -527,8 +669,9 @@ class WizardExportFatturapa(models.TransientModel):
         return True
 
     def setCessionarioCommittente(self, partner, fatturapa):
+        binding = get_binding_module()
         fatturapa.FatturaElettronicaHeader.CessionarioCommittente = (
-            CessionarioCommittenteType())
+            binding.CessionarioCommittenteType())
         self._setDatiAnagraficiCessionario(
             partner.commercial_partner_id, fatturapa)
         self._setSedeCessionario(partner, fatturapa)
@@ -543,7 +686,8 @@ class WizardExportFatturapa(models.TransientModel):
 
         # TODO DatiSAL
 
-        body.DatiGenerali = DatiGeneraliType()
+        binding = get_binding_module()
+        body.DatiGenerali = binding.DatiGeneraliType()
         if not invoice.number:
             raise UserError(
                 _('Invoice %s does not have a number.' % invoice.display_name))
@@ -553,7 +697,7 @@ class WizardExportFatturapa(models.TransientModel):
         # unecessary total has sp now
         # if invoice.split_payment:
         #     ImportoTotaleDocumento += invoice.amount_sp
-        body.DatiGenerali.DatiGeneraliDocumento = DatiGeneraliDocumentoType(
+        body.DatiGenerali.DatiGeneraliDocumento = binding.DatiGeneraliDocumentoType(
             TipoDocumento=TipoDocumento,
             Divisa=invoice.currency_id.name,
             Data=invoice.date_invoice,
@@ -584,15 +728,17 @@ class WizardExportFatturapa(models.TransientModel):
         return True
 
     def setRelatedDocumentTypes(self, invoice, body):
+        binding = get_binding_module()
+        line_numbers = self._get_ftpa_line_numbers(invoice)
         for line in invoice.invoice_line_ids:
             for related_document in line.related_documents:
                 doc_type = RELATED_DOCUMENT_TYPES[related_document.type]
-                documento = DatiDocumentiCorrelatiType()
+                documento = binding.DatiDocumentiCorrelatiType()
                 if related_document.name:
                     documento.IdDocumento = related_document.name
                 if related_document.lineRef:
                     documento.RiferimentoNumeroLinea.append(
-                        line.ftpa_line_number)
+                        line_numbers[line.id])
                 if related_document.date:
                     documento.Data = related_document.date
                 if related_document.numitem:
@@ -606,7 +752,7 @@ class WizardExportFatturapa(models.TransientModel):
                 getattr(body.DatiGenerali, doc_type).append(documento)
         for related_document in invoice.related_documents:
             doc_type = RELATED_DOCUMENT_TYPES[related_document.type]
-            documento = DatiDocumentiCorrelatiType()
+            documento = binding.DatiDocumentiCorrelatiType()
             if related_document.name:
                 documento.IdDocumento = related_document.name
             if related_document.date:
@@ -628,19 +774,32 @@ class WizardExportFatturapa(models.TransientModel):
     def setDatiDDT(self, invoice, body):
         return True
 
+    def _get_ftpa_line_numbers(self, invoice):
+        """Number of the lines of `invoice` in the XML, by line id"""
+        return {
+            line.id: line_no
+            for line_no, line in enumerate(invoice.invoice_line_ids, 1)}
+
+    def _get_line_taxes(self, line):
+        """Taxes of `line` in the XML: descriptive lines get the first
+        non zero tax of the invoice, see set_taxes_for_descriptive_lines"""
+        if line.display_type:
+            non_zero_tax = line.invoice_id.get_first_non_zero_tax()
+            if non_zero_tax:
+                return non_zero_tax
+        return line.invoice_line_tax_ids
+
     def _get_prezzo_unitario(self, line):
         res = line.price_unit
-        if (
-            line.invoice_line_tax_ids and
-            line.invoice_line_tax_ids[0].price_include
-        ):
-            res = line.price_unit / (
-                1 + (line.invoice_line_tax_ids[0].amount / 100))
+        taxes = self._get_line_taxes(line)
+        if taxes and taxes[0].price_include:
+            res = line.price_unit / (1 + (taxes[0].amount / 100))
         return res
 
     def setDettaglioLinee(self, invoice, body):
 
-        body.DatiBeniServizi = DatiBeniServiziType()
+        binding = get_binding_module()
+        body.DatiBeniServizi = binding.DatiBeniServiziType()
 
         line_no = 1
         price_precision = self.env['decimal.precision'].precision_get(
@@ -660,17 +819,20 @@ class WizardExportFatturapa(models.TransientModel):
     def setDettaglioLinea(
         self, line_no, line, body, price_precision, uom_precision
     ):
-        if not line.invoice_line_tax_ids:
+        binding = get_binding_module()
+        taxes = self._get_line_taxes(line)
+        if not taxes:
             raise UserError(
                 _("Invoice line %s does not have tax.") % line.name)
-        if len(line.invoice_line_tax_ids) > 1:
+        if len(taxes) > 1:
             raise UserError(
                 _("Too many taxes for invoice line %s.") % line.name)
-        aliquota = line.invoice_line_tax_ids[0].amount
+        aliquota = taxes[0].amount
         AliquotaIVA = '%.2f' % float_round(aliquota, 2)
-        line.ftpa_line_number = line_no
+        if not self.env.context.get('fatturapa_check_only'):
+            line.ftpa_line_number = line_no
         prezzo_unitario = self._get_prezzo_unitario(line)
-        DettaglioLinea = DettaglioLineeType(
+        DettaglioLinea = binding.DettaglioLineeType(
             NumeroLinea=str(line_no),
             Descrizione=encode_for_export(line.name, 1000),
             PrezzoUnitario='{prezzo:.{precision}f}'.format(
@@ -688,20 +850,17 @@ class WizardExportFatturapa(models.TransientModel):
         DettaglioLinea.ScontoMaggiorazione.extend(
             self.setScontoMaggiorazione(line))
         if aliquota == 0.0:
-            if not line.invoice_line_tax_ids[0].kind_id:
+            if not taxes[0].kind_id:
                 raise UserError(
-                    _("No 'nature' field for tax %s.") %
-                    line.invoice_line_tax_ids[0].name)
-            DettaglioLinea.Natura = line.invoice_line_tax_ids[
-                0
-            ].kind_id.code
-            if line.invoice_line_tax_ids[0].kind_id.code == 'N2.1' and \
+                    _("No 'nature' field for tax %s.") % taxes[0].name)
+            DettaglioLinea.Natura = taxes[0].kind_id.code
+            if taxes[0].kind_id.code == 'N2.1' and \
                     line.invoice_id.partner_id.country_id.code in [
                 'AT', 'BE', 'BG', 'CY', 'HR', 'DK', 'EE', 'FI', 'FR', 'DE', 'GR', 'IE',
                 'IT', 'LV', 'LT', 'LU', 'MT', 'NL', 'PL', 'PT', 'CZ', 'RO', 'SK', 'SI',
                 'ES', 'SE', 'HU'
             ]:
-                dati_gestionali = AltriDatiGestionaliType()
+                dati_gestionali = binding.AltriDatiGestionaliType()
                 dati_gestionali.TipoDato = 'INVCONT'
                 DettaglioLinea.AltriDatiGestionali.append(
                     dati_gestionali
@@ -711,15 +870,14 @@ class WizardExportFatturapa(models.TransientModel):
         if line.product_id:
             product_code = line.product_id.default_code
             if product_code:
-                CodiceArticolo = CodiceArticoloType(
-                    CodiceTipo=self.env['ir.config_parameter'].sudo(
-                    ).get_param('fatturapa.codicetipo.odoo', 'ODOO'),
+                CodiceArticolo = binding.CodiceArticoloType(
+                    CodiceTipo=self._get_codice_tipo(),
                     CodiceValore=product_code[:35],
                 )
                 DettaglioLinea.CodiceArticolo.append(CodiceArticolo)
             product_barcode = line.product_id.barcode
             if product_barcode:
-                CodiceArticolo = CodiceArticoloType(
+                CodiceArticolo = binding.CodiceArticoloType(
                     CodiceTipo='EAN',
                     CodiceValore=product_barcode[:35],
                 )
@@ -727,23 +885,32 @@ class WizardExportFatturapa(models.TransientModel):
         body.DatiBeniServizi.DettaglioLinee.append(DettaglioLinea)
         return DettaglioLinea
 
+    def _get_codice_tipo(self):
+        codice_tipo = self.env.context.get('fatturapa_codice_tipo')
+        if not codice_tipo:
+            codice_tipo = self.env['ir.config_parameter'].sudo().get_param(
+                'fatturapa.codicetipo.odoo', 'ODOO')
+        return codice_tipo
+
     def setScontoMaggiorazione(self, line):
+        binding = get_binding_module()
         res = []
         if line.discount:
-            res.append(ScontoMaggiorazioneType(
+            res.append(binding.ScontoMaggiorazioneType(
                 Tipo='SC',
                 Percentuale='%.2f' % float_round(line.discount, 8)
             ))
         return res
 
     def setDatiRiepilogo(self, invoice, body):
+        binding = get_binding_module()
         if not invoice.tax_line_ids:
             raise UserError(
                 _("Invoice {invoice} has no tax lines")
                 .format(invoice=invoice.display_name))
         for tax_line in invoice.tax_line_ids:
             tax = tax_line.tax_id
-            riepilogo = DatiRiepilogoType(
+            riepilogo = binding.DatiRiepilogoType(
                 AliquotaIVA='%.2f' % float_round(tax.amount, 2),
                 ImponibileImporto='%.2f' % float_round(tax_line.base, 2),
                 Imposta='%.2f' % float_round(tax_line.amount, 2)
@@ -770,11 +937,12 @@ class WizardExportFatturapa(models.TransientModel):
         return True
 
     def setDatiPagamento(self, invoice, body):
+        binding = get_binding_module()
         if invoice.payment_term_id:
             payment_line_ids = invoice.get_receivable_line_ids()
             if not payment_line_ids:
                 return True
-            DatiPagamento = DatiPagamentoType()
+            DatiPagamento = binding.DatiPagamentoType()
             if not invoice.payment_term_id.fatturapa_pt_id:
                 raise UserError(
                     _('Payment term %s does not have a linked e-invoice '
@@ -785,14 +953,13 @@ class WizardExportFatturapa(models.TransientModel):
                       'payment method.') % invoice.payment_term_id.name)
             DatiPagamento.CondizioniPagamento = (
                 invoice.payment_term_id.fatturapa_pt_id.code)
-            move_line_pool = self.env['account.move.line']
-            for move_line_id in payment_line_ids:
-                move_line = move_line_pool.browse(move_line_id)
+            move_lines = self.env['account.move.line'].browse(payment_line_ids)
+            for move_line in move_lines:
                 ImportoPagamento = '%.2f' % float_round(
                     move_line.amount_currency or
                     (move_line.debit - move_line.credit), 2)
                 # Create with only mandatory fields
-                DettaglioPagamento = DettaglioPagamentoType(
+                DettaglioPagamento = binding.DettaglioPagamentoType(
                     ModalitaPagamento=(
                         invoice.payment_term_id.fatturapa_pm_id.code),
                     ImportoPagamento=ImportoPagamento,
@@ -824,6 +991,7 @@ class WizardExportFatturapa(models.TransientModel):
         return True
 
     def setAttachments(self, invoice, body):
+        binding = get_binding_module()
         if invoice.fatturapa_doc_attachments:
             for doc_id in invoice.fatturapa_doc_attachments:
                 file_name, file_extension = os.path.splitext(doc_id.name)
@@ -834,7 +1002,7 @@ class WizardExportFatturapa(models.TransientModel):
                 # backslash so far
                 if '/' in attachment_name:
                     attachment_name = attachment_name.replace('/', '_')
-                AttachDoc = AllegatiType(
+                AttachDoc = binding.AllegatiType(
                     NomeAttachment=encode_for_export(attachment_name, 60),
                     Attachment=base64.decodestring(doc_id.datas)
                 )
@@ -842,8 +1010,9 @@ class WizardExportFatturapa(models.TransientModel):
         return True
 
     def setFatturaElettronicaHeader(self, company, partner, fatturapa):
+        binding = get_binding_module()
         fatturapa.FatturaElettronicaHeader = (
-            FatturaElettronicaHeaderType())
+            binding.FatturaElettronicaHeaderType())
         self.setDatiTrasmissione(company, partner, fatturapa)
         self.setCedentePrestatore(company, fatturapa)
         self.setRappresentanteFiscale(company, fatturapa)
@@ -908,21 +1077,51 @@ class WizardExportFatturapa(models.TransientModel):
         # max_invoice_in_xml field
         return res
 
+    def _prefetch_invoices(self, invoices):
+        """Read the data of `invoices` needed to build the XML files
+        with one query per model, instead of one per invoice"""
+        for path in INVOICE_PREFETCH_FIELDS:
+            invoices.mapped(path)
+        return invoices
+
+    def _prefetch_invoices_by_partner(self, invoices_by_partner):
+        # Translated fields are cached by language: read them in the
+        # language each invoice will be exported in
+        invoice_ids_by_lang = {}
+        for partner, invoice_groups in invoices_by_partner.items():
+            invoice_ids = invoice_ids_by_lang.setdefault(partner.lang, [])
+            for group in invoice_groups:
+                invoice_ids.extend(group)
+        invoice_model = self.env['account.invoice']
+        for lang, invoice_ids in invoice_ids_by_lang.items():
+            self._prefetch_invoices(
+                invoice_model.with_context(lang=lang).browse(invoice_ids))
+
+    def _newFatturaPA(self, partner):
+        binding = get_binding_module()
+        if partner.is_pa or partner.parent_id and partner.parent_id.is_pa:
+            versione = FORMATO_TRASMISSIONE_PA
+        else:
+            versione = FORMATO_TRASMISSIONE_PR
+        return binding.FatturaElettronica(
+            versione=versione, SistemaEmittente=SOFTWARE_IN_USE)
+
     def exportInvoiceXML(
             self, company, partner, invoice_ids, attach=False, context=None):
+        binding = get_binding_module()
         if context is None:
             context = {}
         invoice_obj = self.env['account.invoice']
-        if partner.is_pa or partner.parent_id and partner.parent_id.is_pa:
-            fatturapa = FatturaElettronica(versione=FORMATO_TRASMISSIONE_PA, SistemaEmittente=SOFTWARE_IN_USE)
-        else:
-            fatturapa = FatturaElettronica(versione=FORMATO_TRASMISSIONE_PR, SistemaEmittente=SOFTWARE_IN_USE)
+        # Invoices whose print has already been attached by the export
+        report_invoice_ids = self.env.context.get(
+            'fatturapa_report_invoice_ids', ())
+        fatturapa = self._newFatturaPA(partner)
 
+        wizard = self.with_context(
+            context, fatturapa_codice_tipo=self._get_codice_tipo())
         try:
-            self.with_context(context). \
-                setFatturaElettronicaHeader(company, partner, fatturapa)
-            for invoice_id in invoice_ids:
-                inv = invoice_obj.with_context(context).browse(invoice_id)
+            wizard.setFatturaElettronicaHeader(company, partner, fatturapa)
+            for inv in invoice_obj.with_context(context).browse(invoice_ids):
                 if inv.type not in ["out_invoice", "out_refund"]:
                     raise UserError(
                         _("Impossible to generate XML: not a customer invoice"))
@@ -934,14 +1133,11 @@ class WizardExportFatturapa(models.TransientModel):
 
                 _logger.info(f"Creating XML for invoice {inv.number} ...")
 
-                if self.report_print_menu:
+                if self.report_print_menu and inv.id not in report_invoice_ids:
                     self.generate_attach_report(inv)
-                invoice_body = FatturaElettronicaBodyType()
+                invoice_body = binding.FatturaElettronicaBodyType()
                 inv.preventive_checks()
-                self.with_context(
-                    context
-                ).setFatturaElettronicaBody(
-                    inv, invoice_body)
+                wizard.setFatturaElettronicaBody(inv, invoice_body)
                 fatturapa.FatturaElettronicaBody.append(invoice_body)
                 # TODO DatiVeicoli
 
@@ -954,7 +1150,23 @@ class WizardExportFatturapa(models.TransientModel):
         invoice_obj = self.env['account.invoice']
         attachments = self.env['fatturapa.attachment.out']
         invoices_by_partner = self.group_invoices_by_partner()
+        self._prefetch_invoices_by_partner(invoices_by_partner)
         company = self.env.user.company_id
+        # XML files serialized by a pool of processes at the end
+        pool_workers = self._get_export_workers(company)
+        pool_exports = []
+
+        # Print the invoices of the whole export together
+        report_invoices = invoice_obj.browse()
+        if self.report_print_menu and not self._context.get('simulation'):
+            report_invoices = invoice_obj.browse(
+                self._context['active_ids']).filtered(
+                    lambda inv: inv.type in ['out_invoice', 'out_refund']
+                    and not inv.fatturapa_attachment_out_id)
+            if report_invoices:
+                self.generate_attach_reports(report_invoices)
+        wizard = self.with_context(
+            fatturapa_report_invoice_ids=tuple(report_invoices.ids))
 
         count = 0
         t_count = len(self._context['active_ids'])
@@ -965,13 +1177,15 @@ class WizardExportFatturapa(models.TransientModel):
                 count += len(invoice_ids)
                 _logger.info(f"{count}/{t_count}")
                 try:
-                    fatturapa, number = self.exportInvoiceXML(
+                    fatturapa, number = wizard.exportInvoiceXML(
                         company, partner, invoice_ids, context=context_partner)
 
                     if self._context.get('simulation', False):
                         for invoice_id in invoice_ids:
                             inv = invoice_obj.browse(invoice_id)
                             inv.write({'simulation_data': 'Success'})
+                    elif pool_workers > 1:
+                        pool_exports.append((invoice_ids, fatturapa, number))
                     else:
                         attach = self.saveAttachment(fatturapa, number)
                         attachments |= attach
@@ -989,6 +1203,17 @@ class WizardExportFatturapa(models.TransientModel):
                     else:
                         raise e
 
+        if pool_exports:
+            attach_strs = self.serializeFatturaPAPool(
+                [fatturapa for dummy, fatturapa, dummy in pool_exports],
+                pool_workers)
+            for (invoice_ids, dummy, number), attach_str in zip(
+                    pool_exports, attach_strs):
+                attach = self.saveAttachmentXML(attach_str, number)
+                attachments |= attach
+                invoice_obj.browse(invoice_ids).write(
+                    {'fatturapa_attachment_out_id': attach.id})
+
         action = {
             'view_type': 'form',
             'name': "Export Electronic Invoice",
@@ -1003,6 +1228,67 @@ class WizardExportFatturapa(models.TransientModel):
             action['domain'] = [('id', 'in', attachments.ids)]
         return action
 
+    def checkInvoiceXML(self, company, partner, invoice):
+        """Build the XML of `invoice` and validate it against the XSD,
+        without writing on the invoice.
+        Return the error message, False if the XML is valid"""
+        binding = get_binding_module()
+        try:
+            if invoice.type not in ["out_invoice", "out_refund"]:
+                raise UserError(
+                    _("Impossible to generate XML: not a customer invoice"))
+            invoice.preventive_checks()
+            fatturapa = self._newFatturaPA(partner)
+            self.setFatturaElettronicaHeader(company, partner, fatturapa)
+            fatturapa.FatturaElettronicaHeader.DatiTrasmissione.\
+                ProgressivoInvio = CHECK_FILE_ID
+            invoice_body = binding.FatturaElettronicaBodyType()
+            self.setFatturaElettronicaBody(invoice, invoice_body)
+            fatturapa.FatturaElettronicaBody.append(invoice_body)
+            binding.CreateTreeFromBinding(fatturapa)
+        except etree.DocumentInvalid as e:
+            return '\n'.join(error.message for error in e.error_log)
+        except UserError as e:
+            return e.name
+        except psycopg2.Error:
+            raise
+        except Exception as e:
+            return str(e)
+        return False
+
+    def action_check_xml(self):
+        """Validate the XML of the selected invoices, without exporting
+        them and without writing on them"""
+        invoices_by_partner = self.group_invoices_by_partner()
+        self._prefetch_invoices_by_partner(invoices_by_partner)
+        company = self.env.user.company_id
+        codice_tipo = self._get_codice_tipo()
+
+        results = []
+        for partner in invoices_by_partner:
+            context_partner = self.env.context.copy()
+            context_partner.update({'lang': partner.lang})
+            partner_wizard = self.with_context(
+                context_partner, fatturapa_codice_tipo=codice_tipo,
+                fatturapa_check_only=True)
+            invoice_ids = list(itertools.chain.from_iterable(
+                invoices_by_partner[partner]))
+            invoices = self.env['account.invoice'].with_context(
+                context_partner).browse(invoice_ids)
+            for invoice in invoices:
+                results.append((invoice.id, partner_wizard.checkInvoiceXML(
+                    company, partner, invoice)))
+
+        checks = self.env['fatturapa.export.check'].create_checks(results)
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _("E-invoice XML check"),
+            'res_model': 'fatturapa.export.check',
+            'view_mode': 'tree',
+            'target': 'current',
+            'domain': [('id', 'in', checks.ids)],
+        }
+
     def action_simulate_xml(self):
         self.with_context(simulation=True).exportFatturaPA()
         return {
@@ -1015,30 +1301,60 @@ class WizardExportFatturapa(models.TransientModel):
             'domain': [('id', 'in', self._context['active_ids'])]
         }
 
-    def generate_attach_report(self, inv):
+    def _get_attach_report(self):
         binding_model_id = self.with_context(
             lang=None).report_print_menu.binding_model_id.id
         name = self.report_print_menu.name
-        report_model = self.env['ir.actions.report'].with_context(
+        return self.env['ir.actions.report'].with_context(
             lang=None
         ).search(
             [('binding_model_id', '=', binding_model_id),
              ('name', '=', name)]
         )
-        attachment, attachment_type = report_model.render_qweb_pdf(inv.ids)
-        att_id = self.env['ir.attachment'].create({
+
+    def _render_attach_reports(self, report_model, invoices):
+        """PDF of each invoice, by invoice id.
+        wkhtmltopdf renders them together when the output can be split"""
+        pdfs = {}
+        to_render = invoices
+        if report_model.attachment:
+            # The prints already saved would be merged out of order
+            to_render = invoices.filtered(
+                lambda inv: not report_model.retrieve_attachment(inv))
+        if len(to_render) > 1:
+            pdf_content, dummy = report_model.render_qweb_pdf(to_render.ids)
+            invoice_pdfs = split_pdf(pdf_content, len(to_render))
+            if invoice_pdfs:
+                pdfs.update(zip(to_render.ids, invoice_pdfs))
+            else:
+                _logger.info(
+                    "Printed invoices can't be split, "
+                    "printing them one by one")
+        for inv in invoices:
+            if inv.id not in pdfs:
+                pdfs[inv.id] = report_model.render_qweb_pdf(inv.ids)[0]
+        return pdfs
+
+    def generate_attach_reports(self, invoices):
+        report_model = self._get_attach_report()
+        pdfs = self._render_attach_reports(report_model, invoices)
+        attachments = self.env['ir.attachment'].create([{
             'name': inv.number,
             'type': 'binary',
-            'datas': base64.encodebytes(attachment),
+            'datas': base64.encodebytes(pdfs[inv.id]),
             'datas_fname': '{}.pdf'.format(inv.number),
             'res_model': 'account.invoice',
             'res_id': inv.id,
             'mimetype': 'application/x-pdf'
-            })
-        inv.write({
-            'fatturapa_doc_attachments': [(0, 0, {
-                'is_pdf_invoice_print': True,
-                'ir_attachment_id': att_id.id,
-                'description': _("Attachment generated by "
-                                 "electronic invoice export")})]
-        })
+            } for inv in invoices])
+        self.env['fatturapa.attachments'].create([{
+            'invoice_id': inv.id,
+            'is_pdf_invoice_print': True,
+            'ir_attachment_id': att.id,
+            'description': _("Attachment generated by "
+                             "electronic invoice export")
+            } for inv, att in zip(invoices, attachments)])
+        invoices.invalidate_cache(['fatturapa_doc_attachments'], invoices.ids)
+
+    def generate_attach_report(self, inv):
+        self.generate_attach_reports(inv)
@@ -2,13 +2,7 @@
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
 from odoo.tools.float_utils import float_round
-from odoo.addons.l10n_it_fatturapa.bindings.fatturapa import (
-    DatiDDTType,
-    DatiTrasportoType,
-    DatiAnagraficiVettoreType,
-    IdFiscaleType,
-    AnagraficaType
-)
+from odoo.addons.l10n_it_fatturapa.bindings import get_binding_module
 
 
 class WizardExportFatturapa(models.TransientModel):
@@ -38,9 +32,11 @@ class WizardExportFatturapa(models.TransientModel):
     )
 
     def setDatiDDT(self, invoice, body):
+        binding = get_binding_module()
         res = super(WizardExportFatturapa, self).setDatiDDT(
             invoice, body)
         if self.include_ddt_data == 'dati_ddt':
+            line_numbers = self._get_ftpa_line_numbers(invoice)
             inv_lines_by_ddt = {}
             for line in invoice.invoice_line_ids:
                 if (
@@ -54,9 +50,9 @@ class WizardExportFatturapa(models.TransientModel):
                     )
                     if key not in inv_lines_by_ddt:
                         inv_lines_by_ddt[key] = []
-                    inv_lines_by_ddt[key].append(line.ftpa_line_number)
+                    inv_lines_by_ddt[key].append(line_numbers[line.id])
             for key in sorted(inv_lines_by_ddt.keys()):
-                DatiDDT = DatiDDTType(
+                DatiDDT = binding.DatiDDTType(
                     NumeroDDT=key[0],
                     DataDDT=key[1]
                 )
@@ -64,7 +60,7 @@ class WizardExportFatturapa(models.TransientModel):
                     DatiDDT.RiferimentoNumeroLinea.append(line_number)
                 body.DatiGenerali.DatiDDT.append(DatiDDT)
         elif self.include_ddt_data == 'dati_trasporto':
-            body.DatiGenerali.DatiTrasporto = DatiTrasportoType(
+            body.DatiGenerali.DatiTrasporto = binding.DatiTrasportoType(
                 MezzoTrasporto=invoice.transportation_method_id.name or None,
                 CausaleTrasporto=invoice.transportation_reason_id.name or None,
                 NumeroColli=invoice.parcels or None,
@@ -78,16 +74,16 @@ class WizardExportFatturapa(models.TransientModel):
                     raise UserError(
                         _('TIN not set for %s.') % invoice.carrier_id.name)
                 body.DatiGenerali.DatiTrasporto.DatiAnagraficiVettore = (
-                    DatiAnagraficiVettoreType())
+                    binding.DatiAnagraficiVettoreType())
                 if invoice.carrier_id.fiscalcode:
                     body.DatiGenerali.DatiTrasporto.DatiAnagraficiVettore.\
                         CodiceFiscale = invoice.carrier_id.fiscalcode
                 body.DatiGenerali.DatiTrasporto.DatiAnagraficiVettore.\
-                    IdFiscaleIVA = IdFiscaleType(
+                    IdFiscaleIVA = binding.IdFiscaleType(
                         IdPaese=invoice.carrier_id.vat[0:2],
                         IdCodice=invoice.carrier_id.vat[2:]
                     )
                 body.DatiGenerali.DatiTrasporto.DatiAnagraficiVettore.\
-                    Anagrafica = AnagraficaType(
+                    Anagrafica = binding.AnagraficaType(
                         Denominazione=invoice.carrier_id.name)
         return res
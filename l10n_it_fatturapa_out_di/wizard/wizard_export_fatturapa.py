@@ -3,22 +3,19 @@
 
 from odoo import models
 from odoo.addons.l10n_it_account.tools.account_tools import encode_for_export
-from odoo.addons.l10n_it_fatturapa.bindings.fatturapa import (
-    DatiRiepilogoType,
-    DettaglioLineeType,
-    AltriDatiGestionaliType,
-)
+from odoo.addons.l10n_it_fatturapa.bindings import get_binding_module
 
 
 class WizardExportFatturapa(models.TransientModel):
     _inherit = "wizard.export.fatturapa"
 
     def setDettaglioLinea(self, line_no, line, body, price_precision, uom_precision):
+        binding = get_binding_module()
         DettaglioLinea = super().setDettaglioLinea(
             line_no, line, body, price_precision, uom_precision)
 
         if line.force_dichiarazione_intento_id:
-            dati_gestionali = AltriDatiGestionaliType(
+            dati_gestionali = binding.AltriDatiGestionaliType(
                 TipoDato="INTENTO",
                 RiferimentoTesto=encode_for_export(
                     line.force_dichiarazione_intento_id.telematic_protocol, 60),
@@ -28,6 +25,7 @@ class WizardExportFatturapa(models.TransientModel):
         return DettaglioLinea
 
     def setDettaglioLinee(self, invoice, body):
+        binding = get_binding_module()
         super().setDettaglioLinee(invoice, body)
 
         force_dichiarazione_intento_ids = invoice.dichiarazione_intento_ids.browse()
@@ -39,7 +37,7 @@ class WizardExportFatturapa(models.TransientModel):
         to_add = invoice.dichiarazione_intento_ids - force_dichiarazione_intento_ids
         if not to_add:
             return
-        DettaglioLinea = DettaglioLineeType(
+        DettaglioLinea = binding.DettaglioLineeType(
             NumeroLinea=str(line_no),
             Descrizione=encode_for_export("Altre lettere d'intento", 1000),
             PrezzoUnitario="0.00",
@@ -48,7 +46,7 @@ class WizardExportFatturapa(models.TransientModel):
             Natura="N1",
         )
         for dec in to_add:
-            dati_gestionali = AltriDatiGestionaliType(
+            dati_gestionali = binding.AltriDatiGestionaliType(
                 TipoDato="INTENTO",
                 RiferimentoTesto=encode_for_export(dec.telematic_protocol, 60),
                 RiferimentoData=dec.date
@@ -57,6 +55,7 @@ class WizardExportFatturapa(models.TransientModel):
         body.DatiBeniServizi.DettaglioLinee.append(DettaglioLinea)
 
     def setDatiRiepilogo(self, invoice, body):
+        binding = get_binding_module()
         super().setDatiRiepilogo(invoice, body)
 
         force_dichiarazione_intento_ids = invoice.dichiarazione_intento_ids.browse()
@@ -67,7 +66,7 @@ class WizardExportFatturapa(models.TransientModel):
         if not to_add:
             return
 
-        riepilogo = DatiRiepilogoType(
+        riepilogo = binding.DatiRiepilogoType(
             AliquotaIVA="0.00",
             ImponibileImporto="0.00",
             Imposta="0.00",
@@ -5,10 +5,7 @@ from odoo import api, fields, models
 from odoo.tools.translate import _
 import logging
 import base64
-from odoo.addons.l10n_it_fatturapa.bindings.fatturapa import (
-    ContattiType,
-    ContattiTrasmittenteType
-)
+from odoo.addons.l10n_it_fatturapa.bindings import get_binding_module
 from odoo.exceptions import UserError
 from odoo.addons.l10n_it_fatturapa_out.wizard.wizard_export_fatturapa import fatturapaBDS
 _logger = logging.getLogger(__name__)
@@ -45,6 +42,7 @@ class WizardExportFatturapa(models.TransientModel):
             return ''
 
     def _setContattiTrasmittente(self, company, fatturapa):
+        binding = get_binding_module()
         if not company.phone:
             raise UserError(
                 _('Company Telephone number not set.'))
@@ -54,13 +52,14 @@ class WizardExportFatturapa(models.TransientModel):
                 _('Company Email not set.'))
         Email = company.email
         fatturapa.FatturaElettronicaHeader.DatiTrasmissione.\
-            ContattiTrasmittente = ContattiTrasmittenteType(
+            ContattiTrasmittente = binding.ContattiTrasmittenteType(
                 Telefono=Telefono or None, Email=Email or None)
 
         return True
 
     def _setContatti(self, CedentePrestatore, company):
-        CedentePrestatore.Contatti = ContattiType(
+        binding = get_binding_module()
+        CedentePrestatore.Contatti = binding.ContattiType(
             Telefono=self._wep_phone_number(company.partner_id.phone) or None,
             Email=company.partner_id.email or None
         )
@@ -70,21 +69,22 @@ class WizardExportFatturapa(models.TransientModel):
     ):
         """
         Extension checks quantity and unit price
-        and updates the values correctly
+        and exports the values correctly
         Odoo standard balance invoice set quantity as negative
         and unit price as positive in down payment line
         SDI doesn't allow these values
         """
+        DettaglioLinea = super().setDettaglioLinea(
+            line_no, line, body, price_precision, uom_precision)
 
         # patch
         # down payment
         # if quantity is negative (odoo standard invoice balance)
         # and unit price is positive
         if line.quantity < 0 < line.price_unit:
-            # set quantity as positive
-            line.quantity = line.quantity * -1
-            # and set negative the unit price
-            line.price_unit = line.price_unit * -1
+            # export quantity as positive
+            DettaglioLinea.Quantita = -DettaglioLinea.Quantita
+            # and unit price as negative
+            DettaglioLinea.PrezzoUnitario = -DettaglioLinea.PrezzoUnitario
 
-        return super().setDettaglioLinea(line_no, line, body,
-                                         price_precision, uom_precision)
+        return DettaglioLinea
@@ -1,19 +1,14 @@
 from odoo import models, _
 from odoo.exceptions import UserError
 from odoo.addons.l10n_it_account.tools.account_tools import encode_for_export
-from odoo.addons.l10n_it_fatturapa.bindings.fatturapa import (
-    IdFiscaleType,
-    AnagraficaType,
-    CessionarioCommittenteType,
-    DatiTrasmissioneType,
-    IndirizzoType,
-)
+from odoo.addons.l10n_it_fatturapa.bindings import get_binding_module
 
 
 class WizardExportFatturapa(models.TransientModel):
     _inherit = "wizard.export.fatturapa"
 
     def _setIdTrasmittente_rc(self, partner, fatturapa):
+        binding = get_binding_module()
         if not partner.country_id:
             raise UserError(_("Partner %s, Country not set.") % partner.display_name)
         IdPaese = partner.country_id.code
@@ -24,23 +19,26 @@ class WizardExportFatturapa(models.TransientModel):
         if not IdCodice:
             IdCodice = "%s99999999999" % IdPaese
         fatturapa.FatturaElettronicaHeader.DatiTrasmissione.IdTrasmittente = (
-            IdFiscaleType(IdPaese=IdPaese, IdCodice=IdCodice)
+            binding.IdFiscaleType(IdPaese=IdPaese, IdCodice=IdCodice)
         )
         return True
 
     def setDatiTrasmissione(self, company, partner, fatturapa):
+        binding = get_binding_module()
         super(WizardExportFatturapa, self).setDatiTrasmissione(
             company, partner, fatturapa
         )
         if self.env.context.get("company_partner"):
             company, partner = partner, company.partner_id
-            fatturapa.FatturaElettronicaHeader.DatiTrasmissione = DatiTrasmissioneType()
+            fatturapa.FatturaElettronicaHeader.DatiTrasmissione = (
+                binding.DatiTrasmissioneType())
             self._setIdTrasmittente_rc(company, fatturapa)
             self._setFormatoTrasmissione(partner, fatturapa)
             self._setCodiceDestinatario(partner, fatturapa)
             # self._setContattiTrasmittente(company, fatturapa)
 
     def _setDatiAnagraficiCedente(self, CedentePrestatore, company):
+        binding = get_binding_module()
         res = super(WizardExportFatturapa, self)._setDatiAnagraficiCedente(
             CedentePrestatore, company
         )
@@ -71,23 +69,24 @@ class WizardExportFatturapa(models.TransientModel):
                             "%s" % partner.vat[0:2]
                         )
                     )
-                CedentePrestatore.DatiAnagrafici.IdFiscaleIVA = IdFiscaleType(
+                CedentePrestatore.DatiAnagrafici.IdFiscaleIVA = binding.IdFiscaleType(
                     IdPaese=partner.vat[0:2], IdCodice=partner.vat[2:]
                 )
             elif partner.country_id.code and partner.country_id.code != "IT":
-                CedentePrestatore.DatiAnagrafici.IdFiscaleIVA = IdFiscaleType(
+                CedentePrestatore.DatiAnagrafici.IdFiscaleIVA = binding.IdFiscaleType(
                     IdPaese=partner.country_id.code, IdCodice="99999999999"
                 )
             else:
                 raise UserError(
                     _("Impossible to set IdFiscaleIVA for %s") % partner.display_name
                 )
-            CedentePrestatore.DatiAnagrafici.Anagrafica = AnagraficaType(
+            CedentePrestatore.DatiAnagrafici.Anagrafica = binding.AnagraficaType(
                 Denominazione=partner.name
             )
         return res
 
     def _setSedeCedente(self, CedentePrestatore, company):
+        binding = get_binding_module()
         res = super(WizardExportFatturapa, self)._setSedeCedente(
             CedentePrestatore, company
         )
@@ -106,7 +105,7 @@ class WizardExportFatturapa(models.TransientModel):
                     _("Partner %s, Country is not set.") % partner.display_name
                 )
             if partner.codice_destinatario == "XXXXXXX":
-                CedentePrestatore.Sede = IndirizzoType(
+                CedentePrestatore.Sede = binding.IndirizzoType(
                     Indirizzo=encode_for_export(partner.street, 60),
                     CAP="00000",
                     Comune=encode_for_export(partner.city, 60),
@@ -118,7 +117,7 @@ class WizardExportFatturapa(models.TransientModel):
                     raise UserError(
                         _("Partner %s, ZIP is not set.") % partner.display_name
                     )
-                CedentePrestatore.Sede = IndirizzoType(
+                CedentePrestatore.Sede = binding.IndirizzoType(
                     Indirizzo=encode_for_export(partner.street, 60),
                     CAP=partner.zip,
                     Comune=encode_for_export(partner.city, 60),
@@ -159,30 +158,38 @@ class WizardExportFatturapa(models.TransientModel):
         return res
 
     def setCessionarioCommittente(self, partner, fatturapa):
+        binding = get_binding_module()
         super(WizardExportFatturapa, self).setCessionarioCommittente(partner, fatturapa)
         if self.env.context.get("company_partner"):
             partner = self.env.context["company_partner"]
             fatturapa.FatturaElettronicaHeader.CessionarioCommittente = (
-                CessionarioCommittenteType()
+                binding.CessionarioCommittenteType()
             )
             self._setDatiAnagraficiCessionario(partner, fatturapa)
             self._setSedeCessionario(partner, fatturapa)
 
+    def _get_fiscal_document_type(self, invoice):
+        """Fiscal document type of `invoice`, the one of the reverse charge
+        fiscal position of its purchase invoice when it is not set"""
+        fiscal_position = invoice.rc_purchase_invoice_id.fiscal_position_id
+        if (not invoice.fiscal_document_type_id
+                and fiscal_position.rc_fiscal_document_type_id):
+            return fiscal_position.rc_fiscal_document_type_id
+        return invoice.fiscal_document_type_id
+
     def setDatiGeneraliDocumento(self, invoice, body):
         res = super(WizardExportFatturapa, self).setDatiGeneraliDocumento(invoice, body)
-        if (not invoice.fiscal_document_type_id
-            and invoice.rc_purchase_invoice_id
-            and invoice.rc_purchase_invoice_id.fiscal_position_id
-            and invoice.rc_purchase_invoice_id.fiscal_position_id.rc_fiscal_document_type_id
-        ):
-            invoice.fiscal_document_type_id = invoice.rc_purchase_invoice_id.fiscal_position_id.rc_fiscal_document_type_id
+        fiscal_document_type = self._get_fiscal_document_type(invoice)
+        if (fiscal_document_type != invoice.fiscal_document_type_id
+                and not self.env.context.get("fatturapa_check_only")):
+            invoice.fiscal_document_type_id = fiscal_document_type
         body.DatiGenerali.DatiGeneraliDocumento.TipoDocumento = (
-            invoice.fiscal_document_type_id.code
+            fiscal_document_type.code
         )
         if invoice.type in [
             "out_refund",
             "in_refund",
-        ] and invoice.fiscal_document_type_id.code not in ["TD04", "TD08"]:
+        ] and fiscal_document_type.code not in ["TD04", "TD08"]:
             body.DatiGenerali.DatiGeneraliDocumento.ImportoTotaleDocumento = (
                 -body.DatiGenerali.DatiGeneraliDocumento.ImportoTotaleDocumento
             )
@@ -192,31 +199,34 @@ class WizardExportFatturapa(models.TransientModel):
         DettaglioLinea = super(WizardExportFatturapa, self).setDettaglioLinea(
             line_no, line, body, price_precision, uom_precision
         )
+        fiscal_document_type = self._get_fiscal_document_type(line.invoice_id)
         if line.invoice_id.type in [
             "out_refund",
             "in_refund",
-        ] and line.invoice_id.fiscal_document_type_id.code not in ["TD04", "TD08"]:
+        ] and fiscal_document_type.code not in ["TD04", "TD08"]:
             DettaglioLinea.PrezzoUnitario = -DettaglioLinea.PrezzoUnitario
             DettaglioLinea.PrezzoTotale = -DettaglioLinea.PrezzoTotale
         return DettaglioLinea
 
     def setDatiRiepilogo(self, invoice, body):
         super(WizardExportFatturapa, self).setDatiRiepilogo(invoice, body)
+        fiscal_document_type = self._get_fiscal_document_type(invoice)
         for DatiRiepilogo in body.DatiBeniServizi.DatiRiepilogo:
             if invoice.type in [
                 "out_refund",
                 "in_refund",
-            ] and invoice.fiscal_document_type_id.code not in ["TD04", "TD08"]:
+            ] and fiscal_document_type.code not in ["TD04", "TD08"]:
                 DatiRiepilogo.ImponibileImporto = -DatiRiepilogo.ImponibileImporto
                 DatiRiepilogo.Imposta = -DatiRiepilogo.Imposta
         return True
 
     def setDatiPagamento(self, invoice, body):
         super(WizardExportFatturapa, self).setDatiPagamento(invoice, body)
+        fiscal_document_type = self._get_fiscal_document_type(invoice)
         for DatiPagamento in body.DatiPagamento:
             if (
                 invoice.type in ["out_refund", "in_refund"]
-                and invoice.fiscal_document_type_id.code not in ["TD04", "TD08"]
+                and fiscal_document_type.code not in ["TD04", "TD08"]
                 and DatiPagamento.ImportoPagamento
             ):
                 DatiPagamento.ImportoPagamento = -DatiPagamento.ImportoPagamento
@@ -2,19 +2,18 @@
 
 from odoo import models
 from odoo.tools.float_utils import float_round, float_is_zero
-from odoo.addons.l10n_it_fatturapa.bindings.fatturapa import (
-    DatiBolloType
-)
+from odoo.addons.l10n_it_fatturapa.bindings import get_binding_module
 
 
 class WizardExportFatturapa(models.TransientModel):
     _inherit = "wizard.export.fatturapa"
 
     def setDatiGeneraliDocumento(self, invoice, body):
+        binding = get_binding_module()
         res = super(WizardExportFatturapa, self).setDatiGeneraliDocumento(
             invoice, body)
         if invoice.tax_stamp:
-            body.DatiGenerali.DatiGeneraliDocumento.DatiBollo = DatiBolloType(
+            body.DatiGenerali.DatiGeneraliDocumento.DatiBollo = binding.DatiBolloType(
                 BolloVirtuale="SI")
             if invoice.company_id.tax_stamp_product_id:
                 stamp_price = invoice.company_id.tax_stamp_product_id.list_price
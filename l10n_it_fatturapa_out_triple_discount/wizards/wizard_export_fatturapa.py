@@ -3,9 +3,7 @@
 
 from odoo import models
 from odoo.tools.float_utils import float_round
-from odoo.addons.l10n_it_fatturapa.bindings.fatturapa import (
-    ScontoMaggiorazioneType
-)
+from odoo.addons.l10n_it_fatturapa.bindings import get_binding_module
 
 
 class WizardExportFatturapa(models.TransientModel):
@@ -13,19 +11,20 @@ class WizardExportFatturapa(models.TransientModel):
 
     def setDettaglioLinea(
             self, line_no, line, body, price_precision, uom_precision):
+        binding = get_binding_module()
         res = super(WizardExportFatturapa, self).setDettaglioLinea(
             line_no, line, body, price_precision, uom_precision)
         if line.discount2 or line.discount3:
             DettaglioLinea = body.DatiBeniServizi.DettaglioLinee[-1]
             if line.discount2:
                 DettaglioLinea.ScontoMaggiorazione.append(
-                    ScontoMaggiorazioneType(
+                    binding.ScontoMaggiorazioneType(
                         Tipo='SC',
                         Percentuale='%.2f' % float_round(line.discount2, 8)
                     ))
             if line.discount3:
                 DettaglioLinea.ScontoMaggiorazione.append(
-                    ScontoMaggiorazioneType(
+                    binding.ScontoMaggiorazioneType(
                         Tipo='SC',
                         Percentuale='%.2f' % float_round(line.discount3, 8)
                     ))
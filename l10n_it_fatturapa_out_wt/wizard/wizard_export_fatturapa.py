@@ -3,11 +3,7 @@ from odoo import models
 from odoo.tools.translate import _
 from odoo.exceptions import Warning as UserError
 from odoo.tools.float_utils import float_round
-from odoo.addons.l10n_it_fatturapa.bindings.fatturapa import (
-    DatiRitenutaType,
-    DatiCassaPrevidenzialeType,
-    DatiRiepilogoType
-)
+from odoo.addons.l10n_it_fatturapa.bindings import get_binding_module
 
 WT_TAX_CODE = {
     'inps': 'RT03',
@@ -37,6 +33,7 @@ class WizardExportFatturapa(models.TransientModel):
         return tipoRitenuta
 
     def setDatiGeneraliDocumento(self, invoice, body):
+        binding = get_binding_module()
         res = super(WizardExportFatturapa, self).setDatiGeneraliDocumento(
             invoice, body)
         # Get consistent ordering for file generation for compare with test XML
@@ -52,7 +49,7 @@ class WizardExportFatturapa(models.TransientModel):
                 invoice.partner_id
                 )
             body.DatiGenerali.DatiGeneraliDocumento.DatiRitenuta.append(
-                DatiRitenutaType(
+                binding.DatiRitenutaType(
                     TipoRitenuta=tipoRitenuta,
                     ImportoRitenuta='%.2f' % float_round(wt_line.tax, 2),
                     AliquotaRitenuta='%.2f' % float_round(
@@ -65,7 +62,7 @@ class WizardExportFatturapa(models.TransientModel):
                 tax_kind = tax_id.kind_id.code
                 body.DatiGenerali.DatiGeneraliDocumento.\
                     DatiCassaPrevidenziale.append(
-                        DatiCassaPrevidenzialeType(
+                        binding.DatiCassaPrevidenzialeType(
                             TipoCassa=TC_CODE[wt_line.withholding_tax_id.wt_types],
                             AlCassa='%.2f' % float_round(
                                 wt_line.withholding_tax_id.tax, 2),
@@ -84,6 +81,7 @@ class WizardExportFatturapa(models.TransientModel):
                 return riepilogo
 
     def setDatiRiepilogo(self, invoice, body):
+        binding = get_binding_module()
         res = super(WizardExportFatturapa, self).setDatiRiepilogo(
             invoice, body)
         wt_lines_to_write = invoice.withholding_tax_line_ids.filtered(
@@ -99,7 +97,7 @@ class WizardExportFatturapa(models.TransientModel):
                 tax_riepilogo.ImponibileImporto = '%.2f' % float_round(
                     base_amount, 2)
             else:
-                riepilogo = DatiRiepilogoType(
+                riepilogo = binding.DatiRiepilogoType(
                     AliquotaIVA='0.00',
                     ImponibileImporto='%.2f' % float_round(wt_line.tax, 2),
                     Imposta='0.00',
@@ -91,6 +91,12 @@ class TestEInvoiceResponse(EInvoiceCommon):
             'POSTA CERTIFICATA: Invio File 7339338.txt')
 
         e_invoices = self.attach_in_model.search([])
+        # receiving a file does not create its supplier
+        supplier = self.env['res.partner'].create({
+            'name': 'Supplier',
+            'vat': 'IT02652600210',
+            'supplier': True,
+        })
 
         msg_dict = self.env['mail.thread'] \
             .message_parse(message=incoming_mail)
@@ -105,8 +111,7 @@ class TestEInvoiceResponse(EInvoiceCommon):
         self.assertEqual(
             Datetime.from_string(e_invoices.e_invoice_received_date),
             Datetime.from_string(msg_dict['date']))
-        self.assertEqual(e_invoices.xml_supplier_id.vat,
-                         'IT02652600210')
+        self.assertEqual(e_invoices.xml_supplier_id, supplier)
 
     def test_process_response_INVIO_broken_XML(self):
         """Receiving a 'Invio File' with a broken XML sends an email
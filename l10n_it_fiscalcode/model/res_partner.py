@@ -25,7 +25,7 @@ class ResPartner(models.Model):
         return True
 
     fiscalcode = fields.Char(
-        'Fiscal Code', size=16, help="Italian Fiscal Code")
+        'Fiscal Code', size=16, index=True, help="Italian Fiscal Code")
 
     _constraints = [
         (check_fiscalcode,